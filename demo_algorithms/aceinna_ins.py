@@ -161,6 +161,8 @@ class DMU380Sim(object):
         self.input = ['fs', 'gyro', 'accel', 'gps', 'gps_visibility', 'time', 'gps_time', 'odo']
         self.output = ['algo_time', 'pos', 'vel', 'att_euler', 'wb', 'ab']
         self.batch = True
+        # shared libraries loaded by ctypes cannot be copied to worker processes
+        self.parallel_safe = False
         self.results = None
         # algorithm vars
         this_dir = os.path.dirname(__file__)
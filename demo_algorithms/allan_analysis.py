@@ -16,10 +16,18 @@ class Allan(object):
     '''
     Allan var. A demo algorithm for Sim
     '''
-    def __init__(self):
+    def __init__(self, chunk_size=None, max_tau=None):
         '''
         algorithm description
+        Args:
+            chunk_size: None to process all data at a time. Otherwise, data are processed in
+                chunks of chunk_size samples with bounded memory, which is suitable for long
+                recordings, for example memory-mapped data files.
+            max_tau: max tau in seconds when chunk_size is not None. Memory use grows with it.
+                None means no limit.
         '''
+        self.chunk_size = chunk_size
+        self.max_tau = max_tau
         self.input = ['fs', 'accel', 'gyro']
         self.output = ['algo_time', 'ad_accel', 'ad_gyro']
         self.batch = True   # Put all data from t0 to tf if True (default)
@@ -36,17 +44,19 @@ class Allan(object):
         fs = set_of_input[0]
         accel = set_of_input[1]
         gyro = set_of_input[2]
-        # calculate
-        avar_ax, tau = allan.allan_var(accel[:, 0], fs)
-        avar_ay = allan.allan_var(accel[:, 1], fs)[0]
-        avar_az = allan.allan_var(accel[:, 2], fs)[0]
-        avar_wx = allan.allan_var(gyro[:, 0], fs)[0]
-        avar_wy = allan.allan_var(gyro[:, 1], fs)[0]
-        avar_wz = allan.allan_var(gyro[:, 2], fs)[0]
+        # calculate overlapping Allan deviation of all axes at a time
+        if self.chunk_size is None:
+            adev, tau = allan.allan_dev(np.hstack([accel, gyro]), fs)[0:2]
+        else:
+            n = accel.shape[0]
+            tau = allan.tau_grid(n) / fs
+            if self.max_tau is not None:
+                tau = tau[tau <= self.max_tau]
+            chunks = (np.hstack([accel[i:i+self.chunk_size], gyro[i:i+self.chunk_size]])\
+                      for i in range(0, n, self.chunk_size))
+            adev, tau = allan.allan_dev_chunks(chunks, fs, tau)[0:2]
         # generate results, must be a tuple or list consistent with self.output
-        self.results = [tau,\
-                        np.sqrt(np.array([avar_ax, avar_ay, avar_az]).T),\
-                        np.sqrt(np.array([avar_wx, avar_wy, avar_wz]).T)]
+        self.results = [tau, adev[:, 0:3], adev[:, 3:6]]
 
     def get_results(self):
         '''
@@ -161,3 +161,5 @@ class MahonyFilter(object):
         Reset the fusion process to uninitialized state.
         '''
         self.ini = 0
+        self.gyro_bias = np.array([0.0, 0.0, 0.0])
+        self.tmp = np.array([0.0, 0.0, 0.0])
@@ -34,6 +34,8 @@ class MagCal(object):
         self.input = ['mag']
         self.output = ['soft_iron', 'hard_iron', 'mag_cal']
         self.batch = True
+        # shared libraries loaded by ctypes cannot be copied to worker processes
+        self.parallel_safe = False
         self.results = None
         # algorithm vars
         this_dir = os.path.dirname(__file__)
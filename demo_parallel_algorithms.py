@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Filename: demo_parallel_algorithms.py
+
+"""
+Check that algorithms run in worker processes give the same results as in this process.
+A free integration algorithm is given a different set of initial states for each simulation run.
+The simulation is run with one worker and with several workers, and the results of each run
+should be the same.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+import os
+import math
+import numpy as np
+from gnss_ins_sim.sim import imu_model
+from gnss_ins_sim.sim import ins_sim
+
+# globals
+D2R = math.pi/180
+
+motion_def_path = os.path.abspath('.//demo_motion_def_files//')
+fs = 100.0          # IMU sample frequency
+num_runs = 3        # number of simulation runs, each with its own set of initial states
+
+def run_sim(workers):
+    '''
+    Run the simulation with the given number of workers.
+    '''
+    from demo_algorithms import free_integration
+    from demo_algorithms import free_integration_odo
+    imu = imu_model.IMU(accuracy='low-accuracy', axis=6, gps=False, odo=True)
+    ini_pos_vel_att = np.genfromtxt(motion_def_path+"//motion_def-90deg_turn.csv",\
+                                    delimiter=',', skip_header=1, max_rows=1)
+    ini_pos_vel_att[0] = ini_pos_vel_att[0] * D2R
+    ini_pos_vel_att[1] = ini_pos_vel_att[1] * D2R
+    ini_pos_vel_att[6:9] = ini_pos_vel_att[6:9] * D2R
+    # a different initial velocity error for each run
+    ini_pos_vel_att = np.tile(ini_pos_vel_att.reshape((9, 1)), (1, num_runs))
+    ini_pos_vel_att[3, :] += np.arange(num_runs)
+    algo1 = free_integration.FreeIntegration(ini_pos_vel_att)
+    algo2 = free_integration_odo.FreeIntegration(ini_pos_vel_att)
+    sim = ins_sim.Sim([fs, 0.0, 0.0],
+                      motion_def_path+"//motion_def-90deg_turn.csv",
+                      ref_frame=0,
+                      imu=imu,
+                      mode=None,
+                      env=None,
+                      algorithm=[algo1, algo2],
+                      seed=1)
+    sim.run(num_runs, workers=workers)
+    return sim.dmgr.get_data(['pos'])[0]
+
+def test_parallel_algorithms():
+    '''
+    Compare results of the algorithms run with one worker and with several workers.
+    '''
+    serial = run_sim(1)
+    parallel = run_sim(num_runs)
+    ok = sorted(serial.keys()) == sorted(parallel.keys())
+    for key in sorted(serial.keys()):
+        diff = np.max(np.abs(serial[key] - parallel[key])) if key in parallel else math.inf
+        ok = ok and diff == 0.0
+        print('%-10s max position difference %s' % (key, diff))
+    if not ok:
+        raise ValueError('Results with several workers are different from one worker.')
+    print('PASS')
+
+if __name__ == '__main__':
+    test_parallel_algorithms()
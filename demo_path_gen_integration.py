@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Filename: demo_path_gen_integration.py
+
+"""
+Benchmark of the integration schemes of path_gen.
+Reference trajectories are generated with different integration schemes and simulation over
+sample ratios. The position error of each trajectory is evaluated against the exact integral of
+the same motion, which is obtained by integrating the motion states with RK4 on a finer grid.
+Accuracy against runtime is printed and plotted.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+import os
+import math
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from gnss_ins_sim.geoparams import geoparams
+from gnss_ins_sim.pathgen import pathgen_vec
+from gnss_ins_sim.sim import ins_sim
+
+# globals
+D2R = math.pi/180
+
+motion_def_path = os.path.abspath('.//demo_motion_def_files//')
+fs = 100.0          # IMU sample frequency
+ref_frame = 0       # NED
+substeps = 4        # substeps of each simulation step to get the exact position
+# [integration scheme, simulation over sample ratio]
+configs = [['euler', 1], ['euler', 2], ['euler', 4], ['euler', 8], ['euler', 16],
+           ['rk4', 1], ['rk4', 2]]
+
+def load_motion_def(file_name):
+    '''
+    Load initial states and motion commands from a motion definition file.
+    '''
+    ini_pos_vel_att = np.genfromtxt(file_name, delimiter=',', skip_header=1, max_rows=1)
+    ini_pos_vel_att[0] = ini_pos_vel_att[0] * D2R
+    ini_pos_vel_att[1] = ini_pos_vel_att[1] * D2R
+    ini_pos_vel_att[6:9] = ini_pos_vel_att[6:9] * D2R
+    motion_def = np.genfromtxt(file_name, delimiter=',', skip_header=3)
+    if motion_def.ndim == 1:
+        motion_def = np.array([motion_def])
+    return ini_pos_vel_att, motion_def
+
+def exact_pos(ini_pos_vel_att, motion_def, mobility, dt):
+    '''
+    Position at each simulation step obtained by integrating the motion states with RK4 on a
+    grid that is substeps times finer. The Euler angle change rate and the velocity change rate
+    are constant within each simulation step, so states at the substeps are exact.
+    Args:
+        motion_def: motion_def already converted by path_gen.
+    Returns:
+        nx3 position at each simulation step.
+    '''
+    pos_n = ini_pos_vel_att[0:3]
+    g = geoparams.geo_param(pos_n)[2]
+    if ref_frame == 1:
+        pos_n = geoparams.lla2ecef(pos_n)
+    pos_delta_n = np.zeros(3)
+    tau = np.arange(substeps) * (dt/substeps)
+    pos = []
+    for states in pathgen_vec.gen_motion_states_iter(ini_pos_vel_att, motion_def, mobility,
+                                                     dt, 100000):
+        # states at substeps
+        fine = []
+        for i, i_dot in [['att', 'att_dot'], ['vel_b', 'vel_dot_b']]:
+            x = states[i][:, np.newaxis, :] +\
+                tau[np.newaxis, :, np.newaxis] * states[i_dot][:, np.newaxis, :]
+            fine.append(x.reshape((-1, 3)))
+        for i in ['att_dot', 'vel_dot_b']:
+            fine.append(np.repeat(states[i], substeps, 0))
+        pos_delta = pathgen_vec.integrate_states(pos_n, pos_delta_n, fine[0], fine[1], fine[2],
+                                                 fine[3], dt/substeps, ref_frame, g, 'rk4')[2]
+        pos.append(pos_n + pos_delta[0:-1:substeps])
+        pos_delta_n = pos_delta[-1]
+    return np.vstack(pos)
+
+def pos_error(pos, pos_ref):
+    '''
+    Max position error, m.
+    '''
+    err = pos - pos_ref
+    if ref_frame == 0:
+        rm, rn, _, _, cl = geoparams.geo_param_batch(pos_ref)[0:5]
+        err[:, 0] = err[:, 0] * (rm + pos_ref[:, 2])
+        err[:, 1] = err[:, 1] * (rn + pos_ref[:, 2]) * cl
+    return np.max(np.sqrt(np.sum(err*err, 1)))
+
+def test_integration(file_name):
+    '''
+    Accuracy against runtime of the integration schemes for a motion definition file.
+    '''
+    ini_pos_vel_att, motion_def = load_motion_def(file_name)
+    mobility = ins_sim.high_mobility
+    results = []
+    print(os.path.basename(file_name))
+    print('%8s %5s %10s %14s' % ('scheme', 'osr', 'runtime/s', 'pos error/m'))
+    for integration, osr in configs:
+        output_def = np.array([[osr, fs], [1.0, fs], [1.0, fs]])
+        runtime = float('inf')
+        for _ in range(3):
+            md = motion_def.copy()
+            od = output_def.copy()
+            t = time.time()
+            rtn = pathgen_vec.path_gen_vec(ini_pos_vel_att, md, od, mobility, ref_frame,
+                                           integration=integration)
+            runtime = min(runtime, time.time() - t)
+        pos_ref = exact_pos(ini_pos_vel_att, md, mobility, 1.0/fs/osr)[::osr]
+        err = pos_error(rtn['nav'][:, 1:4], pos_ref[0:rtn['nav'].shape[0]])
+        results.append([runtime, err])
+        print('%8s %5d %10.3f %14.3e' % (integration, osr, runtime, err))
+    return np.array(results)
+
+if __name__ == '__main__':
+    for i in ['motion_def-3d.csv', 'motion_def-long_drive.csv']:
+        res = test_integration(os.path.join(motion_def_path, i))
+        plt.figure(i)
+        for j in range(len(configs)):
+            marker = 'o' if configs[j][0] == 'euler' else 's'
+            plt.loglog(res[j, 0], res[j, 1], marker)
+            plt.annotate('%s, osr=%d' % tuple(configs[j]), (res[j, 0], res[j, 1]))
+        plt.xlabel('runtime (s)')
+        plt.ylabel('max position error (m)')
+        plt.title(i)
+        plt.grid(True)
+    plt.show()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Filename: demo_path_gen_vec.py
+
+"""
+Check the vectorized trajectory engine against the loop engine.
+Reference trajectories of every demo motion definition file are generated by pathgen.path_gen
+and pathgen_vec.path_gen_vec. Both should have the same number of rows, and their difference
+should be within the tolerance stated in pathgen_vec.path_gen_vec.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+import os
+import math
+import time
+import numpy as np
+from gnss_ins_sim.pathgen import pathgen
+from gnss_ins_sim.pathgen import pathgen_vec
+from gnss_ins_sim.sim import ins_sim
+
+# globals
+D2R = math.pi/180
+
+motion_def_path = os.path.abspath('.//demo_motion_def_files//')
+fs = 100.0          # IMU sample frequency
+fs_gps = 10.0       # GPS sample frequency
+# max difference of each output. Position is checked separately.
+tolerance = {'imu': 1e-8, 'nav': 1e-8, 'gps': 1e-8, 'odo': 1e-8, 'mag': 1e-6}
+pos_tolerance = 1e-7    # m
+
+def load_motion_def(file_name):
+    '''
+    Load initial states and motion commands from a motion definition file.
+    '''
+    ini_pos_vel_att = np.genfromtxt(file_name, delimiter=',', skip_header=1, max_rows=1)
+    ini_pos_vel_att[0] = ini_pos_vel_att[0] * D2R
+    ini_pos_vel_att[1] = ini_pos_vel_att[1] * D2R
+    ini_pos_vel_att[6:9] = ini_pos_vel_att[6:9] * D2R
+    motion_def = np.genfromtxt(file_name, delimiter=',', skip_header=3)
+    if motion_def.ndim == 1:
+        motion_def = np.array([motion_def])
+    return ini_pos_vel_att, motion_def
+
+def max_diff(name, x, y):
+    '''
+    Max difference of an output of the two engines. Position in LLA is converted to meters.
+    '''
+    d = np.abs(x - y)
+    if name in ['nav', 'gps']:
+        # columns 1:4 are position, lat and lon in rad
+        d[:, 1:3] = d[:, 1:3] * 6378137.0
+        return max(np.max(d[:, 1:4]) / pos_tolerance, np.max(d[:, 4:]) / tolerance[name])
+    return np.max(d) / tolerance[name]
+
+def test_path_gen_vec():
+    '''
+    Compare the two engines on every demo motion definition file.
+    '''
+    ok = True
+    for file_name in sorted(os.listdir(motion_def_path)):
+        if not file_name.startswith('motion_def') or not file_name.endswith('.csv'):
+            continue
+        ini_pos_vel_att, motion_def = load_motion_def(os.path.join(motion_def_path, file_name))
+        rtn = []
+        runtime = []
+        for engine in [pathgen.path_gen, pathgen_vec.path_gen_vec]:
+            output_def = np.array([[1.0, fs], [1.0, fs_gps], [1.0, fs]])
+            t0 = time.time()
+            rtn.append(engine(ini_pos_vel_att.copy(), motion_def.copy(), output_def,
+                              ins_sim.high_mobility, 0, True))
+            runtime.append(time.time() - t0)
+        rows = []
+        err = 0.0
+        for name in tolerance:
+            x, y = np.asarray(rtn[0][name]), np.asarray(rtn[1][name])
+            rows.append('%s %s/%s' % (name, x.shape[0], y.shape[0]))
+            if x.shape != y.shape:
+                err = math.inf
+            elif x.shape[0] > 0:
+                err = max(err, max_diff(name, x, y))
+        passed = err <= 1.0
+        ok = ok and passed
+        print('%-40s %s  loop %.2fs, vectorized %.2fs  %s' %\
+              (file_name, 'PASS' if passed else 'FAIL', runtime[0], runtime[1], ', '.join(rows)))
+    if not ok:
+        raise ValueError('path_gen_vec does not match path_gen.')
+
+if __name__ == '__main__':
+    test_path_gen_vec()
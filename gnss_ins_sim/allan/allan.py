@@ -4,16 +4,26 @@
 """
 Allan variance analysis.
 Reference: O.J. Woodman. An introduction to inertial navigation.
+W.J. Riley. Handbook of frequency stability analysis. NIST Special Publication 1065.
 Created on 2017-09-22
+20261018:   Overlapping, modified and total Allan deviation of all tau from the cumulative
+            sum of the data, with confidence bounds from equivalent degrees of freedom.
+            Streaming Allan deviation of data that do not fit in memory.
 @author: dongxiaoguang
 """
 
 # import
 import math
+from statistics import NormalDist
 import numpy as np
 
 # global
-VERSION = '1.0'
+VERSION = '1.1'
+# supported Allan deviation types
+ALLAN_MODES = ['non-overlapping', 'overlapping', 'modified', 'total']
+MIN_BINS = 9        # at least 9 bins are required for each tau
+BLOCK_SIZE = 1 << 16    # max number of elements processed at a time, to stay in cache
+CHUNK_SIZE = 1 << 18    # number of samples added to AllanAccumulator at a time
 
 def allan_var(x, fs):
     """
@@ -27,33 +37,306 @@ def allan_var(x, fs):
     """
     ts = 1.0 / fs
     n = len(x)      # number of samples
-    # how many tau will be calculated
-    max_sample_per_bin = int(math.floor(n/9.0)) # max samples in one bin, at least 9 bins required
+    max_sample_per_bin = n // MIN_BINS  # max samples in one bin, at least 9 bins required
     if max_sample_per_bin * ts < 1: # not enough data
         return [], []
-    multiplier = []
-    nextpow10 = math.ceil(math.log10(max_sample_per_bin))
-    scale = 0.1
-    for i in range(0, nextpow10):
-        scale *= 10
-        for j in range(1, 10):
-            tmp = int(j*scale)
-            if tmp <= max_sample_per_bin:
-                multiplier.append(tmp)
+    adev, tau = allan_dev(x, fs, mode='non-overlapping')[0:2]
+    return adev**2, tau
+
+def tau_grid(n, num_per_decade=None):
+    """
+    Number of samples averaged for each tau.
+    Args:
+        n: number of samples.
+        num_per_decade: number of log-spaced tau per decade. None means 1, 2, ..., 9 times
+            10^k.
+    Returns:
+        m: an int array of increasing number of samples per bin, at most n/9.
+    """
+    max_m = n // MIN_BINS
+    if max_m < 1:
+        return np.zeros((0,), dtype=int)
+    if num_per_decade is None:
+        m = [j * 10**i for i in range(int(math.log10(max_m)) + 1) for j in range(1, 10)]
+    else:
+        m = np.logspace(0, math.log10(max_m), int(math.log10(max_m)*num_per_decade) + 1)
+        m = np.round(m)
+    m = np.unique(np.array(m, dtype=int))
+    return m[m <= max_m]
+
+def allan_dev(x, fs, tau=None, mode='overlapping', axis=0, confidence=0.683, alpha=0):
+    """
+    Allan deviation of all tau computed from the cumulative sum (phase) of x. Multiple axes and
+    stacked runs are processed together.
+    Args:
+        x: samples, time along the specified axis. For example, nx6 IMU data, or
+            (runs, n, 6) IMU data of multiple runs with axis=1.
+        fs: sample frequency, Hz
+        tau: None means 1, 2, ..., 9 times 10^k samples. An int means the number of log-spaced
+            tau per decade. An array means the desired tau in seconds, which are rounded to
+            multiples of the sample interval.
+        mode: 'non-overlapping', 'overlapping', 'modified' or 'total'.
+        axis: time axis of x.
+        confidence: confidence level of the bounds, 0.683 means 1 sigma.
+        alpha: noise type to compute equivalent degrees of freedom. 2 for white phase noise,
+            1 for flicker phase noise, 0 for white frequency noise (angle/velocity random
+            walk), -1 for flicker frequency noise (bias instability), -2 for random walk
+            frequency noise (rate random walk).
+    Returns:
+        adev: Allan deviation, (ntau, ...), the remaining dimensions are those of x without
+            the time axis.
+        tau: average time, s
+        bounds: (2, ntau, ...) lower and upper confidence bounds of adev.
+    """
+    if mode not in ALLAN_MODES:
+        raise ValueError('mode should be one of %s, but got %s.'% (ALLAN_MODES, mode))
+    ts = 1.0 / fs
+    x = np.moveaxis(np.asarray(x, dtype=float), axis, 0)
+    n = x.shape[0]
+    if tau is None or np.isscalar(tau):
+        m = tau_grid(n, tau)
+    else:
+        m = np.unique(np.round(np.asarray(tau, dtype=float) / ts).astype(int))
+        m = m[(m >= 1) & (m <= n // MIN_BINS)]
+    ntau = m.shape[0]
+    adev = np.zeros((ntau,) + x.shape[1:])
+    # phase data of n+1 points, the mean is removed to keep precision, which does not change
+    # the second differences
+    phase = np.zeros((n+1,) + x.shape[1:])
+    np.cumsum(x - x.mean(axis=0), axis=0, out=phase[1:])
+    phase *= ts
+    if mode == 'total':
+        # extend the phase data by reflection at both ends
+        phase = np.concatenate([2.0*phase[0] - phase[1:n][::-1], phase,\
+                                2.0*phase[n] - phase[1:n][::-1]])
+    for i in range(ntau):
+        k = m[i]
+        t = k * ts
+        if mode == 'non-overlapping':
+            p = phase[::k]
+            d = p[2:] - 2.0*p[1:-1] + p[:-2]
+            avar = np.sum(d*d, axis=0) / (2.0 * t**2 * d.shape[0])
+        elif mode == 'overlapping':
+            count = n + 1 - 2*k
+            avar = second_diff_sum_sq(phase, k, 0, count) / (2.0 * t**2 * count)
+        elif mode == 'modified':
+            d = phase[2*k:] - 2.0*phase[k:-k] + phase[:-2*k]
+            c = np.zeros((d.shape[0]+1,) + d.shape[1:])
+            np.cumsum(d, axis=0, out=c[1:])
+            s = c[k:] - c[:-k]
+            avar = np.sum(s*s, axis=0) / (2.0 * k**2 * t**2 * s.shape[0])
+        else:
+            # original point j is at index n-1+j of the extended data, and the n-1 terms are
+            # centered at original points 1 to n-1
+            avar = second_diff_sum_sq(phase, k, n-k, n-1) / (2.0 * t**2 * (n-1))
+        adev[i] = np.sqrt(avar)
+    return adev, m * ts, adev_bounds(adev, n, m, mode, confidence, alpha)
+
+def adev_bounds(adev, n, m, mode, confidence=0.683, alpha=0):
+    """
+    Confidence bounds of Allan deviation.
+    Args:
+        adev: Allan deviation, (ntau, ...).
+        n: number of samples.
+        m: number of samples per bin of each tau.
+        mode, confidence, alpha: see allan_dev.
+    Returns:
+        bounds: (2, ntau, ...) lower and upper confidence bounds of adev.
+    """
+    bounds = np.zeros((2,) + adev.shape)
+    for i in range(adev.shape[0]):
+        if mode == 'non-overlapping':
+            # each tau is computed from the phase points of one m-decimated sequence
+            edf = edf_simple(n//m[i] + 1, 1, alpha)
+        else:
+            edf = edf_simple(n+1, m[i], alpha)
+        low, high = chi2_bounds(edf, confidence)
+        bounds[0, i] = adev[i] * math.sqrt(edf / high)
+        bounds[1, i] = adev[i] * math.sqrt(edf / low)
+    return bounds
+
+class AllanAccumulator(object):
+    '''
+    Streaming Allan deviation. Data are added in chunks, and only partial sums of each tau and
+    a short history of the phase data are kept, so memory use does not grow with the length of
+    the data. Results are the same as allan_dev with the same tau.
+    'non-overlapping': the last two phase points of each tau are kept.
+    'overlapping': the phase data of the last 2*max(m) samples are kept.
+    '''
+    def __init__(self, fs, tau, mode='overlapping'):
+        '''
+        Args:
+            fs: sample frequency, Hz
+            tau: desired tau in seconds, rounded to multiples of the sample interval. Tau
+                with less than 9 bins when the results are computed are not output.
+            mode: 'non-overlapping' or 'overlapping'.
+        '''
+        if mode not in ALLAN_MODES[0:2]:
+            raise ValueError('mode should be one of %s, but got %s.'% (ALLAN_MODES[0:2], mode))
+        self.fs = fs
+        self.mode = mode
+        self.m = np.unique(np.round(np.asarray(tau, dtype=float) * fs).astype(int))
+        self.m = self.m[self.m >= 1]
+        self.n = 0                  # number of samples added
+        self.offset = None          # subtracted from the data to keep precision
+        self.phase = None           # phase data of the last samples, the last row is the latest
+        self.points = []            # last two phase points of each tau, non-overlapping mode
+        self.sum_sq = None          # sum of squared second differences of each tau
+        self.count = np.zeros(self.m.shape, dtype=int)  # number of second differences
+
+    def add(self, x):
+        '''
+        Add a chunk of data.
+        Args:
+            x: samples, time along the first axis. All chunks should have the same shape
+                except the first dimension.
+        '''
+        x = np.asarray(x, dtype=float)
+        c = x.shape[0]
+        if c == 0:
+            return
+        if self.phase is None:
+            self.offset = x.mean(axis=0)
+            self.phase = np.zeros((1,) + x.shape[1:])
+            self.points = [self.phase.copy() for i in self.m]
+            self.sum_sq = np.zeros(self.m.shape + x.shape[1:])
+        # phase data of the history and the new samples, row h is the phase after n samples
+        h = self.phase.shape[0] - 1
+        phase = np.zeros((h+1+c,) + x.shape[1:])
+        phase[0:h+1] = self.phase
+        np.cumsum(x - self.offset, axis=0, out=phase[h+1:])
+        phase[h+1:] *= 1.0 / self.fs
+        phase[h+1:] += self.phase[-1]
+        for i in range(self.m.shape[0]):
+            k = self.m[i]
+            if self.mode == 'non-overlapping':
+                # new phase points at multiples of k
+                first = (self.n // k + 1) * k - self.n + h
+                p = np.concatenate([self.points[i], phase[first::k]])
+                if p.shape[0] >= 3:
+                    d = p[2:] - 2.0*p[1:-1] + p[:-2]
+                    self.sum_sq[i] += np.sum(d*d, axis=0)
+                    self.count[i] += d.shape[0]
+                self.points[i] = p[-2:]
             else:
-                break
-    ntau = len(multiplier)
-    tau = np.zeros((ntau,))
-    avar = np.zeros((ntau,))
-    # calculate Allan var
-    for i in range(0, ntau):
-        nsample_per_bin = multiplier[i]             # number of samples per bin
-        nbins = int(math.floor(n/nsample_per_bin))  # number of bins
-        if nbins < 9:
-            break
-        tmp = np.reshape(x[0: nbins*nsample_per_bin], (nbins, nsample_per_bin))
-        tmp = np.mean(tmp, 1)
-        diff = tmp[1::] - tmp[0:-1]
-        avar[i] = 0.5 / (nbins - 1) * np.sum(diff * diff)
-        tau[i] = nsample_per_bin * ts
-    return avar, tau
+                # second differences whose last point is a new sample
+                start = max(h+1 - 2*k, 0)
+                count = h+1+c - 2*k - start
+                if count > 0:
+                    self.sum_sq[i] += second_diff_sum_sq(phase, k, start, count)
+                    self.count[i] += count
+        self.n += c
+        # keep the phase data needed by the next chunk
+        keep = 1
+        if self.mode == 'overlapping' and self.m.shape[0] > 0:
+            keep = 2 * self.m[-1]
+        self.phase = phase[max(0, phase.shape[0]-keep):].copy()
+
+    def results(self, confidence=0.683, alpha=0):
+        '''
+        Allan deviation of the data added so far.
+        Args:
+            confidence, alpha: see allan_dev.
+        Returns:
+            adev, tau, bounds: see allan_dev.
+        '''
+        ts = 1.0 / self.fs
+        m = self.m[self.m <= self.n // MIN_BINS]
+        ntau = m.shape[0]
+        shape = () if self.sum_sq is None else self.sum_sq.shape[1:]
+        adev = np.zeros((ntau,) + shape)
+        for i in range(ntau):
+            t = m[i] * ts
+            adev[i] = np.sqrt(self.sum_sq[i] / (2.0 * t**2 * self.count[i]))
+        return adev, m * ts, adev_bounds(adev, self.n, m, self.mode, confidence, alpha)
+
+def allan_dev_chunks(chunks, fs, tau, mode='overlapping', confidence=0.683, alpha=0):
+    """
+    Allan deviation of data too long to be processed at a time, see AllanAccumulator.
+    Args:
+        chunks: an iterable of chunks of samples, time along the first axis. It can also be an
+            array, for example a memory-mapped .npy file, which is processed in chunks of
+            CHUNK_SIZE samples.
+        fs, tau, mode: see AllanAccumulator.
+        confidence, alpha: see allan_dev.
+    Returns:
+        adev, tau, bounds: see allan_dev.
+    """
+    acc = AllanAccumulator(fs, tau, mode)
+    if hasattr(chunks, 'shape'):
+        data = chunks
+        chunks = (data[i:i+CHUNK_SIZE] for i in range(0, data.shape[0], CHUNK_SIZE))
+    for x in chunks:
+        acc.add(x)
+    return acc.results(confidence, alpha)
+
+def second_diff_sum_sq(phase, k, start, count):
+    """
+    Sum of squared second differences phase[i+2k] - 2*phase[i+k] + phase[i] for i from start
+    to start+count-1, computed in blocks.
+    Args:
+        phase: phase data, time along the first axis.
+        k: step of the second differences.
+        start: first index.
+        count: number of second differences.
+    Returns:
+        sum of squared second differences, an array of the shape of phase without the first
+        axis.
+    """
+    width = max(1, int(np.prod(phase.shape[1:])))
+    rows = max(1, BLOCK_SIZE // width)
+    buf = np.empty((min(rows, count),) + phase.shape[1:])
+    rtn = np.zeros(phase.shape[1:])
+    for i in range(start, start+count, rows):
+        j = min(i+rows, start+count)
+        d = buf[0:j-i]
+        np.multiply(phase[i+k:j+k], -2.0, out=d)
+        d += phase[i+2*k:j+2*k]
+        d += phase[i:j]
+        rtn += np.einsum('i...,i...->...', d, d)
+    return rtn
+
+def edf_simple(n, m, alpha=0):
+    """
+    Equivalent degrees of freedom of overlapping Allan variance, from the simple approximations
+    of Howe, Allan and Barnes. It is also used as an approximation for the other modes.
+    Args:
+        n: number of phase points.
+        m: number of samples per bin.
+        alpha: noise type, see allan_dev.
+    Returns:
+        edf: equivalent degrees of freedom, at least 1.
+    """
+    if alpha == 2:
+        edf = (n + 1) * (n - 2*m) / (2.0 * (n - m))
+    elif alpha == 1:
+        edf = math.exp(math.sqrt(math.log((n - 1) / (2.0*m)) *\
+                                 math.log((2.0*m + 1) * (n - 1) / 4.0)))
+    elif alpha == 0:
+        edf = (3.0 * (n - 1) / (2.0*m) - 2.0 * (n - 2) / n) * 4.0 * m**2 / (4.0 * m**2 + 5)
+    elif alpha == -1:
+        if m == 1:
+            edf = 2.0 * (n - 2) / (2.3*n - 4.9)
+        else:
+            edf = 5.0 * n**2 / (4.0 * m * (n + 3.0*m))
+    elif alpha == -2:
+        edf = (n - 2.0) / m * ((n - 1.0)**2 - 3.0*m*(n - 1) + 4.0*m**2) / (n - 3.0)**2
+    else:
+        raise ValueError('alpha should be 2, 1, 0, -1 or -2, but got %s.'% alpha)
+    return max(edf, 1.0)
+
+def chi2_bounds(edf, confidence):
+    """
+    Quantiles of the chi-square distribution at (1-confidence)/2 and (1+confidence)/2, by the
+    Wilson-Hilferty approximation.
+    Args:
+        edf: degrees of freedom.
+        confidence: confidence level.
+    Returns:
+        low, high: the two quantiles.
+    """
+    z = NormalDist().inv_cdf(0.5 + 0.5*confidence)
+    c = 2.0 / (9.0 * edf)
+    low = edf * max(1.0 - c - z*math.sqrt(c), 1e-3)**3
+    high = edf * (1.0 - c + z*math.sqrt(c))**3
+    return low, high
@@ -265,9 +265,10 @@ def quat2dcm(q):
     """
     Convert quaternion to direction cosine matrix
     Args:
-        q: quaternion, [q0, q1, q2, q3], q0 is the scalar
+        q: quaternion, [q0, q1, q2, q3], q0 is the scalar. Or 4xn, each column is a
+            quaternion, see quat2dcm_batch.
     Return:
-        dcm: direction cosine matrix
+        dcm: direction cosine matrix, 3x3 or 3x3xn.
     """
     q0q0 = q[0] * q[0]
     q0q1 = q[0] * q[1]
@@ -279,7 +280,7 @@ def quat2dcm(q):
     q2q2 = q[2] * q[2]
     q2q3 = q[2] * q[3]
     q3q3 = q[3] * q[3]
-    dcm = np.zeros((3, 3))
+    dcm = np.zeros((3, 3) + np.shape(q)[1:])
     dcm[0, 0] = q0q0 + q1q1 - q2q2 - q3q3
     dcm[0, 1] = 2.0*(q1q2 + q0q3)
     dcm[0, 2] = 2.0*(q1q3 - q0q2)
@@ -349,12 +350,13 @@ def euler2dcm(angles, rot_seq='zyx'):
     to b. That is v_b  = DCM * v_n. '_b' or '_n' mean the vector 'v' is expressed
     in the frame b or n.
     Args:
-        angles: 3x1 Euler angles, rad.
+        angles: 3x1 Euler angles, rad. Or 3xn, each column is a set of Euler angles, see
+            euler2dcm_batch.
         rot_seq: rotation sequence corresponding to the angles.
     Returns:
-        dcm: 3x3 coordinate transformation matrix from n to b
+        dcm: 3x3 coordinate transformation matrix from n to b, or 3x3xn.
     """
-    dcm = np.zeros((3, 3))
+    dcm = np.zeros((3, 3) + np.shape(angles)[1:])
     cangle = np.cos(angles)
     sangle = np.sin(angles)
     rot_seq = rot_seq.lower()
@@ -424,7 +426,7 @@ def euler2dcm(angles, rot_seq='zyx'):
         dcm[2, 1] = -sangle[1]*cangle[2]
         dcm[2, 2] = cangle[0]*cangle[2]*cangle[1] - sangle[0]*sangle[2]
         return dcm
-    elif rot_seq == 'yxz':
+    elif rot_seq == 'yzx':
         dcm[0, 0] = cangle[0]*cangle[1]
         dcm[0, 1] = sangle[1]
         dcm[0, 2] = -sangle[0]*cangle[1]
@@ -506,6 +508,7 @@ def dcm2euler(dcm, rot_seq='zyx'):
     Returns:
         angles: 3x1 Euler angles, rad.
     """
+    rot_seq = rot_seq.lower()
     if rot_seq == 'zyx':
         #     [          cy*cz,          cy*sz,            -sy]
         #     [ sy*sx*cz-sz*cx, sy*sx*sz+cz*cx,          cy*sx]
@@ -593,6 +596,125 @@ def dcm2euler(dcm, rot_seq='zyx'):
     else:
         return False
 
+def quat2euler_batch(q, rot_seq='zyx'):
+    '''
+    Convert quaternions to Euler angles. This is the vectorized version of quat2euler.
+    Args:
+        q: nx4 quaternions, each row is [q0, q1, q2, q3], q0 is the scalar. Stacked quaternions
+            of size (...,4), e.g. (runs,n,4), are also supported.
+        rot_seq: rotation sequence corresponding to the angles.
+    Return:
+        angles: nx3 or (...,3) Euler angles, rad.
+    '''
+    angles = quat2euler(np.moveaxis(np.asarray(q, dtype=float), -1, 0), rot_seq)
+    return batch_result(angles, 1, rot_seq)
+
+def euler2quat_batch(angles, rot_seq='zyx'):
+    '''
+    Convert Euler angles to quaternions. This is the vectorized version of euler2quat.
+    Args:
+        angles: nx3 or (...,3) Euler angles, rad.
+        rot_seq: rotation sequence corresponding to the angles.
+    Return:
+        q: nx4 or (...,4) quaternions, [q0, q1, q2, q3], q0 is the scalar
+    '''
+    q = euler2quat(np.moveaxis(np.asarray(angles, dtype=float), -1, 0), rot_seq)
+    return batch_result(q, 1, rot_seq)
+
+def quat2dcm_batch(q):
+    '''
+    Convert quaternions to direction cosine matrices. This is the vectorized version of
+    quat2dcm.
+    Args:
+        q: nx4 or (...,4) quaternions, [q0, q1, q2, q3], q0 is the scalar.
+    Return:
+        dcm: nx3x3 or (...,3,3) direction cosine matrices.
+    '''
+    dcm = quat2dcm(np.moveaxis(np.asarray(q, dtype=float), -1, 0))
+    return batch_result(dcm, 2)
+
+def dcm2quat_batch(c):
+    '''
+    Convert direction cosine matrices to quaternions. This is the vectorized version of
+    dcm2quat.
+    Args:
+        c: nx3x3 or (...,3,3) direction cosine matrices.
+    Returns:
+        q: nx4 or (...,4) quaternions, scalar first and non-negative.
+    '''
+    c = np.asarray(c, dtype=float)
+    c00, c01, c02 = c[..., 0, 0], c[..., 0, 1], c[..., 0, 2]
+    c10, c11, c12 = c[..., 1, 0], c[..., 1, 1], c[..., 1, 2]
+    c20, c21, c22 = c[..., 2, 0], c[..., 2, 1], c[..., 2, 2]
+    tr = c00 + c11 + c22
+    # the same branches as dcm2quat, selected for each matrix
+    branch = np.where(tr > 0.0, 0,
+                      np.where((c11 > c00) & (c11 > c22), 2, np.where(c22 > c00, 3, 1)))
+    diag = [1.0 + tr, c00 - c11 - c22 + 1.0, c11 - c00 - c22 + 1.0, c22 - c00 - c11 + 1.0]
+    # [q0*q0, q0*q1, q0*q2, q0*q3], [q1*q0, ...], ... times 4
+    cross = [[None, c12 - c21, c20 - c02, c01 - c10],
+             [c12 - c21, None, c01 + c10, c20 + c02],
+             [c20 - c02, c01 + c10, None, c12 + c21],
+             [c01 - c10, c20 + c02, c12 + c21, None]]
+    q = np.zeros(c.shape[:-2] + (4,))
+    for i in range(4):
+        sel = branch == i
+        if not np.any(sel):
+            continue
+        sqdip1 = np.sqrt(np.maximum(diag[i][sel], 0.0))
+        q[sel, i] = 0.5*sqdip1
+        # if sqdip1 equals 0, something is wrong
+        with np.errstate(divide='ignore'):
+            sqdip1 = np.where(sqdip1 != 0.0, 0.5/sqdip1, 0.0)
+        for j in range(4):
+            if j != i:
+                q[sel, j] = cross[i][j][sel] * sqdip1
+    # ensure q[0] is non-negative
+    q[q[..., 0] < 0] *= -1.0
+    return q
+
+def euler2dcm_batch(angles, rot_seq='zyx'):
+    '''
+    Convert Euler angles to direction cosine matrices. This is the vectorized version of
+    euler2dcm.
+    Args:
+        angles: nx3 or (...,3) Euler angles, rad.
+        rot_seq: rotation sequence corresponding to the angles.
+    Returns:
+        dcm: nx3x3 or (...,3,3) coordinate transformation matrices from n to b
+    '''
+    dcm = euler2dcm(np.moveaxis(np.asarray(angles, dtype=float), -1, 0), rot_seq)
+    return batch_result(dcm, 2, rot_seq)
+
+def dcm2euler_batch(dcm, rot_seq='zyx'):
+    '''
+    Convert direction cosine matrices to Euler angles. This is the vectorized version of
+    dcm2euler.
+    Args:
+        dcm: nx3x3 or (...,3,3) coordinate transformation matrices from n to b
+        rot_seq: rotation sequence corresponding to the angles.
+    Returns:
+        angles: nx3 or (...,3) Euler angles, rad.
+    '''
+    dcm = np.moveaxis(np.asarray(dcm, dtype=float), (-2, -1), (0, 1))
+    return batch_result(dcm2euler(dcm, rot_seq), 1, rot_seq)
+
+def batch_result(x, ndim, rot_seq=None):
+    '''
+    Move the leading component axes of the output of a conversion to the end.
+    Args:
+        x: output of a conversion with component axes first, or False if rot_seq is not
+            supported.
+        ndim: number of component axes, 1 for vectors and 2 for matrices.
+        rot_seq: rotation sequence of the conversion.
+    Returns:
+        x with component axes last.
+    '''
+    if x is False:
+        raise ValueError('Unsupported rotation sequence: %s.'% rot_seq)
+    x = np.moveaxis(np.asarray(x), tuple(range(ndim)), tuple(range(-ndim, 0)))
+    return np.ascontiguousarray(x)
+
 def ecef_to_ned(lat, lon):
     '''
     transformation matrix from the ECEF frame to the NED frame defined by lat and lon.
@@ -602,13 +724,46 @@ def ecef_to_ned(lat, lon):
     '''
     return rot_y(-math.pi/2.0 - lat).dot(rot_z(lon))
 
+def ecef_to_ned_batch(lat, lon):
+    '''
+    Transformation matrices from the ECEF frame to the NED frames defined by arrays of lat and
+    lon. This is the vectorized version of ecef_to_ned.
+    Args:
+        lat: (...,) latitude, rad
+        lon: (...,) longitude, rad, same size as lat
+    Returns:
+        c_ne: (...,3,3) transformation matrices.
+    '''
+    # rot_y(-pi/2-lat).dot(rot_z(lon)) expanded
+    angle = -math.pi/2.0 - np.asarray(lat, dtype=float)
+    sa = np.sin(angle)
+    ca = np.cos(angle)
+    slon = np.sin(lon)
+    clon = np.cos(lon)
+    c_ne = np.zeros(sa.shape + (3, 3))
+    c_ne[..., 0, 0] = ca * clon
+    c_ne[..., 0, 1] = ca * slon
+    c_ne[..., 0, 2] = -sa
+    c_ne[..., 1, 0] = -slon
+    c_ne[..., 1, 1] = clon
+    c_ne[..., 2, 0] = sa * clon
+    c_ne[..., 2, 1] = sa * slon
+    c_ne[..., 2, 2] = ca
+    return c_ne
+
 def three_axis_rot(r11, r12, r21, r31, r32):
+    if isinstance(r21, np.ndarray):
+        # arrays from the batch conversions. Rounding errors may push r21 slightly beyond 1.
+        return np.arctan2(r11, r12), np.arcsin(np.clip(r21, -1.0, 1.0)), np.arctan2(r31, r32)
     r1 = math.atan2(r11, r12)
     r2 = math.asin(r21)
     r3 = math.atan2(r31, r32)
     return r1, r2, r3
 
 def two_axis_rot(r11, r12, r21, r31, r32):
+    if isinstance(r21, np.ndarray):
+        return np.array([np.arctan2(r11, r12), np.arccos(np.clip(r21, -1.0, 1.0)),
+                         np.arctan2(r31, r32)])
     r1 = math.atan2(r11, r12)
     r2 = math.acos(r21)
     r3 = math.atan2(r31, r32)
@@ -800,12 +955,14 @@ def angle_range_pi(x):
     '''
     Limit angle range within [-pi, pi]
     Args：
-        x: rad
+        x: rad, a scalar or a numpy array
     Return:
         equivalent angle of x, [-pi, pi], rad
     '''
     # [0, 2pi]
     x = x % (TWO_PI)
+    if isinstance(x, np.ndarray):
+        return np.where(x > math.pi, x - TWO_PI, x)
     # [-pi, pi]
     if x > math.pi:
         x = x - TWO_PI
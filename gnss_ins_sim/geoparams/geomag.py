@@ -14,9 +14,109 @@
 # >>> mag.dec
 # -6.1335150785195536
 # >>>
+#
+# Many points can be evaluated in one call with numpy arrays:
+#
+# >>> mag = gm.GeoMagBatch(lat_array, lon_array, alt_array)
+# >>> mag.bx, mag.by, mag.bz
+#
+# Coefficient files are parsed once per process and shared by all GeoMag objects created
+# from the same file.
 
 import math, os, unittest
 from datetime import date
+import numpy as np
+
+# parsed and normalized coefficients of each coefficient file, keyed by the absolute file name
+# and the modification time of the file
+_coef_cache = {}
+
+def coef_file_name(wmm_filename=None):
+    """
+    Absolute name of a WMM coefficient file.
+    Args:
+        wmm_filename: coefficient file name. A relative name is relative to the directory of
+            this module. None means WMM.COF.
+    Returns:
+        the absolute file name.
+    """
+    if not wmm_filename:
+        wmm_filename = os.path.join(os.path.dirname(__file__), 'WMM.COF')
+    elif not os.path.isabs(wmm_filename):
+        wmm_filename = os.path.join(os.path.dirname(__file__), wmm_filename)
+    return os.path.abspath(wmm_filename)
+
+def load_coefficients(wmm_filename=None):
+    """
+    Parse a WMM coefficient file and convert the Schmidt normalized Gauss coefficients to
+    unnormalized ones. The results are cached, so each file is only parsed once unless it is
+    modified.
+    Args:
+        wmm_filename: coefficient file name. A relative name is relative to the directory of
+            this module. None means WMM.COF.
+    Returns:
+        a dict with keys 'epoch', 'model', 'modeldate', 'c', 'cd' and 'k'. 'c' and 'cd' are
+        the coefficients and their secular variations, g(n,m) in c[m][n] and h(n,m) in
+        c[n][m-1]. 'k' holds the recursion constants of the Legendre polynomials. They should
+        not be modified.
+    """
+    wmm_filename = coef_file_name(wmm_filename)
+    key = (wmm_filename, os.stat(wmm_filename).st_mtime_ns)
+    if key in _coef_cache:
+        return _coef_cache[key]
+    coef = {}
+    wmm=[]
+    with open(wmm_filename) as wmm_file:
+        for line in wmm_file:
+            linevals = line.strip().split()
+            if len(linevals) == 3:
+                coef['epoch'] = float(linevals[0])
+                coef['model'] = linevals[1]
+                coef['modeldate'] = linevals[2]
+            elif len(linevals) == 6:
+                linedict = {'n': int(float(linevals[0])),
+                'm': int(float(linevals[1])),
+                'gnm': float(linevals[2]),
+                'hnm': float(linevals[3]),
+                'dgnm': float(linevals[4]),
+                'dhnm': float(linevals[5])}
+                wmm.append(linedict)
+
+    maxord = 12
+    c = [[0.0]*14 for i in range(14)]
+    cd = [[0.0]*14 for i in range(14)]
+    for wmmnm in wmm:
+        m = wmmnm['m']
+        n = wmmnm['n']
+        if (m <= n):
+            c[m][n] = wmmnm['gnm']
+            cd[m][n] = wmmnm['dgnm']
+            if (m != 0):
+                c[n][m-1] = wmmnm['hnm']
+                cd[n][m-1] = wmmnm['dhnm']
+
+    #/* CONVERT SCHMIDT NORMALIZED GAUSS COEFFICIENTS TO UNNORMALIZED */
+    snorm = [[0.0]*13 for i in range(13)]
+    snorm[0][0] = 1.0
+    k = [[0.0]*13 for i in range(13)]
+    for n in range(1,maxord+1):
+        snorm[0][n] = snorm[0][n-1]*(2.0*n-1)/n
+        j=2.0
+        for m in range(0,n+1):
+            k[m][n] = (((n-1)*(n-1))-(m*m))/((2.0*n-1)*(2.0*n-3.0))
+            if (m > 0):
+                flnmj = ((n-m+1.0)*j)/(n+m)
+                snorm[m][n] = snorm[m-1][n]*math.sqrt(flnmj)
+                j = 1.0
+                c[n][m-1] = snorm[m][n]*c[n][m-1]
+                cd[n][m-1] = snorm[m][n]*cd[n][m-1]
+            c[m][n] = snorm[m][n]*c[m][n]
+            cd[m][n] = snorm[m][n]*cd[m][n]
+    coef['c'] = c
+    coef['cd'] = cd
+    coef['k'] = k
+    _coef_cache[key] = coef
+    return coef
 
 class GeoMag:
 
@@ -194,28 +294,140 @@ class GeoMag:
 
         return retobj
 
+    def GeoMagBatch(self, dlat, dlon, h=0, time=None):
+        """
+        Vectorized version of GeoMag. Evaluate the geomagnetic field at many points in one call.
+        Args:
+            dlat: latitude, decimal degrees, scalar or numpy array.
+            dlon: longitude, decimal degrees, scalar or numpy array.
+            h: altitude, meters, scalar or numpy array.
+            time: a datetime.date, or decimal year, scalar or numpy array. None means today.
+            dlat, dlon, h and time are broadcast against each other.
+        Returns:
+            An object with attributes dec, dip, ti, bh, bx, by, bz, lat, lon, alt and time, the
+            same as GeoMag, except that they are numpy arrays of the broadcast shape.
+        """
+        if time is None:
+            time = date.today()
+        if isinstance(time, date):
+            time = time.year+((time - date(time.year,1,1)).days/365.0)
+        dlat, dlon, h, time = np.broadcast_arrays(np.asarray(dlat, dtype=float),
+                                                  np.asarray(dlon, dtype=float),
+                                                  np.asarray(h, dtype=float),
+                                                  np.asarray(time, dtype=float))
+        alt = h/1000.0
+        dt = time - self.epoch
+        rlat = np.radians(dlat)
+        rlon = np.radians(dlon)
+        srlat = np.sin(rlat)
+        crlat = np.cos(rlat)
+        srlat2 = srlat*srlat
+        crlat2 = crlat*crlat
+
+        #/* CONVERT FROM GEODETIC COORDS. TO SPHERICAL COORDS. */
+        q = np.sqrt(self.a2-self.c2*srlat2)
+        q1 = alt*q
+        q2 = ((q1+self.a2)/(q1+self.b2))*((q1+self.a2)/(q1+self.b2))
+        ct = srlat/np.sqrt(q2*crlat2+srlat2)
+        st = np.sqrt(1.0-(ct*ct))
+        r2 = (alt*alt)+2.0*q1+(self.a4-self.c4*srlat2)/(q*q)
+        r = np.sqrt(r2)
+        d = np.sqrt(self.a2*crlat2+self.b2*srlat2)
+        ca = (alt+d)/r
+        sa = self.c2*crlat*srlat/(r*d)
+
+        # sin(m*lon) and cos(m*lon)
+        sp = [np.zeros(dlat.shape), np.sin(rlon)]
+        cp = [np.ones(dlat.shape), np.cos(rlon)]
+        for m in range(2,self.maxord+1):
+            sp.append(sp[1]*cp[m-1]+cp[1]*sp[m-1])
+            cp.append(cp[1]*cp[m-1]-sp[1]*sp[m-1])
+
+        # unnormalized associated Legendre polynomials and derivatives, p[m][n] and dp[m][n].
+        # Terms with m > n are zero.
+        zero = np.zeros(dlat.shape)
+        p = [[zero]*(self.maxord+1) for i in range(self.maxord+1)]
+        dp = [[zero]*(self.maxord+1) for i in range(self.maxord+1)]
+        p[0][0] = np.ones(dlat.shape)
+        pp = [np.ones(dlat.shape)]      # for the north/south geographic poles
+        aor = self.re/r
+        ar = aor*aor
+        br = np.zeros(dlat.shape)
+        bt = np.zeros(dlat.shape)
+        bp = np.zeros(dlat.shape)
+        bpp = np.zeros(dlat.shape)
+        for n in range(1,self.maxord+1):
+            ar = ar*aor
+            for m in range(0,n+1):
+                if (n == m):
+                    p[m][n] = st * p[m-1][n-1]
+                    dp[m][n] = st*dp[m-1][n-1]+ct*p[m-1][n-1]
+                elif (n == 1 and m == 0):
+                    p[m][n] = ct*p[m][n-1]
+                    dp[m][n] = ct*dp[m][n-1]-st*p[m][n-1]
+                else:
+                    p[m][n] = ct*p[m][n-1]-self.k[m][n]*p[m][n-2]
+                    dp[m][n] = ct*dp[m][n-1] - st*p[m][n-1]-self.k[m][n]*dp[m][n-2]
+                # time adjusted Gauss coefficients
+                tc_mn = self.c[m][n]+dt*self.cd[m][n]
+                # accumulate terms of the spherical harmonic expansions
+                par = ar*p[m][n]
+                if (m == 0):
+                    temp1 = tc_mn*cp[m]
+                    temp2 = tc_mn*sp[m]
+                else:
+                    tc_nm = self.c[n][m-1]+dt*self.cd[n][m-1]
+                    temp1 = tc_mn*cp[m]+tc_nm*sp[m]
+                    temp2 = tc_mn*sp[m]-tc_nm*cp[m]
+                bt = bt-ar*temp1*dp[m][n]
+                bp = bp + (self.fm[m] * temp2 * par)
+                br = br + (self.fn[n] * temp1 * par)
+                # special case: north/south geographic poles
+                if (m == 1):
+                    if (n == 1):
+                        pp.append(pp[n-1])
+                    else:
+                        pp.append(ct*pp[n-1]-self.k[m][n]*pp[n-2])
+                    bpp = bpp + (self.fm[m]*temp2*ar*pp[n])
+
+        pole = st == 0.0
+        bp = np.where(pole, bpp, bp/np.where(pole, 1.0, st))
+        # rotate magnetic vector components from spherical to geodetic coordinates
+        bx = -bt*ca-br*sa
+        by = bp
+        bz = bt*sa-br*ca
+        # compute declination (dec), inclination (dip) and total intensity (ti)
+        bh = np.sqrt((bx*bx)+(by*by))
+        ti = np.sqrt((bh*bh)+(bz*bz))
+        dec = np.degrees(np.arctan2(by,bx))
+        dip = np.degrees(np.arctan2(bz,bh))
+
+        class RetObj:
+            pass
+        retobj = RetObj()
+        retobj.dec = dec
+        retobj.dip = dip
+        retobj.ti = ti
+        retobj.bh = bh
+        retobj.bx = bx
+        retobj.by = by
+        retobj.bz = bz
+        retobj.lat = dlat
+        retobj.lon = dlon
+        retobj.alt = h
+        retobj.time = time
+
+        return retobj
+
     def __init__(self, wmm_filename=None):
-        if not wmm_filename:
-            wmm_filename = os.path.join(os.path.dirname(__file__), 'WMM.COF')
-        else:
-            if not os.path.isabs(wmm_filename):     # add by DXG
-                wmm_filename = os.path.join(os.path.dirname(__file__), wmm_filename)
-        wmm=[]
-        with open(wmm_filename) as wmm_file:
-            for line in wmm_file:
-                linevals = line.strip().split()
-                if len(linevals) == 3:
-                    self.epoch = float(linevals[0])
-                    self.model = linevals[1]
-                    self.modeldate = linevals[2]
-                elif len(linevals) == 6:
-                    linedict = {'n': int(float(linevals[0])),
-                    'm': int(float(linevals[1])),
-                    'gnm': float(linevals[2]),
-                    'hnm': float(linevals[3]),
-                    'dgnm': float(linevals[4]),
-                    'dhnm': float(linevals[5])}
-                    wmm.append(linedict)
+        # coefficients are parsed once and shared, they are not modified by GeoMag
+        coef = load_coefficients(wmm_filename)
+        self.epoch = coef['epoch']
+        self.model = coef['model']
+        self.modeldate = coef['modeldate']
+        self.c = coef['c']
+        self.cd = coef['cd']
+        self.k = coef['k']
 
         z = [0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0]
         self.maxord = self.maxdeg = 12
@@ -237,50 +449,8 @@ class GeoMag:
         self.a4 = self.a2*self.a2
         self.b4 = self.b2*self.b2
         self.c4 = self.a4 - self.b4
-
-        self.c = [z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14]]
-        self.cd = [z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14],z[0:14]]
-        
-        for wmmnm in wmm:
-            m = wmmnm['m']
-            n = wmmnm['n']
-            gnm = wmmnm['gnm']
-            hnm = wmmnm['hnm']
-            dgnm = wmmnm['dgnm']
-            dhnm = wmmnm['dhnm']
-            if (m <= n):
-                self.c[m][n] = gnm
-                self.cd[m][n] = dgnm
-                if (m != 0):
-                    self.c[n][m-1] = hnm
-                    self.cd[n][m-1] = dhnm
-
-        #/* CONVERT SCHMIDT NORMALIZED GAUSS COEFFICIENTS TO UNNORMALIZED */
-        self.snorm = [z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13]]
-        self.snorm[0][0] = 1.0
-        self.k = [z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13],z[0:13]]
-        self.k[1][1] = 0.0
         self.fn = [0.0,2.0,3.0,4.0,5.0,6.0,7.0,8.0,9.0,10.0,11.0,12.0,13.0]
         self.fm = [0.0,1.0,2.0,3.0,4.0,5.0,6.0,7.0,8.0,9.0,10.0,11.0,12.0]
-        for n in range(1,self.maxord+1):
-            self.snorm[0][n] = self.snorm[0][n-1]*(2.0*n-1)/n
-            j=2.0
-            #for (m=0,D1=1,D2=(n-m+D1)/D1;D2>0;D2--,m+=D1):
-            m=0
-            D1=1
-            D2=(n-m+D1)/D1
-            while (D2 > 0):
-                self.k[m][n] = (((n-1)*(n-1))-(m*m))/((2.0*n-1)*(2.0*n-3.0))
-                if (m > 0):
-                    flnmj = ((n-m+1.0)*j)/(n+m)
-                    self.snorm[m][n] = self.snorm[m-1][n]*math.sqrt(flnmj)
-                    j = 1.0
-                    self.c[n][m-1] = self.snorm[m][n]*self.c[n][m-1]
-                    self.cd[n][m-1] = self.snorm[m][n]*self.cd[n][m-1]
-                self.c[m][n] = self.snorm[m][n]*self.c[m][n]
-                self.cd[m][n] = self.snorm[m][n]*self.cd[m][n]
-                D2=D2-1
-                m=m+D1
 
 class GeoMagTest(unittest.TestCase):
 
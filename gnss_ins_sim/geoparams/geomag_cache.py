@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Filename: geomag_cache.py
+
+"""
+Spatial tile cache of the geomagnetic field.
+The WMM is evaluated on a regular lat/lon/alt grid, and the field at any position is trilinearly
+interpolated from the 8 grid nodes around it. The grid spacing is chosen from an error tolerance.
+Grid nodes are evaluated tile by tile when a position in the tile is first queried, and tiles are
+kept in memory for later queries, so trajectories in the same region share them. Tiles are not
+saved on disk, and are only shared within a process. Each worker process of Sim evaluates its
+own tiles.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+import os
+import math
+import collections
+from datetime import date
+import numpy as np
+from . import geomag
+
+# global
+DEFAULT_TOL = 1.0           # nT, default max interpolation error of each component
+# The trilinear interpolation error of the WMM is about c*h^2, with h the grid spacing. c is
+# estimated from random positions all over the world, with margin. The error along lat/lon is
+# about 10.5*h^2 nT with h in deg, and along altitude is about 3.2e-9*h^2 nT with h in m.
+LATLON_ERR_COEF = 12.0      # nT/deg^2
+ALT_ERR_COEF = 4.0e-9       # nT/m^2
+TILE_SIZE = [16, 16, 4]     # number of lat/lon/alt grid cells in a tile
+DEFAULT_MAX_TILES = 1024    # default max number of tiles kept in a cache, about 35 KB each
+
+# caches shared by all trajectories in this process, see get_cache
+_shared_caches = {}
+
+def get_cache(tol=DEFAULT_TOL, wmm_filename='WMM.COF', time=None):
+    """
+    Get a tile cache shared by all callers in this process with the same arguments. Tiles
+    evaluated for one trajectory are reused by later trajectories in the same region. A new
+    cache is created if the coefficient file is modified.
+    Args:
+        tol, wmm_filename, time: See GeoMagTileCache.
+    Returns:
+        a GeoMagTileCache object.
+    """
+    time = decimal_year(time)
+    wmm_filename = geomag.coef_file_name(wmm_filename)
+    key = (wmm_filename, os.stat(wmm_filename).st_mtime_ns, float(tol), time)
+    if key not in _shared_caches:
+        _shared_caches[key] = GeoMagTileCache(tol, wmm_filename, time)
+    return _shared_caches[key]
+
+def decimal_year(time):
+    """
+    Convert a date to decimal year, the same as geomag.GeoMag.
+    Args:
+        time: a datetime.date, or decimal year. None means today.
+    Returns:
+        decimal year.
+    """
+    if time is None:
+        time = date.today()
+    if isinstance(time, date):
+        time = time.year+((time - date(time.year, 1, 1)).days/365.0)
+    return float(time)
+
+class GeoMagTileCache(object):
+    '''
+    Geomagnetic field interpolated from WMM values on a regular grid. Grid nodes are at
+    multiples of the grid spacing, and are evaluated in tiles of TILE_SIZE cells. When there
+    are more than max_tiles tiles, the least recently used ones are removed.
+    '''
+    def __init__(self, tol=DEFAULT_TOL, wmm_filename='WMM.COF', time=None,
+                 max_tiles=DEFAULT_MAX_TILES):
+        '''
+        Args:
+            tol: max interpolation error of each component of the field, nT.
+            wmm_filename: WMM coefficient file, see geomag.GeoMag.
+            time: a datetime.date, or decimal year. None means today.
+            max_tiles: max number of tiles kept in memory.
+        '''
+        if tol <= 0:
+            raise ValueError("tol should be positive, but got %s." % tol)
+        if max_tiles < 1:
+            raise ValueError("max_tiles should be at least 1, but got %s." % max_tiles)
+        self.tol = tol
+        self.max_tiles = max_tiles
+        self.gm = geomag.GeoMag(wmm_filename)
+        self.time = decimal_year(time)
+        # half of the tolerance for lat/lon and half for altitude. The lat/lon spacing divides
+        # 90deg, so that the poles are grid nodes.
+        d_latlon = math.sqrt(0.5*tol/LATLON_ERR_COEF)
+        d_latlon = 90.0 / math.ceil(90.0/d_latlon)
+        self.spacing = np.array([d_latlon, d_latlon, math.sqrt(0.5*tol/ALT_ERR_COEF)])
+        self.tile_size = np.array(TILE_SIZE)
+        # (TILE_SIZE[0]+1)x(TILE_SIZE[1]+1)x(TILE_SIZE[2]+1)x3 node values, least recently used
+        # first
+        self.tiles = collections.OrderedDict()
+
+    def field(self, pos_lla):
+        '''
+        Geomagnetic field at given positions.
+        Args:
+            pos_lla: 3x1 or ...x3 [Lat, Lon, Alt], rad, m.
+        Returns:
+            3x1 or ...x3 geomagnetic field in the NED frame, nT.
+        '''
+        pos_lla = np.asarray(pos_lla, dtype=float)
+        shape = pos_lla.shape
+        if pos_lla.size == 0:
+            return np.zeros(shape)
+        pos_lla = pos_lla.reshape((-1, 3))
+        # grid cell of each position, and the position within the cell
+        u = np.stack((np.degrees(pos_lla[:, 0]), np.degrees(pos_lla[:, 1]), pos_lla[:, 2]), 1)
+        u = u / self.spacing
+        cell = np.floor(u)
+        frac = u - cell
+        cell = cell.astype(np.int64)
+        # tile of each cell, and the cell within the tile
+        tile = np.floor_divide(cell, self.tile_size)
+        cell = cell - tile * self.tile_size
+        # interpolate positions tile by tile
+        geo_mag = np.zeros(pos_lla.shape)
+        tile_min = tile.min(0)
+        tile_dims = tile.max(0) - tile_min + 1
+        tile_idx = np.ravel_multi_index((tile - tile_min).T, tile_dims)
+        keys, inverse = np.unique(tile_idx, return_inverse=True)
+        if keys.shape[0] == 1:
+            order = np.arange(tile_idx.shape[0])
+        else:
+            order = np.argsort(inverse, kind='stable')
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(inverse, minlength=keys.shape[0]))))
+        for k in range(keys.shape[0]):
+            key = np.unravel_index(keys[k], tile_dims) + tile_min
+            nodes = self.__get_tile(tuple(int(x) for x in key))
+            sel = order[bounds[k]:bounds[k+1]]
+            i, j, l = cell[sel, 0], cell[sel, 1], cell[sel, 2]
+            f = frac[sel]
+            acc = 0.0
+            for di in (0, 1):
+                wi = f[:, 0] if di else 1.0 - f[:, 0]
+                for dj in (0, 1):
+                    wj = f[:, 1] if dj else 1.0 - f[:, 1]
+                    for dl in (0, 1):
+                        wl = f[:, 2] if dl else 1.0 - f[:, 2]
+                        acc = acc + (wi*wj*wl)[:, np.newaxis] * nodes[i+di, j+dj, l+dl]
+            geo_mag[sel] = acc
+        return geo_mag.reshape(shape)
+
+    def clear(self):
+        '''
+        Remove all tiles.
+        '''
+        self.tiles = collections.OrderedDict()
+
+    def __get_tile(self, key):
+        '''
+        Node values of a tile, evaluated by the WMM when the tile is first used.
+        Args:
+            key: (lat, lon, alt) index of the tile.
+        Returns:
+            node values of the tile, nT.
+        '''
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        grid = []
+        for i in range(3):
+            start = key[i] * self.tile_size[i]
+            grid.append(np.arange(start, start + self.tile_size[i] + 1) * self.spacing[i])
+        # nodes beyond the poles are never used by interpolation
+        grid[0] = np.clip(grid[0], -90.0, 90.0)
+        lat, lon, alt = np.meshgrid(grid[0], grid[1], grid[2], indexing='ij')
+        mag = self.gm.GeoMagBatch(lat, lon, alt, self.time)
+        nodes = np.stack((mag.bx, mag.by, mag.bz), -1)
+        self.tiles[key] = nodes
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return nodes
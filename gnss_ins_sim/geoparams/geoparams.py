@@ -12,6 +12,7 @@ Created on 2017-09-12
 import math
 import numpy as np
 #import scipy.linalg
+from ..attitude import attitude
 
 # global
 VERSION = '1.0'
@@ -52,6 +53,36 @@ def geo_param(pos):
     g = g1 * (1.0 - (2.0/Re) * (1.0 + FLATTENING + m - 2.0*FLATTENING*sl_sqr)*h + 3.0*h*h/Re/Re)
     return rm, rn, g, sl, cl, W_IE
 
+def geo_param_batch(pos):
+    """
+    Calculate local radius and gravity given an array of [Lat, Lon, Alt].
+    This is the vectorized version of geo_param.
+    Args:
+        pos: numpy array of size (n,3) or (...,3), [Lat, Lon, Alt], rad, m
+    Returns:
+        rm: (n,) meridian radius, m
+        rn: (n,) normal radius, m
+        g: (n,) gravity, m/s/s
+        sl: (n,) sin(Lat)
+        cl: (n,) cos(lat)
+        w_ie: Earth's rotation rate w.r.t the inertial frame, rad/s
+    """
+    # some constants, same as geo_param
+    normal_gravity = 9.7803253359
+    k = 0.00193185265241
+    m = 0.00344978650684
+    # calc
+    sl = np.sin(pos[..., 0])
+    cl = np.cos(pos[..., 0])
+    sl_sqr = sl * sl
+    h = pos[..., 2]
+    tmp = np.sqrt(1.0 - E_SQR*sl_sqr)
+    rm = (Re*(1 - E_SQR)) / (tmp * (1.0 - E_SQR*sl_sqr))
+    rn = Re / tmp
+    g1 = normal_gravity * (1 + k*sl_sqr) / tmp
+    g = g1 * (1.0 - (2.0/Re) * (1.0 + FLATTENING + m - 2.0*FLATTENING*sl_sqr)*h + 3.0*h*h/Re/Re)
+    return rm, rn, g, sl, cl, W_IE
+
 def earth_radius(lat):
     """
     Calculate Earth meridian radius and normal radius.
@@ -90,26 +121,20 @@ def lla2ecef_batch(lla):
     '''
     [Lat Lon Alt] position to xyz position
     Args:
-        lla: [Lat, Lon, Alt], [rad, rad, meter], numpy array of size (n,3)
+        lla: [Lat, Lon, Alt], [rad, rad, meter], numpy array of size (3,), (n,3) or (...,3)
     return:
-        WGS-84 position, [x, y, z], [m, m, m], numpy array of size (n,3)
-    '''
-    # only one LLA
-    if lla.ndim == 1:
-        return lla2ecef(lla)
-    # multiple LLA
-    n = lla.shape[0]
-    xyz = np.zeros((n, 3))
-    for i in range(0, n):
-        sl = math.sin(lla[i, 0])
-        cl = math.cos(lla[i, 0])
-        sl_sqr = sl * sl
-        r = Re / math.sqrt(1.0 - E_SQR*sl_sqr)
-        rho = (r + lla[i, 2]) * cl
-
-        xyz[i, 0] = rho * math.cos(lla[i, 1])
-        xyz[i, 1] = rho * math.sin(lla[i, 1])
-        xyz[i, 2] = (r*(1.0-E_SQR) + lla[i, 2]) * sl
+        WGS-84 position, [x, y, z], [m, m, m], numpy array of the same size as lla
+    '''
+    lla = np.asarray(lla, dtype=float)
+    sl = np.sin(lla[..., 0])
+    cl = np.cos(lla[..., 0])
+    sl_sqr = sl * sl
+    r = Re / np.sqrt(1.0 - E_SQR*sl_sqr)
+    rho = (r + lla[..., 2]) * cl
+    xyz = np.zeros(lla.shape)
+    xyz[..., 0] = rho * np.cos(lla[..., 1])
+    xyz[..., 1] = rho * np.sin(lla[..., 1])
+    xyz[..., 2] = (r*(1.0-E_SQR) + lla[..., 2]) * sl
     return xyz
 
 def ecef2lla(xyz):
@@ -148,3 +173,101 @@ def ecef2lla(xyz):
     alt = rho*math.cos(lat) + (xyz[2] + e2*N*slat)*slat - N
     return np.array([lat, lon, alt])
 
+def ecef2lla_batch(xyz):
+    '''
+    [x y z] position in ECEF to [Lat Lon Alt]
+    Args:
+        WGS-84 position, [x, y, z], [m, m, m], numpy array of size (3,), (n,3) or (...,3)
+    return:
+        lla: [Lat, Lon, Alt], [rad, rad, meter], numpy array of the same size as xyz
+    '''
+    xyz = np.asarray(xyz, dtype=float)
+    # longitude
+    lon = np.arctan2(xyz[..., 1], xyz[..., 0])
+    # distance from the polar axis
+    rho = np.sqrt(xyz[..., 0]*xyz[..., 0] + xyz[..., 1]*xyz[..., 1])
+    # Spheroid properties
+    b = (1.0 - FLATTENING) * Re             # Semiminor axis
+    e2 = FLATTENING * (2.0 - FLATTENING)    # Square of (first) eccentricity
+    ep2 = e2 / (1.0 - e2)                   # Square of second eccentricity
+    # Bowring's formula for initial parametric (beta) and geodetic latitudes
+    beta = np.arctan2(xyz[..., 2], (1.0 - FLATTENING) * rho)
+    lat = np.arctan2(xyz[..., 2] + b*ep2*np.sin(beta)**3.0,\
+                     rho - Re*e2*np.cos(beta)**3.0)
+    # Fixed-point iteration with Bowring's formula
+    # (typically converges within two or three iterations). Converged positions are kept.
+    beta_new = np.arctan2((1.0 - FLATTENING)*np.sin(lat), np.cos(lat))
+    count = 0
+    active = beta != beta_new
+    while count < 5 and np.any(active):
+        beta = np.where(active, beta_new, beta)
+        lat_new = np.arctan2(xyz[..., 2] + b*ep2*np.sin(beta)**3.0,\
+                             rho - Re*e2*np.cos(beta)**3.0)
+        lat = np.where(active, lat_new, lat)
+        beta_new = np.arctan2((1.0 - FLATTENING)*np.sin(lat), np.cos(lat))
+        active = active & (beta != beta_new)
+        count += 1
+    # Ellipsoidal height from final value for latitude
+    slat = np.sin(lat)
+    N = Re/np.sqrt(1.0-e2*slat*slat)
+    alt = rho*np.cos(lat) + (xyz[..., 2] + e2*N*slat)*slat - N
+    return np.stack((lat, lon, alt), -1)
+
+def lla2ned_batch(lla, lla0):
+    '''
+    [Lat Lon Alt] position to position in the local NED frame with origin lla0.
+    Args:
+        lla: [Lat, Lon, Alt], [rad, rad, meter], numpy array of size (3,), (n,3) or (...,3)
+        lla0: origin of the NED frame, [Lat, Lon, Alt], [rad, rad, meter]
+    return:
+        ned: [N, E, D], [m, m, m], numpy array of the same size as lla
+    '''
+    lla0 = np.asarray(lla0, dtype=float)
+    c_ne = attitude.ecef_to_ned_batch(lla0[0], lla0[1])
+    return (lla2ecef_batch(lla) - lla2ecef_batch(lla0)).dot(c_ne.T)
+
+def ned2lla_batch(ned, lla0):
+    '''
+    Position in the local NED frame with origin lla0 to [Lat Lon Alt].
+    Args:
+        ned: [N, E, D], [m, m, m], numpy array of size (3,), (n,3) or (...,3)
+        lla0: origin of the NED frame, [Lat, Lon, Alt], [rad, rad, meter]
+    return:
+        lla: [Lat, Lon, Alt], [rad, rad, meter], numpy array of the same size as ned
+    '''
+    lla0 = np.asarray(lla0, dtype=float)
+    c_ne = attitude.ecef_to_ned_batch(lla0[0], lla0[1])
+    return ecef2lla_batch(lla2ecef_batch(lla0) + np.asarray(ned, dtype=float).dot(c_ne))
+
+def lla2enu_batch(lla, lla0):
+    '''
+    [Lat Lon Alt] position to position in the local ENU frame with origin lla0.
+    Args:
+        lla: [Lat, Lon, Alt], [rad, rad, meter], numpy array of size (3,), (n,3) or (...,3)
+        lla0: origin of the ENU frame, [Lat, Lon, Alt], [rad, rad, meter]
+    return:
+        enu: [E, N, U], [m, m, m], numpy array of the same size as lla
+    '''
+    return ned_enu(lla2ned_batch(lla, lla0))
+
+def enu2lla_batch(enu, lla0):
+    '''
+    Position in the local ENU frame with origin lla0 to [Lat Lon Alt].
+    Args:
+        enu: [E, N, U], [m, m, m], numpy array of size (3,), (n,3) or (...,3)
+        lla0: origin of the ENU frame, [Lat, Lon, Alt], [rad, rad, meter]
+    return:
+        lla: [Lat, Lon, Alt], [rad, rad, meter], numpy array of the same size as enu
+    '''
+    return ned2lla_batch(ned_enu(enu), lla0)
+
+def ned_enu(x):
+    '''
+    Swap between NED and ENU. The conversion is the same in both directions.
+    Args:
+        x: [N, E, D] or [E, N, U], numpy array of size (3,), (n,3) or (...,3)
+    return:
+        [E, N, U] or [N, E, D], numpy array of the same size as x
+    '''
+    x = np.asarray(x, dtype=float)
+    return np.stack((x[..., 1], x[..., 0], -x[..., 2]), -1)
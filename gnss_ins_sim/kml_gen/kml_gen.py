@@ -9,6 +9,7 @@ Created on 2017-11-29
 
 import os
 import math
+import zipfile
 import numpy as np
 from ..geoparams import geoparams
 from ..attitude import attitude
@@ -51,6 +52,35 @@ kmlstr_end = '''
 </kml>
 '''
 
+# templates of KMZ files with tracks as lines
+DEFAULT_TOL = 0.5           # m, default max deviation of a simplified track from the original
+COORD_BLOCK_SIZE = 10000    # number of coordinates formatted together
+kmzstr_header = '''<?xml version = "1.0" encoding = "UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+<Document>
+   <name>%s</name>'''
+kmzstr_folder_begin = '''
+   <Folder>
+      <name>%s</name>'''
+kmzstr_folder_end = '''
+   </Folder>'''
+kmzstr_track_begin = '''
+   <Placemark>
+      <name>%s</name>
+      <Style> <LineStyle> <color>%s</color> <width>2</width> </LineStyle> </Style>
+      <MultiGeometry>'''
+kmzstr_line_begin = '''
+         <LineString>
+            <tessellate>1</tessellate>
+            <coordinates>
+'''
+kmzstr_line_end = '''            </coordinates>
+         </LineString>'''
+kmzstr_track_end = '''
+      </MultiGeometry>
+   </Placemark>'''
+kmzstr_coord = '%.9f,%.9f,%.3f\n'
+
 def kml_gen(data_dir, pos, heading=None, name='pathgen', convert_to_lla=False, 
             color='ffff0000', max_points=None):
     '''
@@ -75,25 +105,10 @@ def kml_gen(data_dir, pos, heading=None, name='pathgen', convert_to_lla=False,
         None.
     '''
     # get lla from pos
-    pos = pos.copy()
-    n = pos.shape[0]
-    if convert_to_lla is False:
-        lla = pos
-        lla[:, 0] = lla[:, 0] * R2D
-        lla[:, 1] = lla[:, 1] * R2D
-    else:
-        # ned to lla
-        lla = np.zeros(pos.shape)
-        # virtual inertial frame is defined by initial position
-        lla[0, :] = geoparams.ecef2lla(pos[0, :])
-        c_ne = attitude.ecef_to_ned(lla[0, 0], lla[0, 1])
-        for i in range(1, n):
-            ned_pos = pos[i, :]-pos[0, :]
-            ecef_pos = pos[0, :] + c_ne.T.dot(ned_pos)
-            lla[i, :] = geoparams.ecef2lla(ecef_pos)
-        # rad to deg
-        lla[:, 0] = lla[:, 0] * R2D
-        lla[:, 1] = lla[:, 1] * R2D
+    lla = pos_to_lla(pos, convert_to_lla)
+    lla[:, 0] = lla[:, 0] * R2D
+    lla[:, 1] = lla[:, 1] * R2D
+    if convert_to_lla is not False:
         # save lla to .csv file. ** This is needed by the web version.
         header_line = 'Latitude (deg), Longitude (deg), Altitude (deg)'
         file_name = data_dir + '//' + name + '_LLA.csv'
@@ -128,4 +143,163 @@ def kml_gen(data_dir, pos, heading=None, name='pathgen', convert_to_lla=False,
     # write end
     f.write(kmlstr_end)
     f.close()
-    
\ No newline at end of file
+    
+def pos_to_lla(pos, convert_to_lla=False):
+    '''
+    Get [Lat Lon Alt] from position data.
+    Args:
+        pos: nx3 [lat, lon, alt] in rad and m, or [x, y, z] in m
+        convert_to_lla: true if position data are generated in a virtual inertial frame.
+            See kml_gen.
+    Returns:
+        lla: nx3 [lat, lon, alt], rad and m. This is a copy of pos.
+    '''
+    pos = np.array(pos, dtype=float)
+    if convert_to_lla is False:
+        return pos
+    # virtual inertial frame is defined by initial position
+    lla = np.zeros(pos.shape)
+    lla[0, :] = geoparams.ecef2lla(pos[0, :])
+    c_ne = attitude.ecef_to_ned(lla[0, 0], lla[0, 1])
+    # ned to lla
+    ecef_pos = pos[0, :] + (pos[1:, :] - pos[0, :]).dot(c_ne)
+    lla[1:, :] = geoparams.ecef2lla_batch(ecef_pos)
+    return lla
+
+def simplify_track(xyz, tol=DEFAULT_TOL):
+    '''
+    Simplify a track by the Douglas-Peucker algorithm. Points are removed so that the removed
+    points are within tol of the simplified track, and turns are kept.
+    Args:
+        xyz: nx3 positions of the track in a Cartesian frame, m.
+        tol: max distance from a removed point to the simplified track, m.
+    Returns:
+        indices of the points in the simplified track, in ascending order.
+    '''
+    n = xyz.shape[0]
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    tol_sqr = tol * tol
+    segments = [(0, n-1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        # squared distance from the points between start and end to the line segment
+        d = xyz[end] - xyz[start]
+        v = xyz[start+1:end] - xyz[start]
+        d_sqr = d.dot(d)
+        if d_sqr > 0.0:
+            t = np.clip(v.dot(d) / d_sqr, 0.0, 1.0)
+            v = v - t[:, np.newaxis] * d
+        dist_sqr = np.sum(v*v, 1)
+        idx = np.argmax(dist_sqr)
+        if dist_sqr[idx] > tol_sqr:
+            idx = start + 1 + idx
+            keep[idx] = True
+            segments.append((start, idx))
+            segments.append((idx, end))
+    return np.nonzero(keep)[0]
+
+class KmzWriter(object):
+    '''
+    Write tracks as lines to a .kmz file. Tracks are simplified by simplify_track, and written
+    to the file one by one, so that all tracks need not be kept in memory.
+    '''
+    def __init__(self, file_name, name='gnss-ins-sim', tol=DEFAULT_TOL):
+        '''
+        Args:
+            file_name: name of the .kmz file.
+            name: name of the KML document.
+            tol: max deviation of the simplified tracks from the original tracks, m.
+                If tol is None, tracks are not simplified.
+        '''
+        self.tol = tol
+        self.zip = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED)
+        self.f = self.zip.open('doc.kml', 'w')
+        self.in_folder = False
+        self.__write(kmzstr_header % name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def begin_folder(self, name):
+        '''
+        Begin a folder. Tracks added later are put in this folder until end_folder is called.
+        Args:
+            name: name of the folder.
+        '''
+        self.end_folder()
+        self.__write(kmzstr_folder_begin % name)
+        self.in_folder = True
+
+    def end_folder(self):
+        '''
+        End the current folder, if any.
+        '''
+        if self.in_folder:
+            self.__write(kmzstr_folder_end)
+            self.in_folder = False
+
+    def add_track(self, name, lla, color='ffff0000', valid=None):
+        '''
+        Add a track.
+        Args:
+            name: name of the track.
+            lla: nx3 [lat, lon, alt], rad and m.
+            color: color and opacity of the track, aabbggrr. See kml_gen.
+            valid: n boolean values to specify which points are valid, e.g., GPS visibility.
+                Invalid points are skipped, and the track is split into segments of
+                consecutive valid points. Segments of a single point are skipped. None means
+                all points are valid.
+        '''
+        lla = np.asarray(lla, dtype=float)
+        if lla.ndim == 1:
+            lla = lla.reshape((1, 3))
+        if valid is None:
+            valid = np.ones(lla.shape[0], dtype=bool)
+        valid = np.asarray(valid).astype(bool)
+        # start and end+1 of each segment of consecutive valid points
+        edges = np.diff(np.concatenate(([0], valid.astype(np.int8), [0])))
+        starts = np.nonzero(edges == 1)[0]
+        ends = np.nonzero(edges == -1)[0]
+        # a line needs at least two points
+        long_enough = (ends - starts) > 1
+        starts = starts[long_enough]
+        ends = ends[long_enough]
+        self.__write(kmzstr_track_begin % (name, color))
+        if starts.shape[0] > 0:
+            # simplification in the NED frame at the first valid point
+            ned = geoparams.lla2ned_batch(lla, lla[starts[0]])
+        for i in range(starts.shape[0]):
+            idx = np.arange(starts[i], ends[i])
+            if self.tol is not None:
+                idx = idx[simplify_track(ned[idx], self.tol)]
+            self.__write(kmzstr_line_begin)
+            coords = np.stack((lla[idx, 1]*R2D, lla[idx, 0]*R2D, lla[idx, 2]), 1)
+            for j in range(0, coords.shape[0], COORD_BLOCK_SIZE):
+                block = coords[j:j+COORD_BLOCK_SIZE]
+                self.__write((kmzstr_coord * block.shape[0]) % tuple(block.flat))
+            self.__write(kmzstr_line_end)
+        self.__write(kmzstr_track_end)
+
+    def close(self):
+        '''
+        Finish the document and close the file.
+        '''
+        if self.f is None:
+            return
+        self.end_folder()
+        self.__write(kmlstr_end)
+        self.f.close()
+        self.zip.close()
+        self.f = None
+
+    def __write(self, lines):
+        self.f.write(lines.encode('utf-8'))
@@ -8,6 +8,11 @@ Created on 2017-09-12
             and angular velocity.
 20171028:   Remove magnetic inclination when reference frame is a virtual inertial
             frame (ref_frame==1).
+20261018:   Generate type-1 segments in closed form once the command filter has settled.
+            Add the 4th-order Runge-Kutta integration scheme.
+            Geomagnetic field along the trajectory from a tile cache.
+            Generate Gauss-Markov bias drift in vectorized blocks.
+            Generate PSD vibration of any length by overlap-add filtering.
 @author: dongxiaoguang
 """
 
@@ -16,14 +21,26 @@ import math
 import numpy as np
 from ..attitude import attitude
 from ..geoparams import geoparams
-from ..geoparams import geomag
 from ..psd import time_series_from_psd
+from . import pathgen_vec
 
 # global
 VERSION = '1.0'
 D2R = math.pi/180
+# motion command filter and PD controller params shared by all trajectory engines
+CMD_FILT_ALPHA = 0.9            # for the low pass filter of the motion commands
+CTRL_KP = 5.0                   # kp and kd are PD controller params
+CTRL_KD = 10.0
+ATT_CONVERGE_THRESHOLD = 1e-4   # threshold to determine if the command is completed
+VEL_CONVERGE_THRESHOLD = 1e-4
+# type-1 segments whose command filter has settled are generated in closed form
+CMD_SETTLE_THRESHOLD = 1e-6     # max difference between the filter output and the command
+FAST_PATH_MIN_COUNT = 100       # min remaining simulation count to use the closed form
+# numerical integration schemes of the trajectory
+INTEGRATION_SCHEMES = ['euler', 'rk4']
 
-def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, magnet=False):
+def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, magnet=False,
+             implicit_index=False, dtype=np.float64, integration='euler', mag_cache=None):
     """
     Generate IMU and GPS or odometer data file according to initial position\velocity\attitude,
     motion command and simulation mode.
@@ -59,6 +76,33 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
             True: Geomagnetic field in the body frame will be calculaed.
                 For ref_frame==0, N is geographic north, and there is declination;
                 For ref_frame==1, there is no declination.
+        implicit_index:
+            False: the first column of each output is the sample index (default).
+            True: the index column is removed from all outputs. The index of the k-th row is
+                start + k*step, and [start, step] of each output is given in
+                path_results['index'].
+        dtype: data type of the outputs. np.float64 by default. np.float32 halves the memory,
+            but float32 only has about 7 significant digits. That is about 0.5m for Lat/Lon in
+            rad and for xyz position in the ECEF frame.
+        integration: numerical integration scheme of the trajectory. In both schemes, the Euler
+            angle change rate and the velocity change rate given by the motion commands are
+            constant within a simulation step, so attitude and velocity are exact.
+            'euler': forward Euler (default). Position and travel distance are integrated with
+                the velocity at the beginning of each step, and the true IMU output is the value
+                at the beginning of each step. The position error grows with the step size, and
+                a large simulation over sample ratio is needed for an accurate trajectory.
+            'rk4': Position and travel distance are integrated with the classical 4th-order
+                Runge-Kutta method, and the true IMU output is the average over each step (what
+                an ideal integrating sensor measures) using the same RK4 stages. This is about
+                3~4 times the computation of 'euler' per step, but the position error is
+                several orders of magnitude smaller, so the over sample ratio can stay at 1.
+        mag_cache: geomagnetic field along the trajectory when magnet is True and ref_frame==0.
+            None: interpolated from the tile cache shared in this process, whose error is
+                below geomag_cache.DEFAULT_TOL (default).
+            a geomag_cache.GeoMagTileCache object: interpolated from it, e.g. to use another
+                error tolerance.
+            False: the field at the initial position is used for the whole trajectory.
+            For ref_frame==1, the field at the initial position is always used.
     Returns:
         path_results. Resutls of path generation.
             'status':  True: Everything is OK.
@@ -82,6 +126,9 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
             'odo':      True odometer measurements.
                         [index, travel_distance, velocity_in_body_frame].
                         Odometry are down sampled to odd_freq, index synced with mimu.csv index.
+            'index':    {'imu': [start, step], 'gps': [start, step]}, only when implicit_index is
+                        True. 'imu' also applies to 'nav', 'mag' and 'odo'. 'gps' is present only
+                        when GPS is enabled.
     """
     ### path generation results
     path_results = {'status': True,
@@ -91,6 +138,9 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
                     'gps': [],
                     'odo': []}
 
+    if integration not in INTEGRATION_SCHEMES:
+        raise ValueError("integration should be one of %s, but got %s."\
+                         % (INTEGRATION_SCHEMES, integration))
     ### sim freq and data output freq
     out_freq = output_def[0, 1]     # IMU output frequency
     sim_osr = output_def[0, 0]      # simulation over sample ratio w.r.t IMU output freq
@@ -98,16 +148,16 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
     dt = 1.0 / sim_freq             # simulation period
 
     ### Path gen command filter to make trajectory smoother
-    alpha = 0.9                     # for the low pass filter of the motion commands
+    alpha = CMD_FILT_ALPHA          # for the low pass filter of the motion commands
     filt_a = alpha * np.eye(3)
     filt_b = (1-alpha) * np.eye(3)
     max_acc = mobility[0]           # 10.0m/s2, max acceleratoin
     max_dw = mobility[1]            # 0.5rad/s2    # max angular acceleration, rad/s/s
     max_w = mobility[2]             # 1.0rad/s       # max angular velocity, rad/s
-    kp = 5.0                        # kp and kd are PD controller params
-    kd = 10.0
-    att_converge_threshold = 1e-4   # threshold to determine if the command is completed
-    vel_converge_threshold = 1e-4
+    kp = CTRL_KP                    # kp and kd are PD controller params
+    kd = CTRL_KD
+    att_converge_threshold = ATT_CONVERGE_THRESHOLD # threshold to determine if the command
+    vel_converge_threshold = VEL_CONVERGE_THRESHOLD # is completed
     att_dot = np.zeros(3)           # Euler angle change rate
     vel_dot_b = np.zeros(3)         # Velocity change rate in the body frame
 
@@ -124,28 +174,35 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
     if sim_count_max <= 0:
         raise ValueError("Total time duration in the motion definition file must be above 0.")
     ### create output arrays
-    sim_count_max = int(sim_count_max)
-    imu_data = np.zeros((sim_count_max, 7))
-    nav_data = np.zeros((sim_count_max, 10))
+    # The output arrays are sized from the total simulation count and the output periods.
+    # imu/nav/mag/odo are output every sim_osr simulation steps, and gps every output_def[1, 1]
+    # simulation steps.
+    sim_count_total = int(np.sum(motion_def[:, 7]))
+    col = 0 if implicit_index else 1                # column of the first data after the index
+    n_high_freq = int(math.ceil(sim_count_total / sim_osr))
+    imu_data = np.zeros((n_high_freq, 6+col), dtype=dtype)
+    nav_data = np.zeros((n_high_freq, 9+col), dtype=dtype)
     enable_gps = False
     enable_odo = False
     if output_def.shape[0] == 3:
         if output_def[1, 0] == 1:
             enable_gps = True
-            gps_data = np.zeros((sim_count_max, 8))
             output_def[1, 1] = sim_osr * round(out_freq / output_def[1, 1])
+            gps_data = np.zeros((int(math.ceil(sim_count_total / output_def[1, 1])), 7+col),
+                                dtype=dtype)
         else:
             output_def[1, 0] = -1
         if output_def[2, 0] == 1:
             enable_odo = True
-            odo_data = np.zeros((sim_count_max, 5))
+            # odometer data are output at the same rate as the IMU
+            odo_data = np.zeros((n_high_freq, 4+col), dtype=dtype)
             output_def[2, 1] = sim_osr * round(out_freq / output_def[2, 1])
         else:
             output_def[2, 0] = -1
     else:
         raise ValueError("output_def should be of size 3x2.")
     if magnet:
-        mag_data = np.zeros((sim_count_max, 4))
+        mag_data = np.zeros((n_high_freq, 3+col), dtype=dtype)
 
     ### start computations
     sim_count = 0               # number of total simulation data
@@ -161,14 +218,8 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
     pos_delta_n = np.zeros(3)                   # pos change
     earth_param = geoparams.geo_param(pos_n)    # geo parameters
     g = earth_param[2]                          # local gravity at ini pos
-    if magnet:                                  # geomagnetic parameters at the initial position
-        gm = geomag.GeoMag("WMM.COF")
-        geo_mag = gm.GeoMag(pos_n[0]/D2R, pos_n[1]/D2R, pos_n[2]) # units in nT and deg
-        geo_mag_n = np.array([geo_mag.bx, geo_mag.by, geo_mag.bz])
-        geo_mag_n = geo_mag_n / 1000.0          # nT to uT
-        if ref_frame == 1:                      # remove inclination
-            geo_mag_n[0] = math.sqrt(geo_mag_n[0]*geo_mag_n[0] + geo_mag_n[1]*geo_mag_n[1])
-            geo_mag_n[1] = 0.0
+    if magnet:                                  # geomagnetic field along the trajectory
+        geo_mag_n, mag_cache = pathgen_vec.geo_mag_source(pos_n, ref_frame, mag_cache)
     ## start trajectory generation
     if ref_frame == 1:      # if using virtual inertial frame, convert LLA to ECEF xyz
         pos_n = geoparams.lla2ecef(pos_n)
@@ -194,6 +245,59 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
         sim_count_max = sim_count + motion_def[i, 7]    # max cycles to execute command of this seg
         com_complete = 0                                # complete command of this seg, go to next
         while (sim_count < sim_count_max) and (com_complete == 0):
+            # If the command filter of a type-1 segment has settled, the Euler angle change rate
+            # and velocity change rate are (almost) constant. The rest of this segment has a
+            # closed-form solution and is generated in batch.
+            if com_type == 1 and (sim_count_max - sim_count) >= FAST_PATH_MIN_COUNT and\
+                    np.max(np.abs(att_dot - att_dot_com)) < CMD_SETTLE_THRESHOLD and\
+                    np.max(np.abs(vel_dot_b - vel_dot_com)) < CMD_SETTLE_THRESHOLD:
+                seg = gen_rate_segment(int(sim_count_max - sim_count), pos_n, pos_delta_n,
+                                       odo_dist, vel_b, att, att_dot, vel_dot_b, att_dot_com,
+                                       vel_dot_com, dt, ref_frame, g, integration)
+                counts = sim_count + np.arange(seg['acc'].shape[0])
+                # IMU measurement and navigation results
+                idx = np.nonzero(counts % sim_osr == 0)[0]
+                idx_end = idx_high_freq + idx.shape[0]
+                acc_avg, acc_sum = pathgen_vec.window_sum(seg['acc'], idx, acc_sum)
+                gyro_avg, gyro_sum = pathgen_vec.window_sum(seg['gyro'], idx, gyro_sum)
+                rows = slice(idx_high_freq, idx_end)
+                imu_data[rows, col:col+3] = acc_avg / sim_osr
+                imu_data[rows, col+3:col+6] = gyro_avg / sim_osr
+                nav_data[rows, col:col+3] = pos_n + seg['pos_delta'][idx]
+                nav_data[rows, col+3:col+6] = seg['vel_n'][idx]
+                nav_data[rows, col+6:col+9] =\
+                    pathgen_vec.euler_angle_range_three_axis(seg['att'][idx])
+                if not implicit_index:
+                    imu_data[rows, 0] = counts[idx]
+                    nav_data[rows, 0] = counts[idx]
+                if enable_odo:
+                    odo_data[rows, col] = seg['odo_dist'][idx]
+                    odo_data[rows, col+1:col+4] = seg['vel_b'][idx]
+                    if not implicit_index:
+                        odo_data[rows, 0] = counts[idx]
+                idx_high_freq = idx_end
+                # GPS measurement
+                if enable_gps:
+                    idx = np.nonzero(counts % output_def[1, 1] == 0)[0]
+                    idx_end = idx_low_freq + idx.shape[0]
+                    rows = slice(idx_low_freq, idx_end)
+                    gps_data[rows, col:col+3] = pos_n + seg['pos_delta'][idx]
+                    gps_data[rows, col+3:col+6] = seg['vel_n'][idx]
+                    gps_data[rows, col+6] = gps_visibility
+                    if not implicit_index:
+                        gps_data[rows, 0] = counts[idx]
+                    idx_low_freq = idx_end
+                # states at the end of this segment
+                pos_delta_n = seg['pos_delta'][-1]
+                odo_dist = seg['odo_dist'][-1]
+                vel_b = seg['vel_b'][-1]
+                att = seg['att'][-1]
+                att_dot = seg['att_dot'][-1]
+                vel_dot_b = seg['vel_dot_b'][-1]
+                c_nb = attitude.euler2dcm(att, 'zyx').T     # b to n
+                vel_n = c_nb.dot(vel_b)
+                sim_count += seg['acc'].shape[0]
+                break
             # handle the input motion commands
             if com_type == 1:
                 att_dot = filt_a.dot(att_dot) + filt_b.dot(att_dot_com)         # filter input
@@ -225,11 +329,17 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
                     #vel_dot_b = (vel_com_b - vel_b) / dt
 
             # compute IMU outputs according to pos/vel/att changes
-            imu_results = calc_true_sensor_output(pos_n+pos_delta_n, vel_b, att, c_nb, vel_dot_b,
-                                                  att_dot, ref_frame, g)
-            acc = imu_results[0]
-            gyro = imu_results[1]
-            pos_dot_n = imu_results[3]  # lla change rate if NED, vel_n if virtual inertial
+            if integration == 'euler':
+                imu_results = calc_true_sensor_output(pos_n+pos_delta_n, vel_b, att, c_nb,
+                                                      vel_dot_b, att_dot, ref_frame, g)
+                acc = imu_results[0]
+                gyro = imu_results[1]
+                pos_dot_n = imu_results[3]  # lla change rate if NED, vel_n if virtual inertial
+                pos_step = pos_dot_n*dt
+                odo_step = np.sqrt(np.dot(vel_b, vel_b))*dt
+            else:
+                acc, gyro, pos_step, odo_step = rk4_step(pos_n+pos_delta_n, vel_b, att, c_nb,
+                                                         vel_dot_b, att_dot, dt, ref_frame, g)
             # update IMU results
             acc_sum = acc_sum + acc
             gyro_sum = gyro_sum + gyro
@@ -247,64 +357,43 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
                 gyro_avg = gyro_sum / sim_osr
                 # write to files
                 #imu_data[idx_high_freq, :] = np.hstack((idx_high_freq, acc_avg, gyro_avg))
-                imu_data[idx_high_freq, 0] = sim_count
-                imu_data[idx_high_freq, 1] = acc_avg[0]
-                imu_data[idx_high_freq, 2] = acc_avg[1]
-                imu_data[idx_high_freq, 3] = acc_avg[2]
-                imu_data[idx_high_freq, 4] = gyro_avg[0]
-                imu_data[idx_high_freq, 5] = gyro_avg[1]
-                imu_data[idx_high_freq, 6] = gyro_avg[2]
+                imu_data[idx_high_freq, col:col+3] = acc_avg
+                imu_data[idx_high_freq, col+3:col+6] = gyro_avg
                 # nav data
-                nav_data[idx_high_freq, 0] = sim_count
-                nav_data[idx_high_freq, 1] = pos_n[0] + pos_delta_n[0]
-                nav_data[idx_high_freq, 2] = pos_n[1] + pos_delta_n[1]
-                nav_data[idx_high_freq, 3] = pos_n[2] + pos_delta_n[2]
-                nav_data[idx_high_freq, 4] = vel_n[0]
-                nav_data[idx_high_freq, 5] = vel_n[1]
-                nav_data[idx_high_freq, 6] = vel_n[2]
-                euler_angles = attitude.euler_angle_range_three_axis(att)
-                nav_data[idx_high_freq, 7] = euler_angles[0] # yaw [-pi, pi]
-                nav_data[idx_high_freq, 8] = euler_angles[1] # pitch [-pi/2, pi/2]
-                nav_data[idx_high_freq, 9] = euler_angles[2] # roll [-pi, pi]
+                nav_data[idx_high_freq, col:col+3] = pos_n + pos_delta_n
+                nav_data[idx_high_freq, col+3:col+6] = vel_n
+                # yaw [-pi, pi], pitch [-pi/2, pi/2], roll [-pi, pi]
+                nav_data[idx_high_freq, col+6:col+9] = attitude.euler_angle_range_three_axis(att)
+                if not implicit_index:
+                    imu_data[idx_high_freq, 0] = sim_count
+                    nav_data[idx_high_freq, 0] = sim_count
                 # next cycle
                 acc_sum = np.zeros(3)
                 gyro_sum = np.zeros(3)
-                # update magnetometer results
-                if magnet:
-                    geo_mag_b = c_nb.T.dot(geo_mag_n)
-                    #mag_data[idx_high_freq, :] = np.hstack((idx_high_freq, geo_mag_b))
-                    mag_data[idx_high_freq, 0] = sim_count
-                    mag_data[idx_high_freq, 1] = geo_mag_b[0]
-                    mag_data[idx_high_freq, 2] = geo_mag_b[1]
-                    mag_data[idx_high_freq, 3] = geo_mag_b[2]
                 # update odometer results
                 if enable_odo:
                     #odo_data[idx_high_freq, :] = np.hstack((idx_high_freq,
                     #                                       odo_dist, odo_vel))
-                    odo_data[idx_high_freq, 0] = sim_count
-                    odo_data[idx_high_freq, 1] = odo_dist
-                    odo_data[idx_high_freq, 2] = odo_vel[0]
-                    odo_data[idx_high_freq, 3] = odo_vel[1]
-                    odo_data[idx_high_freq, 4] = odo_vel[2]
+                    odo_data[idx_high_freq, col] = odo_dist
+                    odo_data[idx_high_freq, col+1:col+4] = odo_vel
+                    if not implicit_index:
+                        odo_data[idx_high_freq, 0] = sim_count
                 # index increment
                 idx_high_freq += 1
             # GPS or odometer measurement
             if enable_gps:
                 if (sim_count % output_def[1, 1]) == 0:     # measurement period
-                    gps_data[idx_low_freq, 0] = sim_count
-                    gps_data[idx_low_freq, 1] = pos_n[0] + pos_delta_n[0]
-                    gps_data[idx_low_freq, 2] = pos_n[1] + pos_delta_n[1]
-                    gps_data[idx_low_freq, 3] = pos_n[2] + pos_delta_n[2]
-                    gps_data[idx_low_freq, 4] = vel_n[0]
-                    gps_data[idx_low_freq, 5] = vel_n[1]
-                    gps_data[idx_low_freq, 6] = vel_n[2]
-                    gps_data[idx_low_freq, 7] = gps_visibility
+                    gps_data[idx_low_freq, col:col+3] = pos_n + pos_delta_n
+                    gps_data[idx_low_freq, col+3:col+6] = vel_n
+                    gps_data[idx_low_freq, col+6] = gps_visibility
+                    if not implicit_index:
+                        gps_data[idx_low_freq, 0] = sim_count
                     # index increment
                     idx_low_freq += 1
 
             # accumulate pos/vel/att change
-            pos_delta_n = pos_delta_n + pos_dot_n*dt    # accumulated pos change
-            odo_dist = odo_dist + np.sqrt(np.dot(vel_b, vel_b))*dt
+            pos_delta_n = pos_delta_n + pos_step        # accumulated pos change
+            odo_dist = odo_dist + odo_step
             vel_b = vel_b + vel_dot_b*dt
             att = att + att_dot*dt
             c_nb = attitude.euler2dcm(att, 'zyx').T     # b to n
@@ -321,13 +410,103 @@ def path_gen(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, mag
     path_results['imu'] = imu_data[0:idx_high_freq, :]
     path_results['nav'] = nav_data[0:idx_high_freq, :]
     if magnet:
+        # magnetometer results, calculated from the true attitude and position in one pass
+        att = nav_data[0:idx_high_freq, col+6:col+9].astype(float)
+        c_nb = pathgen_vec.euler2dcm_zyx(att).swapaxes(-1, -2)     # b to n
+        mag_data[0:idx_high_freq, col:col+3] = pathgen_vec.geo_mag_body(
+            c_nb, nav_data[0:idx_high_freq, col:col+3].astype(float), geo_mag_n, mag_cache)
+        if not implicit_index:
+            mag_data[0:idx_high_freq, 0] = nav_data[0:idx_high_freq, 0]
         path_results['mag'] = mag_data[0:idx_high_freq, :]
     if enable_odo:
         path_results['odo'] = odo_data[0:idx_high_freq, :]
     if enable_gps:
         path_results['gps'] = gps_data[0:idx_low_freq, :]
+    if implicit_index:
+        path_results['index'] = {'imu': [0, int(sim_osr)]}
+        if enable_gps:
+            path_results['index']['gps'] = [0, int(output_def[1, 1])]
     return path_results
 
+def gen_rate_segment(n, pos_n, pos_delta_n, odo_dist, vel_b, att, att_dot, vel_dot_b,
+                     att_dot_com, vel_dot_com, dt, ref_frame, g, integration='euler'):
+    """
+    Generate n simulation steps of a type-1 segment in closed form.
+    Args:
+        n: number of simulation steps.
+        pos_n: 3x1 initial position of the simulation.
+        pos_delta_n: 3x1 position change accumulated before this segment.
+        odo_dist: travel distance accumulated before this segment.
+        vel_b: 3x1 velocity in the body frame before the first step.
+        att: 3x1 Euler angles before the first step.
+        att_dot: 3x1 Euler angle change rate (filter output) before the first step.
+        vel_dot_b: 3x1 velocity change rate (filter output) before the first step.
+        att_dot_com: 3x1 commanded Euler angle change rate.
+        vel_dot_com: 3x1 commanded velocity change rate in the body frame.
+        dt: simulation period, sec.
+        ref_frame: See doc of function path_gen.
+        g: Gravity, only used when ref_frame==1, m/s/s.
+        integration: See doc of function path_gen.
+    Returns:
+        a dict. 'att', 'vel_b', 'att_dot', 'vel_dot_b', 'vel_n', 'c_nb', 'acc' and 'gyro' are
+        the states and true IMU output at each step. 'att' and 'vel_b' have an extra row for
+        the states after the last step. 'pos_delta' is the accumulated position change and
+        'odo_dist' is the accumulated travel distance, both of size n+1 and the last row is the
+        value after the last step.
+    """
+    states = pathgen_vec.gen_states_rate(att, vel_b, att_dot, vel_dot_b,
+                                         np.array(att_dot_com, dtype=float),
+                                         np.array(vel_dot_com, dtype=float), n, dt)
+    seg = {}
+    seg['att'] = np.vstack((states[0], states[4]))
+    seg['vel_b'] = np.vstack((states[1], states[5]))
+    seg['att_dot'] = states[2]
+    seg['vel_dot_b'] = states[3]
+    seg['c_nb'], seg['vel_n'], seg['pos_delta'], seg['acc'], seg['gyro'], odo_delta =\
+        pathgen_vec.integrate_states(pos_n, pos_delta_n, states[0], states[1], states[2],
+                                     states[3], dt, ref_frame, g, integration)
+    seg['odo_dist'] = np.cumsum(np.hstack((odo_dist, odo_delta)))
+    return seg
+
+def rk4_step(pos_n, vel_b, att, c_nb, vel_dot_b, att_dot, dt, ref_frame, g):
+    """
+    Integrate a simulation step with the classical 4th-order Runge-Kutta method. The Euler angle
+    change rate and the velocity change rate are constant within the step.
+    Args:
+        pos_n, vel_b, att, c_nb: states at the beginning of the step, see calc_true_sensor_output.
+        vel_dot_b: Velocity change rate in the body frame, m/s/s
+        att_dot: Euler angle change rate, [yaw_d, pitch_d, roll_d], rad/s
+        dt: simulation period, sec.
+        ref_frame: See doc of function path_gen.
+        g: Gravity, only used when ref_frame==1, m/s/s.
+    Returns:
+        [0]: 3x1 true accelerometer output averaged over the step, m/s/s
+        [1]: 3x1 true gyro output averaged over the step, rad/s
+        [2]: 3x1 position change of the step
+        [3]: travel distance of the step, m
+    """
+    # states in the middle and at the end of the step
+    att_mid = att + 0.5*dt*att_dot
+    vel_b_mid = vel_b + 0.5*dt*vel_dot_b
+    c_nb_mid = attitude.euler2dcm(att_mid, 'zyx').T
+    att_end = att + dt*att_dot
+    vel_b_end = vel_b + dt*vel_dot_b
+    c_nb_end = attitude.euler2dcm(att_end, 'zyx').T
+    # RK4 stages
+    r1 = calc_true_sensor_output(pos_n, vel_b, att, c_nb, vel_dot_b, att_dot, ref_frame, g)
+    r2 = calc_true_sensor_output(pos_n + 0.5*dt*r1[3], vel_b_mid, att_mid, c_nb_mid,
+                                 vel_dot_b, att_dot, ref_frame, g)
+    r3 = calc_true_sensor_output(pos_n + 0.5*dt*r2[3], vel_b_mid, att_mid, c_nb_mid,
+                                 vel_dot_b, att_dot, ref_frame, g)
+    r4 = calc_true_sensor_output(pos_n + dt*r3[3], vel_b_end, att_end, c_nb_end,
+                                 vel_dot_b, att_dot, ref_frame, g)
+    acc = (r1[0] + 2.0*r2[0] + 2.0*r3[0] + r4[0]) / 6.0
+    gyro = (r1[1] + 2.0*r2[1] + 2.0*r3[1] + r4[1]) / 6.0
+    pos_step = (r1[3] + 2.0*r2[3] + 2.0*r3[3] + r4[3]) * (dt/6.0)
+    odo_step = (math.sqrt(np.dot(vel_b, vel_b)) + 4.0*math.sqrt(np.dot(vel_b_mid, vel_b_mid)) +
+                math.sqrt(np.dot(vel_b_end, vel_b_end))) * (dt/6.0)
+    return acc, gyro, pos_step, odo_step
+
 def calc_true_sensor_output(pos_n, vel_b, att, c_nb, vel_dot_b, att_dot, ref_frame, g):
     """
     Calculate true IMU results from attitude change rate and velocity
@@ -438,7 +617,7 @@ def parse_motion_def(motion_def_seg, att, vel):
         vel_com = [motion_def_seg[4], motion_def_seg[5], motion_def_seg[6]]
     return att_com, vel_com
 
-def acc_gen(fs, ref_a, acc_err, vib_def=None):
+def acc_gen(fs, ref_a, acc_err, vib_def=None, rng=None):
     """
     Add error to true acc data according to acclerometer model parameters
     Args:
@@ -462,9 +641,15 @@ def acc_gen(fs, ref_a, acc_err, vib_def=None):
                 'x': x axis, in unit of m2/s4/Hz.
                 'y': y axis, in unit of m2/s4/Hz.
                 'z': z axis, in unit of m2/s4/Hz.
+                'filter': optional shaping filters of x, y and z axis, see psd_vib_filter.
+                    They are designed from the PSD if not given.
+        rng: a numpy.random.Generator to generate random numbers. None means the global
+            numpy.random.
     Returns:
         a_mea: nx3 measured acc data
     """
+    if rng is None:
+        rng = np.random
     dt = 1.0/fs
     # total data count
     n = ref_a.shape[0]
@@ -472,27 +657,25 @@ def acc_gen(fs, ref_a, acc_err, vib_def=None):
     # static bias
     acc_bias = acc_err['b']
     # bias drift
-    acc_bias_drift = bias_drift(acc_err['b_corr'], acc_err['b_drift'], n, fs)
+    acc_bias_drift = bias_drift(acc_err['b_corr'], acc_err['b_drift'], n, fs, rng=rng)
     # vibrating acceleration
     acc_vib = np.zeros((n, 3))
     if vib_def is not None:
         if vib_def['type'].lower() == 'psd':
-            acc_vib[:, 0] = time_series_from_psd.time_series_from_psd(vib_def['x'],
-                                                                      vib_def['freq'], fs, n)[1]
-            acc_vib[:, 1] = time_series_from_psd.time_series_from_psd(vib_def['y'],
-                                                                      vib_def['freq'], fs, n)[1]
-            acc_vib[:, 2] = time_series_from_psd.time_series_from_psd(vib_def['z'],
-                                                                      vib_def['freq'], fs, n)[1]
+            if 'filter' not in vib_def:
+                vib_def = psd_vib_filter(vib_def, fs)
+            for i, axis in enumerate(['x', 'y', 'z']):
+                acc_vib[:, i] = time_series_from_psd.filter_noise(vib_def['filter'][axis], n, rng)
         elif vib_def['type'] == 'random':
-            acc_vib[:, 0] = vib_def['x'] * np.random.randn(n)
-            acc_vib[:, 1] = vib_def['y'] * np.random.randn(n)
-            acc_vib[:, 2] = vib_def['z'] * np.random.randn(n)
+            acc_vib[:, 0] = vib_def['x'] * rng.standard_normal(n)
+            acc_vib[:, 1] = vib_def['y'] * rng.standard_normal(n)
+            acc_vib[:, 2] = vib_def['z'] * rng.standard_normal(n)
         elif vib_def['type'] == 'sinusoidal':
             acc_vib[:, 0] = vib_def['x'] * np.sin(2.0*math.pi*vib_def['freq']*dt*np.arange(n))
             acc_vib[:, 1] = vib_def['y'] * np.sin(2.0*math.pi*vib_def['freq']*dt*np.arange(n))
             acc_vib[:, 2] = vib_def['z'] * np.sin(2.0*math.pi*vib_def['freq']*dt*np.arange(n))
     # accelerometer white noise
-    acc_noise = np.random.randn(n, 3)
+    acc_noise = rng.standard_normal((n, 3))
     acc_noise[:, 0] = acc_err['vrw'][0] / math.sqrt(dt) * acc_noise[:, 0]
     acc_noise[:, 1] = acc_err['vrw'][1] / math.sqrt(dt) * acc_noise[:, 1]
     acc_noise[:, 2] = acc_err['vrw'][2] / math.sqrt(dt) * acc_noise[:, 2]
@@ -500,7 +683,24 @@ def acc_gen(fs, ref_a, acc_err, vib_def=None):
     a_mea = ref_a + acc_bias + acc_bias_drift + acc_noise + acc_vib
     return a_mea
 
-def gyro_gen(fs, ref_w, gyro_err):
+def psd_vib_filter(vib_def, fs):
+    """
+    Design the shaping filters of a PSD vibration model. The filters are designed once and
+    reused by all axes and simulation runs with the same model.
+    Args:
+        vib_def: vibration model of type 'psd', see acc_gen.
+        fs: sample frequency, Hz.
+    Returns:
+        a copy of vib_def with the shaping filters of x, y and z axis in vib_def['filter'].
+    """
+    vib_def = dict(vib_def)
+    vib_def['filter'] = {}
+    for axis in ['x', 'y', 'z']:
+        vib_def['filter'][axis] = time_series_from_psd.psd_filter(vib_def[axis],
+                                                                  vib_def['freq'], fs)
+    return vib_def
+
+def gyro_gen(fs, ref_w, gyro_err, rng=None):
     """
     Add error to true gyro data according to gyroscope model parameters
     Args:
@@ -510,9 +710,13 @@ def gyro_gen(fs, ref_w, gyro_err):
             'b': 3x1 constant gyro bias, rad/s.
             'b_drift': 3x1 gyro bias drift, rad/s.
             'arw': 3x1 angle random walk, rad/s/root-Hz.
+        rng: a numpy.random.Generator to generate random numbers. None means the global
+            numpy.random.
     Returns:
         w_mea: nx3 measured gyro data
     """
+    if rng is None:
+        rng = np.random
     dt = 1.0/fs
     # total data count
     n = ref_w.shape[0]
@@ -520,9 +724,9 @@ def gyro_gen(fs, ref_w, gyro_err):
     # static bias
     gyro_bias = gyro_err['b']
     # bias drift Todo: first-order Gauss-Markov model
-    gyro_bias_drift = bias_drift(gyro_err['b_corr'], gyro_err['b_drift'], n, fs)
+    gyro_bias_drift = bias_drift(gyro_err['b_corr'], gyro_err['b_drift'], n, fs, rng=rng)
     # gyroscope white noise
-    gyro_noise = np.random.randn(n, 3)
+    gyro_noise = rng.standard_normal((n, 3))
     gyro_noise[:, 0] = gyro_err['arw'][0] / math.sqrt(dt) * gyro_noise[:, 0]
     gyro_noise[:, 1] = gyro_err['arw'][1] / math.sqrt(dt) * gyro_noise[:, 1]
     gyro_noise[:, 2] = gyro_err['arw'][2] / math.sqrt(dt) * gyro_noise[:, 2]
@@ -530,7 +734,7 @@ def gyro_gen(fs, ref_w, gyro_err):
     w_mea = ref_w + gyro_bias + gyro_bias_drift + gyro_noise
     return w_mea
 
-def bias_drift(corr_time, drift, n, fs):
+def bias_drift(corr_time, drift, n, fs, runs=None, rng=None):
     """
     Bias drift (instability) model for accelerometers or gyroscope.
     If correlation time is valid (positive and finite), a first-order Gauss-Markov model is used.
@@ -540,26 +744,65 @@ def bias_drift(corr_time, drift, n, fs):
         drift: 3x1 bias drift std, rad/s.
         n: total data count
         fs: sample frequency, Hz.
+        runs: number of simulation runs. If runs is None, drift of one run is generated.
+        rng: a numpy.random.Generator to generate random numbers. None means the global
+            numpy.random.
     Returns
-        sensor_bias_drift: drift of sensor bias
+        sensor_bias_drift: drift of sensor bias, nx3, or (runs,n,3) if runs is not None.
     """
+    if rng is None:
+        rng = np.random
+    shape = (n,) if runs is None else (n, runs)
     # 3 axis
-    sensor_bias_drift = np.zeros((n, 3))
+    sensor_bias_drift = np.zeros(shape + (3,))
     for i in range(0, 3):
         if not math.isinf(corr_time[i]):
             # First-order Gauss-Markov
             a = 1 - 1/fs/corr_time[i]
             b = 1/fs*drift[i]
-            #sensor_bias_drift[0, :] = np.random.randn(3) * drift
-            drift_noise = np.random.randn(n, 3)
-            for j in range(1, n):
-                sensor_bias_drift[j, i] = a*sensor_bias_drift[j-1, i] + b*drift_noise[j-1, i]
+            drift_noise = rng.standard_normal(shape)
+            sensor_bias_drift[..., i] = gauss_markov(a, b*drift_noise)
         else:
             # normal distribution
-            sensor_bias_drift[:, i] = drift[i] * np.random.randn(n)
+            sensor_bias_drift[..., i] = drift[i] * rng.standard_normal(shape)
+    if runs is not None:
+        sensor_bias_drift = np.ascontiguousarray(sensor_bias_drift.transpose((1, 0, 2)))
     return sensor_bias_drift
 
-def gps_gen(ref_gps, gps_err, gps_type=0):
+def gauss_markov(a, w):
+    """
+    First-order Gauss-Markov process x[0] = 0, x[j] = a*x[j-1] + w[j-1] along the first axis.
+    The recursion is solved in blocks. Within a block, x[j] = a^j * cumsum(w[k]/a^(k+1)) plus
+    the decayed last value of the previous block, with the block short enough that the powers
+    of a do not overflow or underflow.
+    Args:
+        a: coefficient of the process.
+        w: (n,...) driving noise, each column is a process.
+    Returns:
+        x: (n,...) the process.
+    """
+    w = np.asarray(w, dtype=float)
+    n = w.shape[0]
+    x = np.zeros(w.shape)
+    if n < 2:
+        return x
+    if a == 0.0:
+        x[1:] = w[:-1]
+        return x
+    log_a = abs(math.log(abs(a)))
+    block = n if log_a == 0.0 else max(1, min(n, int(230.0/log_a)))
+    # a^0, a^1, ..., a^block
+    p = np.power(a, np.arange(block+1, dtype=float)).reshape((-1,) + (1,)*(w.ndim-1))
+    prev = np.zeros(w.shape[1:])    # last value of the previous block
+    for start in range(1, n, block):
+        end = min(start+block, n)
+        m = end - start
+        x[start:end] = p[0:m] * np.cumsum(w[start-1:end-1] / p[0:m], axis=0) +\
+                       p[1:m+1] * prev
+        prev = x[end-1]
+    return x
+
+def gps_gen(ref_gps, gps_err, gps_type=0, rng=None):
     '''
     Add error to true GPS data according to GPS receiver error parameters
     Args:
@@ -572,9 +815,13 @@ def gps_gen(ref_gps, gps_err, gps_type=0):
         gps_type: GPS data type.
             0: default, position is in the form of [Lat, Lon, Alt], rad, m
             1: position is in the form of [x, y, z], m
+        rng: a numpy.random.Generator to generate random numbers. None means the global
+            numpy.random.
     Returns:
         gps_mea: ref_gps with error.
     '''
+    if rng is None:
+        rng = np.random
     # total data count
     n = ref_gps.shape[0]
     pos_err = gps_err['stdp'].copy()
@@ -584,13 +831,13 @@ def gps_gen(ref_gps, gps_err, gps_type=0):
         pos_err[0] = pos_err[0] / earth_param[0]
         pos_err[1] = pos_err[1] / earth_param[1] / earth_param[4]
     ## simulate GPS error
-    pos_noise = pos_err * np.random.randn(n, 3)
-    vel_noise = gps_err['stdv'] * np.random.randn(n, 3)
+    pos_noise = pos_err * rng.standard_normal((n, 3))
+    vel_noise = gps_err['stdv'] * rng.standard_normal((n, 3))
     gps_mea = np.hstack([ref_gps[:, 0:3] + pos_noise,
                          ref_gps[:, 3:6] + vel_noise])
     return gps_mea
 
-def odo_gen(ref_odo, odo_err):
+def odo_gen(ref_odo, odo_err, rng=None):
     '''
     Add error to true odometer data.
     Args:
@@ -598,15 +845,19 @@ def odo_gen(ref_odo, odo_err):
         odo_err: odometer error profile.
             'scale': scalar, scale factor error.
             'stdv': scalar, RMS velocity error.
+        rng: a numpy.random.Generator to generate random numbers. None means the global
+            numpy.random.
     Returns:
         odo_mea: nx1, measured odometer output.
     '''
+    if rng is None:
+        rng = np.random
     n = ref_odo.shape[0]
-    odo_mea = np.random.randn(n)
+    odo_mea = rng.standard_normal(n)
     odo_mea = odo_err['scale']*ref_odo + odo_err['stdv']*odo_mea
     return odo_mea
 
-def mag_gen(ref_mag, mag_err):
+def mag_gen(ref_mag, mag_err, rng=None):
     """
     Add error to magnetic data.
     Args:
@@ -615,13 +866,17 @@ def mag_gen(ref_mag, mag_err):
             'si': 3x3 soft iron matrix
             'hi': hard iron array, [ox, oy, oz], uT
             'std': RMS of magnetometer noise, uT
+        rng: a numpy.random.Generator to generate random numbers. None means the global
+            numpy.random.
     Returns:
         mag_mea: ref_mag with error, mag_mea = si * (ref_mag + hi) + noise
     """
+    if rng is None:
+        rng = np.random
     # total data count
     n = ref_mag.shape[0]
     # add error
     mag_mea = ref_mag + mag_err['hi']
     mag_mea = mag_mea.dot(mag_err['si'].T)
-    mag_noise = mag_err['std'] * np.random.randn(n, 3)
+    mag_noise = mag_err['std'] * rng.standard_normal((n, 3))
     return mag_mea + mag_noise
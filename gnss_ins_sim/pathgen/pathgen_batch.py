@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+# Fielname = pathgen_batch.py
+
+"""
+Batch trajectory generation for IMU+GNSS simulation.
+N trajectories, e.g. the same motion commands from different initial positions and headings,
+are generated together. Motion states of each trajectory are generated in closed form by
+pathgen_vec, and position and true sensor output of all trajectories are calculated block by
+block as Nxnx3 arrays with the vectorized functions in pathgen_vec.
+Motion states are generated once for trajectories with the same initial velocity and attitude
+and the same motion definitions, for example the same motion from different initial positions.
+Only such trajectories are faster than calling pathgen_vec.path_gen_vec for each of them. For
+trajectories with different motion states, the cost is about the same as separate calls.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+# import
+import math
+import numpy as np
+from ..geoparams import geoparams
+from . import pathgen
+from . import pathgen_vec
+
+# global
+VERSION = '1.0'
+BLOCK_STEPS = 200000        # default number of simulation steps of all trajectories in a block
+
+def path_gen_batch(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, magnet=False,
+                   implicit_index=False, dtype=np.float64, integration='euler', mag_cache=None,
+                   block_size=None):
+    """
+    Generate N trajectories together. Each trajectory is the same as generated by
+    pathgen_vec.path_gen_vec with its initial states and motion definitions.
+    Args:
+        ini_pos_vel_att: Nx9 initial states. Each row is the initial states of a trajectory, see
+            pathgen.path_gen. A 9x1 array means there is only one trajectory.
+        motion_def: mx9 motion definitions shared by all trajectories, or Nxmx9 motion
+            definitions, one for each trajectory. All trajectories have the same number of
+            segments. See pathgen.path_gen. The time duration is converted into simulation
+            count in place, the same as pathgen.path_gen.
+        output_def, mobility, ref_frame, magnet, implicit_index, dtype, integration, mag_cache:
+            shared by all trajectories. See pathgen.path_gen.
+        block_size: number of imu/nav rows of each trajectory generated in each block. It
+            bounds the memory of the intermediate results. None means about BLOCK_STEPS
+            simulation steps of all trajectories in each block.
+    Returns:
+        path_results. The same as pathgen.path_gen, except that
+            'imu', 'nav', 'mag', 'gps' and 'odo' are NxLxk arrays, the i-th one is the output of
+                the i-th trajectory. Trajectories may have different lengths when type-2/3/4/5
+                commands are completed at different time, and rows beyond the length of a
+                trajectory are NaN.
+            'length': {'imu': (N,) number of valid rows of 'imu', 'nav', 'mag' and 'odo' of each
+                trajectory, 'gps': (N,) number of valid rows of 'gps'}.
+    """
+    if integration not in pathgen.INTEGRATION_SCHEMES:
+        raise ValueError("integration should be one of %s, but got %s."\
+                         % (pathgen.INTEGRATION_SCHEMES, integration))
+    ini_pos_vel_att = np.array(ini_pos_vel_att, dtype=float)
+    if ini_pos_vel_att.ndim == 1:
+        ini_pos_vel_att = ini_pos_vel_att.reshape((1, -1))
+    num = ini_pos_vel_att.shape[0]
+    if motion_def.ndim == 2:
+        seg_def = motion_def[np.newaxis]
+    elif motion_def.ndim == 3 and motion_def.shape[0] == num:
+        seg_def = motion_def
+    else:
+        raise ValueError("motion_def should be of size mx9 or %sxmx9, but got %s."\
+                         % (num, motion_def.shape))
+    ### path generation results
+    path_results = {'status': True,
+                    'imu': [],
+                    'nav': [],
+                    'mag': [],
+                    'gps': [],
+                    'odo': []}
+
+    ### sim freq and data output freq
+    out_freq = output_def[0, 1]     # IMU output frequency
+    sim_osr = output_def[0, 0]      # simulation over sample ratio w.r.t IMU output freq
+    sim_freq = sim_osr * out_freq   # simulation frequency
+    dt = 1.0 / sim_freq             # simulation period
+
+    ### convert time duration to simulation cycles
+    if np.any(seg_def[:, :, 7] < 0):
+        raise ValueError("Time duration of motion commands should not be negative.")
+    seg_count = seg_def[:, :, 7] * out_freq                     # max count for each segment
+    sim_count_max = np.sum(np.ceil(seg_count), 1)               # data count of all segments
+    seg_def[:, :, 7] = np.round(seg_count * sim_osr)            # simulation count
+    # total sim_count_max must be above 0
+    if np.any(sim_count_max <= 0):
+        raise ValueError("Total time duration in the motion definition file must be above 0.")
+    seg_def = np.broadcast_to(seg_def, (num,) + seg_def.shape[1:])
+    enable_gps = False
+    enable_odo = False
+    if output_def.shape[0] == 3:
+        if output_def[1, 0] == 1:
+            enable_gps = True
+            output_def[1, 1] = sim_osr * round(out_freq / output_def[1, 1])
+        else:
+            output_def[1, 0] = -1
+        if output_def[2, 0] == 1:
+            enable_odo = True
+            output_def[2, 1] = sim_osr * round(out_freq / output_def[2, 1])
+        else:
+            output_def[2, 0] = -1
+    else:
+        raise ValueError("output_def should be of size 3x2.")
+    osr = int(sim_osr)
+    gps_period = int(output_def[1, 1])
+    if block_size is None:
+        block_count = max(1, BLOCK_STEPS // (num*osr)) * osr
+    elif block_size > 0:
+        block_count = int(block_size) * osr
+    else:
+        raise ValueError("block_size should be a positive integer or None.")
+
+    ### create output arrays
+    sim_count_total = int(np.max(np.sum(seg_def[:, :, 7], 1)))
+    col = 0 if implicit_index else 1                # column of the first data after the index
+    n_high_freq = int(math.ceil(sim_count_total / sim_osr))
+    imu_data = np.zeros((num, n_high_freq, 6+col), dtype=dtype)
+    nav_data = np.zeros((num, n_high_freq, 9+col), dtype=dtype)
+    if magnet:
+        mag_data = np.zeros((num, n_high_freq, 3+col), dtype=dtype)
+    if enable_odo:
+        odo_data = np.zeros((num, n_high_freq, 4+col), dtype=dtype)
+    if enable_gps:
+        gps_data = np.zeros((num, int(math.ceil(sim_count_total / gps_period)), 7+col),
+                            dtype=dtype)
+
+    ### initialize
+    pos_n = ini_pos_vel_att[:, 0:3]                     # ini pos, LLA
+    g = geoparams.geo_param_batch(pos_n)[2]             # local gravity at ini pos
+    if magnet:                                          # geomagnetic field along trajectories
+        geo_mag_n, mag_cache = pathgen_vec.geo_mag_source(pos_n, ref_frame, mag_cache)
+        geo_mag_n = geo_mag_n[:, np.newaxis, :]
+    if ref_frame == 1:      # if using virtual inertial frame, convert LLA to ECEF xyz
+        pos_n = geoparams.lla2ecef_batch(pos_n)
+    pos_n = pos_n[:, np.newaxis, :]
+    g = g.reshape((num, 1))
+    sim_count = 0                       # number of total simulation data
+    pos_delta_n = np.zeros((num, 3))    # pos change
+    acc_sum = np.zeros((num, 3))        # accum of over sampled simulated acc data
+    gyro_sum = np.zeros((num, 3))       # accum of over sampled simulated gyro data
+    odo_dist = np.zeros((num, 1))       # accum of travel distance
+    idx_high_freq = 0                   # data index for imu, nav, mag, odo
+    idx_low_freq = 0                    # data index for gps
+
+    ### generate data block by block
+    states = MotionStatesBatch(ini_pos_vel_att, seg_def, mobility, dt, block_count)
+    while np.any(states.active):
+        block = states.run()
+        att = block['att']
+        vel_b = block['vel_b']
+        n = att.shape[1]
+        if n == 0:
+            # the last blocks of all trajectories ended at the end of the previous block
+            break
+        counts = sim_count + np.arange(n)
+        # position, true sensor output and travel distance
+        c_nb, vel_n, pos_delta, acc, gyro, odo_delta = pathgen_vec.integrate_states(
+            pos_n, pos_delta_n, att, vel_b, block['att_dot'], block['vel_dot_b'], dt,
+            ref_frame, g, integration)
+        pos = pos_n + pos_delta[:, 0:n]
+        # down sample according to output_def, the same as pathgen_vec.path_gen_iter
+        idx = down_sample_index(sim_count, n, osr)
+        rows = slice(idx_high_freq, idx_high_freq + len(range(n)[idx]))
+        acc_avg, acc_sum = pathgen_vec.window_sum(acc, np.arange(n)[idx], acc_sum)
+        gyro_avg, gyro_sum = pathgen_vec.window_sum(gyro, np.arange(n)[idx], gyro_sum)
+        imu_data[:, rows, col:col+3] = acc_avg / sim_osr
+        imu_data[:, rows, col+3:col+6] = gyro_avg / sim_osr
+        nav_data[:, rows, col:col+3] = pos[:, idx]
+        nav_data[:, rows, col+3:col+6] = vel_n[:, idx]
+        nav_data[:, rows, col+6:col+9] = pathgen_vec.euler_angle_range_three_axis(att[:, idx])
+        if not implicit_index:
+            imu_data[:, rows, 0] = counts[idx]
+            nav_data[:, rows, 0] = counts[idx]
+        if magnet:
+            mag_data[:, rows, col:col+3] = pathgen_vec.geo_mag_body(c_nb[:, idx], pos[:, idx],
+                                                                    geo_mag_n, mag_cache)
+            if not implicit_index:
+                mag_data[:, rows, 0] = counts[idx]
+        if enable_odo:
+            odo = np.cumsum(np.hstack((odo_dist, odo_delta)), 1)
+            odo_data[:, rows, col] = odo[:, idx]
+            odo_data[:, rows, col+1:col+4] = vel_b[:, idx]
+            if not implicit_index:
+                odo_data[:, rows, 0] = counts[idx]
+            odo_dist = odo[:, n:n+1]
+        idx_high_freq = rows.stop
+        if enable_gps:
+            idx = down_sample_index(sim_count, n, gps_period)
+            rows = slice(idx_low_freq, idx_low_freq + len(range(n)[idx]))
+            gps_data[:, rows, col:col+3] = pos[:, idx]
+            gps_data[:, rows, col+3:col+6] = vel_n[:, idx]
+            gps_data[:, rows, col+6] = block['gps_visibility'][:, idx]
+            if not implicit_index:
+                gps_data[:, rows, 0] = counts[idx]
+            idx_low_freq = rows.stop
+        # carry states to the next block
+        pos_delta_n = pos_delta[:, n]
+        sim_count += n
+
+    ### return generated data, rows beyond the length of each trajectory are NaN
+    length = -(-states.count // osr)
+    path_results['length'] = {'imu': length}
+    path_results['imu'] = imu_data[:, 0:idx_high_freq]
+    path_results['nav'] = nav_data[:, 0:idx_high_freq]
+    if magnet:
+        path_results['mag'] = mag_data[:, 0:idx_high_freq]
+    if enable_odo:
+        path_results['odo'] = odo_data[:, 0:idx_high_freq]
+    for i in ['imu', 'nav', 'mag', 'odo']:
+        if len(path_results[i]) > 0:
+            for j in range(num):
+                path_results[i][j, length[j]:] = np.nan
+    if enable_gps:
+        length = -(-states.count // gps_period)
+        path_results['length']['gps'] = length
+        path_results['gps'] = gps_data[:, 0:idx_low_freq]
+        for j in range(num):
+            path_results['gps'][j, length[j]:] = np.nan
+    if implicit_index:
+        path_results['index'] = {'imu': [0, osr]}
+        if enable_gps:
+            path_results['index']['gps'] = [0, gps_period]
+    return path_results
+
+def down_sample_index(sim_count, n, period):
+    """
+    Steps in a block to output data.
+    Args:
+        sim_count: simulation count of the first step of the block.
+        n: number of steps in the block.
+        period: output period in simulation steps.
+    Returns:
+        a slice selecting the steps whose simulation count is a multiple of period.
+    """
+    return slice(-sim_count % period, n, period)
+
+class MotionStatesBatch(object):
+    '''
+    Motion states of N trajectories driven by their motion commands. The states of each
+    trajectory are generated in closed form by pathgen_vec.gen_motion_states_iter, block by
+    block, and the blocks of all trajectories are stacked. Motion states do not depend on the
+    initial position, so trajectories with the same initial velocity and attitude and the same
+    motion definitions share one generator. A finished trajectory holds its states with zero
+    change rates.
+    '''
+    def __init__(self, ini_pos_vel_att, motion_def, mobility, dt, block_count):
+        '''
+        Args:
+            ini_pos_vel_att: Nx9 initial states, see pathgen.path_gen.
+            motion_def: Nxmx9 motion definitions. motion_def[:, :, 7] should be already
+                converted into simulation count.
+            mobility: [max_acceleration, max_angular_acceleration, max_angular_velocity]
+            dt: simulation period, sec.
+            block_count: number of simulation steps in each block.
+        '''
+        num = ini_pos_vel_att.shape[0]
+        self.dt = dt
+        self.block_count = block_count
+        # group trajectories with the same motion states
+        groups = {}
+        self.group = np.zeros((num,), dtype=int)        # group of each trajectory
+        for i in range(num):
+            key = ini_pos_vel_att[i, 3:9].tobytes() +\
+                  np.ascontiguousarray(motion_def[i]).tobytes()
+            self.group[i] = groups.setdefault(key, len(groups))
+        first = np.unique(self.group, return_index=True)[1]
+        self.gens = [pathgen_vec.gen_motion_states_iter(ini_pos_vel_att[i], motion_def[i],
+                                                        mobility, dt, block_count)\
+                     for i in first]
+        self.att = ini_pos_vel_att[first, 6:9].copy()   # Euler angles after the last step
+        self.vel_b = ini_pos_vel_att[first, 3:6].copy() # velocity after the last step
+        self.gps_visibility = np.zeros((len(first),))
+        self.group_active = np.ones((len(first),), dtype=bool)
+        self.group_count = np.zeros((len(first),), dtype=int)
+
+    @property
+    def active(self):
+        '''
+        (N,) True if the trajectory is not finished.
+        '''
+        return self.group_active[self.group]
+
+    @property
+    def count(self):
+        '''
+        (N,) simulation count of each trajectory.
+        '''
+        return self.group_count[self.group]
+
+    def run(self):
+        '''
+        Generate the next block of all trajectories. The block has block_count steps, or less
+        if all trajectories are finished within it.
+        Returns:
+            a dict containing motion states of all trajectories at each step:
+                'att': Nxnx3 Euler angles [yaw, pitch, roll], rotation sequency is zyx, rad.
+                'vel_b': Nxnx3 velocity in the body frame, m/s.
+                'att_dot': Nxnx3 Euler angle change rate, rad/s.
+                'vel_dot_b': Nxnx3 velocity change rate in the body frame, m/s/s.
+                'gps_visibility': Nxn gps visibility.
+        '''
+        num = self.att.shape[0]
+        blocks = [None] * num
+        for i in np.nonzero(self.group_active)[0]:
+            blocks[i] = next(self.gens[i], None)
+            n = 0 if blocks[i] is None else blocks[i]['att'].shape[0]
+            self.group_count[i] += n
+            if n < self.block_count:
+                # the generator yields full blocks except the last one
+                self.group_active[i] = False
+        n = max([0] + [x['att'].shape[0] for x in blocks if x is not None])
+        block = {}
+        for i in ['att', 'vel_b', 'att_dot', 'vel_dot_b']:
+            block[i] = np.zeros((num, n, 3))
+        block['gps_visibility'] = np.zeros((num, n))
+        for i in range(num):
+            m = 0 if blocks[i] is None else blocks[i]['att'].shape[0]
+            if m > 0:
+                for j in block:
+                    block[j][i, 0:m] = blocks[i][j]
+                # states after the last step of this block
+                self.att[i] = blocks[i]['att'][-1] + blocks[i]['att_dot'][-1]*self.dt
+                self.vel_b[i] = blocks[i]['vel_b'][-1] + blocks[i]['vel_dot_b'][-1]*self.dt
+                self.gps_visibility[i] = blocks[i]['gps_visibility'][-1]
+            # a finished trajectory holds its states
+            block['att'][i, m:] = self.att[i]
+            block['vel_b'][i, m:] = self.vel_b[i]
+            block['gps_visibility'][i, m:] = self.gps_visibility[i]
+        # expand groups to trajectories
+        for i in block:
+            block[i] = block[i][self.group]
+        return block
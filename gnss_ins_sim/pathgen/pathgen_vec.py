@@ -0,0 +1,877 @@
+# -*- coding: utf-8 -*-
+# Fielname = pathgen_vec.py
+
+"""
+Vectorized trajectory generation for IMU+GNSS simulation.
+This is an alternative engine of pathgen.path_gen. Instead of computing everything at each
+simulation step, the motion states (attitude, body velocity and their change rates) of each
+motion segment are generated in bulk, and then position, true sensor output, GPS and odometer
+data of all simulation steps are calculated in a few vectorized passes.
+path_gen_iter is the streaming version, which generates data block by block to bound memory.
+Functions below that take nx3 arrays also accept arrays with extra leading dimensions, e.g.
+Nxnx3 for N trajectories in pathgen_batch.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+# import
+import math
+import numpy as np
+from ..geoparams import geoparams
+from ..geoparams import geomag
+from ..geoparams import geomag_cache
+from . import pathgen
+
+# global
+VERSION = '1.0'
+D2R = math.pi/180
+TWO_PI = 2.0*math.pi
+HALF_PI = 0.5*math.pi
+POS_ITER_MAX = 10           # max iterations to solve position in the NED frame
+POS_ITER_TOL = 1.0e-15      # rad, convergence threshold of position iteration
+REGIME_WIN_MIN = 64         # min/max window size to generate states of type-2/3/4/5 commands
+REGIME_WIN_MAX = 65536
+
+def path_gen_vec(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, magnet=False,
+                 implicit_index=False, dtype=np.float64, integration='euler', mag_cache=None):
+    """
+    Vectorized version of pathgen.path_gen. Input and output are the same as pathgen.path_gen.
+    The command filter and the PD controller of each motion segment are processed in bulk (type-1
+    segments have a closed-form solution, other types are generated piecewise in closed form
+    between saturation changes), and the true sensor output of all simulation steps is
+    calculated in batch.
+    The output agrees with pathgen.path_gen row for row to floating-point rounding. On the demo
+    motion definitions, the difference of IMU, velocity and attitude output is below 1e-8 (m/s/s,
+    rad/s, m/s, rad) and the position difference is below 1e-7 m. See demo_path_gen_vec.py.
+    Args:
+        See pathgen.path_gen.
+    Returns:
+        See pathgen.path_gen.
+    """
+    ### path generation results
+    path_results = {'status': True,
+                    'imu': [],
+                    'nav': [],
+                    'mag': [],
+                    'gps': [],
+                    'odo': []}
+    # the whole trajectory is generated as one block
+    blocks = list(path_gen_iter(ini_pos_vel_att, motion_def, output_def, mobility,
+                                ref_frame, magnet, None, implicit_index, dtype, integration,
+                                mag_cache))
+    if len(blocks) != 1:
+        raise RuntimeError('path_gen_iter should yield one block, but got %s.'% len(blocks))
+    for i in blocks[0]:
+        path_results[i] = blocks[0][i]
+    if implicit_index:
+        # the whole trajectory starts from 0
+        for i in path_results['index']:
+            path_results['index'][i][0] = 0
+    return path_results
+
+def path_gen_iter(ini_pos_vel_att, motion_def, output_def, mobility, ref_frame=0, magnet=False,
+                  block_size=100000, implicit_index=False, dtype=np.float64, integration='euler',
+                  mag_cache=None):
+    """
+    Streaming version of path_gen_vec. Instead of returning the whole trajectory at once, this
+    generator yields blocks of data. Each block contains block_size rows of imu/nav/mag/odo data
+    (the last block may contain less) and the gps data within the same time span. The
+    integrator states (position, velocity, attitude, command filter, PD controller, IMU over
+    sampling accumulator and travel distance) are carried between blocks, so concatenating all
+    blocks gives the same results as path_gen_vec, and the memory is bounded by the block size
+    instead of the trajectory length.
+    Since this is a generator, motion_def and output_def are checked and converted (see
+    pathgen.path_gen) when the first block is requested.
+    Args:
+        block_size: number of imu/nav rows in each block. None means the whole trajectory is
+            generated in one block.
+        Other args: See pathgen.path_gen.
+    Yields:
+        A dict with keys 'imu', 'nav', 'mag', 'gps' and 'odo'. Each is a numpy array organized
+        the same as the output of pathgen.path_gen, or [] if the data is disabled. If
+        implicit_index is True, there is also the key 'index' giving [start, step] of the sample
+        index of this block.
+    """
+    if integration not in pathgen.INTEGRATION_SCHEMES:
+        raise ValueError("integration should be one of %s, but got %s."\
+                         % (pathgen.INTEGRATION_SCHEMES, integration))
+    ### sim freq and data output freq
+    out_freq = output_def[0, 1]     # IMU output frequency
+    sim_osr = output_def[0, 0]      # simulation over sample ratio w.r.t IMU output freq
+    sim_freq = sim_osr * out_freq   # simulation frequency
+    dt = 1.0 / sim_freq             # simulation period
+
+    ### convert time duration to simulation cycles
+    sim_count_max = 0
+    for i in range(0, motion_def.shape[0]):
+        if motion_def[i, 7] < 0:
+            raise ValueError("Time duration of %s-th command has negative time duration: %s."\
+                             % (i, motion_def[i, 7]))
+        seg_count = motion_def[i, 7] * out_freq         # max count for this segment
+        sim_count_max += math.ceil(seg_count)           # data count of all segments
+        motion_def[i, 7] = round(seg_count * sim_osr)   # simulation count
+    # total sim_count_max must be above 0
+    if sim_count_max <= 0:
+        raise ValueError("Total time duration in the motion definition file must be above 0.")
+    enable_gps = False
+    enable_odo = False
+    if output_def.shape[0] == 3:
+        if output_def[1, 0] == 1:
+            enable_gps = True
+            output_def[1, 1] = sim_osr * round(out_freq / output_def[1, 1])
+        else:
+            output_def[1, 0] = -1
+        if output_def[2, 0] == 1:
+            enable_odo = True
+            output_def[2, 1] = sim_osr * round(out_freq / output_def[2, 1])
+        else:
+            output_def[2, 0] = -1
+    else:
+        raise ValueError("output_def should be of size 3x2.")
+    osr = int(sim_osr)
+    gps_period = int(output_def[1, 1])
+    if block_size is None:
+        block_count = int(np.sum(motion_def[:, 7]))     # max simulation count
+    elif block_size > 0:
+        block_count = int(block_size) * osr
+    else:
+        raise ValueError("block_size should be a positive integer or None.")
+
+    ### initialize
+    pos_n = ini_pos_vel_att[0:3]                # ini pos, LLA
+    earth_param = geoparams.geo_param(pos_n)    # geo parameters
+    g = earth_param[2]                          # local gravity at ini pos
+    if magnet:                                  # geomagnetic field along the trajectory
+        geo_mag_n, mag_cache = geo_mag_source(pos_n, ref_frame, mag_cache)
+    if ref_frame == 1:      # if using virtual inertial frame, convert LLA to ECEF xyz
+        pos_n = geoparams.lla2ecef(pos_n)
+    sim_count = 0                   # number of total simulation data
+    pos_delta_n = np.zeros(3)       # pos change
+    acc_sum = np.zeros(3)           # accum of over sampled simulated acc data
+    gyro_sum = np.zeros(3)          # accum of over sampled simulated gyro data
+    odo_dist = 0.0                  # accum of travel distance
+
+    ### generate data block by block
+    for states in gen_motion_states_iter(ini_pos_vel_att, motion_def, mobility, dt, block_count):
+        att = states['att']
+        vel_b = states['vel_b']
+        n = att.shape[0]
+        counts = sim_count + np.arange(n)
+        # position, true sensor output and travel distance
+        c_nb, vel_n, pos_delta, acc, gyro, odo_delta = integrate_states(
+            pos_n, pos_delta_n, att, vel_b, states['att_dot'], states['vel_dot_b'], dt,
+            ref_frame, g, integration)
+        pos = pos_n + pos_delta[0:n]
+        # down sample according to output_def. IMU measurements are averaged over the over
+        # sampled data. The first output only contains the first simulation step, the same as
+        # pathgen.path_gen.
+        block = {'imu': [], 'nav': [], 'mag': [], 'gps': [], 'odo': []}
+        idx_high_freq = np.nonzero(counts % osr == 0)[0]
+        acc_avg, acc_sum = window_sum(acc, idx_high_freq, acc_sum)
+        gyro_avg, gyro_sum = window_sum(gyro, idx_high_freq, gyro_sum)
+        block['imu'] = [acc_avg / sim_osr, gyro_avg / sim_osr]
+        block['nav'] = [pos[idx_high_freq], vel_n[idx_high_freq],
+                        euler_angle_range_three_axis(att[idx_high_freq])]
+        if magnet:
+            block['mag'] = [geo_mag_body(c_nb[idx_high_freq], pos[idx_high_freq], geo_mag_n,
+                                         mag_cache)]
+        if enable_odo:
+            odo = np.cumsum(np.hstack((odo_dist, odo_delta)))
+            block['odo'] = [odo[idx_high_freq].reshape((-1, 1)), vel_b[idx_high_freq]]
+            odo_dist = odo[n]
+        if enable_gps:
+            idx_low_freq = np.nonzero(counts % gps_period == 0)[0]
+            block['gps'] = [pos[idx_low_freq], vel_n[idx_low_freq],
+                            states['gps_visibility'][idx_low_freq].reshape((-1, 1))]
+        # sample index, either as the first column or as [start, step]
+        for i in block:
+            if len(block[i]) == 0:
+                continue
+            if not implicit_index:
+                idx = idx_low_freq if i == 'gps' else idx_high_freq
+                block[i].insert(0, counts[idx].astype(float).reshape((-1, 1)))
+            block[i] = np.hstack(block[i]).astype(dtype, copy=False)
+        if implicit_index:
+            # the first index in this block
+            block['index'] = {'imu': [-(-sim_count // osr) * osr, osr]}
+            if enable_gps:
+                block['index']['gps'] = [-(-sim_count // gps_period) * gps_period, gps_period]
+        # carry states to the next block
+        pos_delta_n = pos_delta[n]
+        sim_count += n
+        yield block
+
+def gen_motion_states_iter(ini_pos_vel_att, motion_def, mobility, dt, block_count):
+    """
+    Generate motion states according to the motion commands block by block.
+    Args:
+        ini_pos_vel_att: See pathgen.path_gen.
+        motion_def: See pathgen.path_gen. motion_def[:, 7] should be already converted into
+            simulation count.
+        mobility: [max_acceleration, max_angular_acceleration, max_angular_velocity]
+        dt: simulation period, sec.
+        block_count: number of simulation steps in each block.
+    Yields:
+        a dict containing motion states of block_count simulation steps (the last block may
+        contain less, and there is at least one block):
+            'att': nx3 Euler angles [yaw, pitch, roll], rotation sequency is zyx, rad.
+            'vel_b': nx3 velocity in the body frame, m/s.
+            'att_dot': nx3 Euler angle change rate, rad/s.
+            'vel_dot_b': nx3 velocity change rate in the body frame, m/s/s.
+            'gps_visibility': (n,) gps visibility.
+    """
+    names = ['att', 'vel_b', 'att_dot', 'vel_dot_b', 'gps_visibility']
+    att = np.array(ini_pos_vel_att[6:9], dtype=float)   # ini att
+    vel_b = np.array(ini_pos_vel_att[3:6], dtype=float) # ini vel
+    att_dot = np.zeros(3)                               # Euler angle change rate
+    vel_dot_b = np.zeros(3)                             # Velocity change rate in the body frame
+    buf = []            # states not yielded yet
+    buf_count = 0       # number of steps in buf
+    yielded = False     # if any block has been yielded
+    for i in range(0, motion_def.shape[0]):
+        com_type = round(motion_def[i, 0])      # command type of this segment
+        seg_count = int(motion_def[i, 7])       # max cycles to execute command of this seg
+        motion_com = pathgen.parse_motion_def(motion_def[i], att, vel_b)
+        motion_com = (np.array(motion_com[0], dtype=float), np.array(motion_com[1], dtype=float))
+        vel_filt = vel_b        # initialize the filter states to last vel
+        com_complete = False
+        while seg_count > 0 and not com_complete:
+            n = min(seg_count, block_count - buf_count)
+            if com_type == 1:
+                seg = gen_states_rate(att, vel_b, att_dot, vel_dot_b,
+                                      motion_com[0], motion_com[1], n, dt)
+            else:
+                seg = gen_states_maneuver(att, vel_b, att_dot, motion_com[0], motion_com[1],
+                                          n, dt, mobility, vel_filt)
+                vel_filt = seg[8]
+                com_complete = seg[9]
+            att, vel_b, att_dot, vel_dot_b = seg[4:8]
+            seg_count -= n
+            gps_visibility = motion_def[i, 8] * np.ones((seg[0].shape[0],))
+            buf.append(seg[0:4] + (gps_visibility,))
+            buf_count += seg[0].shape[0]
+            if buf_count == block_count:
+                yield dict(zip(names, [np.concatenate([x[j] for x in buf]) for j in range(5)]))
+                yielded = True
+                buf = []
+                buf_count = 0
+    if buf_count > 0 or not yielded:
+        # the last block. Yield an empty block if all segments are shorter than a
+        # simulation step.
+        buf.append((np.zeros((0, 3)),)*4 + (np.zeros((0,)),))
+        yield dict(zip(names, [np.concatenate([x[j] for x in buf]) for j in range(5)]))
+
+def gen_states_rate(att, vel_b, att_dot, vel_dot_b, att_dot_com, vel_dot_com, n, dt):
+    """
+    Generate motion states of a type-1 segment in closed form. The commanded Euler angle change
+    rate and velocity change rate pass a first-order low pass filter, whose output is
+    y[k] = com + (y[-1]-com) * alpha^(k+1).
+    Args:
+        att: 3x1 Euler angles at the beginning of this segment, rad.
+        vel_b: 3x1 velocity in the body frame at the beginning of this segment, m/s.
+        att_dot: 3x1 Euler angle change rate at the beginning of this segment, rad/s.
+        vel_dot_b: 3x1 velocity change rate at the beginning of this segment, m/s/s.
+        att_dot_com: 3x1 commanded Euler angle change rate, rad/s.
+        vel_dot_com: 3x1 commanded velocity change rate, m/s/s.
+        n: number of simulation steps of this segment.
+        dt: simulation period, sec.
+    Returns:
+        [0]: nx3 Euler angles.
+        [1]: nx3 velocity in the body frame.
+        [2]: nx3 Euler angle change rate.
+        [3]: nx3 velocity change rate in the body frame.
+        [4:8]: att, vel_b, att_dot and vel_dot_b after this segment.
+    """
+    if n <= 0:
+        empty = np.zeros((0, 3))
+        return empty, empty, empty, empty, att, vel_b, att_dot, vel_dot_b
+    decay = pathgen.CMD_FILT_ALPHA ** np.arange(1, n+1)
+    decay = decay.reshape((n, 1))
+    seg_att_dot = att_dot_com + (att_dot - att_dot_com) * decay
+    seg_vel_dot_b = vel_dot_com + (vel_dot_b - vel_dot_com) * decay
+    # accumulate, the first row is the initial value
+    seg_att = np.cumsum(np.vstack((att, seg_att_dot*dt)), 0)
+    seg_vel_b = np.cumsum(np.vstack((vel_b, seg_vel_dot_b*dt)), 0)
+    return seg_att[0:n], seg_vel_b[0:n], seg_att_dot, seg_vel_dot_b,\
+           seg_att[n], seg_vel_b[n], seg_att_dot[n-1], seg_vel_dot_b[n-1]
+
+def gen_states_maneuver(att, vel_b, att_dot, att_com, vel_com_b, n, dt, mobility, vel_filt=None):
+    """
+    Generate motion states of a type-2/3/4/5 segment. The commanded velocity passes a first-order
+    low pass filter and the commanded attitude is tracked by a PD controller with limits on the
+    acceleration, angular acceleration and angular velocity. Each axis is independent of the
+    others except for the completion check, and is generated in bulk by vel_axis_states and
+    att_axis_states.
+    Args:
+        att: 3x1 Euler angles at the beginning of this segment, rad.
+        vel_b: 3x1 velocity in the body frame at the beginning of this segment, m/s.
+        att_dot: 3x1 Euler angle change rate at the beginning of this segment, rad/s.
+        att_com: 3x1 commanded Euler angles, rad.
+        vel_com_b: 3x1 commanded velocity in the body frame, m/s.
+        n: max number of simulation steps of this segment.
+        dt: simulation period, sec.
+        mobility: [max_acceleration, max_angular_acceleration, max_angular_velocity]
+        vel_filt: 3x1 state of the velocity command filter. None means the filter is
+            initialized to vel_b, i.e., this is the beginning of the segment.
+    Returns:
+        [0]: mx3 Euler angles, m<=n.
+        [1]: mx3 velocity in the body frame.
+        [2]: mx3 Euler angle change rate.
+        [3]: mx3 velocity change rate in the body frame.
+        [4:8]: att, vel_b, att_dot and vel_dot_b after this segment.
+        [8]: state of the velocity command filter after this segment.
+        [9]: True if the command is completed, else False.
+    """
+    if vel_filt is None:
+        vel_filt = vel_b
+    if n <= 0:
+        empty = np.zeros((0, 3))
+        return empty, empty, empty, empty, att, vel_b, att_dot, np.zeros(3), vel_filt, False
+    seg_att = np.zeros((n+1, 3))
+    seg_att_dot = np.zeros((n+1, 3))
+    seg_vel_b = np.zeros((n+1, 3))
+    seg_vel_dot_b = np.zeros((n, 3))
+    seg_vel_filt = np.zeros((n, 3))
+    trans_powers = []
+    for i in range(3):
+        seg_vel_b[:, i], seg_vel_dot_b[:, i], seg_vel_filt[:, i] =\
+            vel_axis_states(vel_b[i], vel_com_b[i], n, dt, mobility[0], vel_filt[i])
+        seg_att[:, i], seg_att_dot[:, i] = att_axis_states(att[i], att_dot[i], att_com[i], n, dt,
+                                                           mobility[1], mobility[2],
+                                                           trans_powers)
+    # the Euler angle change rate of the i-th step is the one after the PD controller
+    seg_att_dot = seg_att_dot[1:]
+    # Complete the command of this segment?
+    att_err = np.sqrt(np.sum((seg_att[0:n] - att_com)**2, 1))
+    vel_err = np.sqrt(np.sum((seg_vel_b[0:n] - vel_com_b)**2, 1))
+    idx = np.nonzero(np.logical_and(att_err < pathgen.ATT_CONVERGE_THRESHOLD,
+                                    vel_err < pathgen.VEL_CONVERGE_THRESHOLD))[0]
+    if idx.shape[0] > 0:
+        # the step at which the command is completed is still executed, after which
+        # att_dot and vel_dot should be set to zero
+        m = idx[0] + 1
+        return seg_att[0:m], seg_vel_b[0:m], seg_att_dot[0:m], seg_vel_dot_b[0:m],\
+               seg_att[m], seg_vel_b[m], np.zeros(3), np.zeros(3), seg_vel_filt[m-1], True
+    return seg_att[0:n], seg_vel_b[0:n], seg_att_dot, seg_vel_dot_b,\
+           seg_att[n], seg_vel_b[n], seg_att_dot[n-1], seg_vel_dot_b[n-1], seg_vel_filt[n-1], False
+
+def vel_axis_states(vel, vel_com, n, dt, max_acc, vel_filt):
+    """
+    Velocity of one axis driven by the low pass filtered velocity command with the acceleration
+    limited to [-max_acc, max_acc]. The velocity either ramps at the max acceleration or
+    follows the filter output. Both have closed-form solutions, so the steps are generated in
+    windows assuming the current regime and verified against the step-by-step rule, and the
+    regime switches at the first step the assumption does not hold.
+    Args:
+        vel: initial velocity, m/s.
+        vel_com: commanded velocity, m/s.
+        n: number of simulation steps.
+        dt: simulation period, sec.
+        max_acc: max acceleration, m/s/s.
+        vel_filt: initial state of the velocity command filter, m/s.
+    Returns:
+        v: (n+1,) velocity before each step and after the last step.
+        acc: (n,) acceleration of each step.
+        filt: (n,) filter output of each step.
+    """
+    # filter output
+    filt = vel_com + (vel_filt - vel_com) * pathgen.CMD_FILT_ALPHA ** np.arange(1, n+1)
+    v = np.zeros(n+1)
+    acc = np.zeros(n)
+    v[0] = vel
+    k = 0
+    win = REGIME_WIN_MIN
+    while k < n:
+        m = min(n, k+win)
+        acc_k = (filt[k] - v[k]) / dt
+        if abs(acc_k) <= max_acc:   # velocity follows filter output
+            v[k+1:m+1] = filt[k:m]
+            acc_raw = (filt[k:m] - v[k:m]) / dt
+            valid = np.abs(acc_raw) <= max_acc
+        else:                       # velocity ramps at max acceleration
+            s = max_acc if acc_k > 0 else -max_acc
+            v[k+1:m+1] = v[k] + s*dt*np.arange(1, m-k+1)
+            acc_raw = (filt[k:m] - v[k:m]) / dt
+            valid = acc_raw > max_acc if acc_k > 0 else acc_raw < -max_acc
+        j = regime_end(valid, k, m)
+        acc[k:j] = np.clip(acc_raw[0:j-k], -max_acc, max_acc)
+        win = 2*win if j == m else REGIME_WIN_MIN
+        win = min(win, REGIME_WIN_MAX)
+        k = j
+    return v, acc, filt
+
+def att_axis_states(att, att_dot, att_com, n, dt, max_dw, max_w, trans_powers):
+    """
+    Euler angle of one axis driven by the PD controller with the angular acceleration limited
+    to [-max_dw, max_dw] and the angular velocity limited to [-max_w, max_w]. There are three
+    regimes: angular velocity saturated, angular acceleration saturated and the linear PD
+    controller. All of them have closed-form solutions, so the steps are generated in windows
+    assuming the current regime and verified against the step-by-step rule, and the regime
+    switches at the first step the assumption does not hold.
+    Args:
+        att: initial Euler angle, rad.
+        att_dot: initial Euler angle change rate, rad/s.
+        att_com: commanded Euler angle, rad.
+        n: number of simulation steps.
+        dt: simulation period, sec.
+        max_dw: max angular acceleration, rad/s/s.
+        max_w: max angular velocity, rad/s.
+        trans_powers: a list caching the powers of the state transition matrix of the linear
+            PD controller. It is shared by all axes.
+    Returns:
+        a: (n+1,) Euler angle before each step and after the last step.
+        w: (n+1,) Euler angle change rate. w[0] is the initial value and w[k+1] is the one
+            after the PD controller at the k-th step.
+    """
+    kp = pathgen.CTRL_KP
+    kd = pathgen.CTRL_KD
+    a = np.zeros(n+1)
+    w = np.zeros(n+1)
+    a[0] = att
+    w[0] = att_dot
+    k = 0
+    win = REGIME_WIN_MIN
+    while k < n:
+        m = min(n, k+win)
+        steps = np.arange(1, m-k+1)
+        e_k = kp*(att_com - a[k]) + kd*(0 - w[k])
+        w_k = w[k] + min(max(e_k, -max_dw), max_dw)*dt
+        if abs(w_k) > max_w:        # angular velocity saturated
+            regime = 0
+            s = max_w if w_k > 0 else -max_w
+            w[k+1:m+1] = s
+            a[k+1:m+1] = a[k] + s*dt*steps
+        elif abs(e_k) > max_dw:     # angular acceleration saturated
+            regime = 1
+            s = max_dw if e_k > 0 else -max_dw
+            w[k+1:m+1] = w[k] + s*dt*steps
+            a[k+1:m+1] = a[k] + np.cumsum(w[k+1:m+1])*dt
+        else:                       # linear PD controller
+            regime = 2
+            powers = transition_powers(trans_powers, dt, m-k+1)
+            x = np.dot(powers[1:], np.array([a[k]-att_com, w[k]]))
+            a[k+1:m+1] = att_com + x[:, 0]
+            w[k+1:m+1] = x[:, 1]
+        # verify the regime
+        e_raw = kp*(att_com - a[k:m]) + kd*(0 - w[k:m])
+        w_raw = w[k:m] + np.clip(e_raw, -max_dw, max_dw)*dt
+        if regime == 0:
+            valid = w_raw > max_w if s > 0 else w_raw < -max_w
+        elif regime == 1:
+            valid = np.logical_and(e_raw > max_dw if s > 0 else e_raw < -max_dw,
+                                   np.abs(w_raw) <= max_w)
+        else:
+            valid = np.logical_and(np.abs(e_raw) <= max_dw, np.abs(w_raw) <= max_w)
+        j = regime_end(valid, k, m)
+        win = 2*win if j == m else REGIME_WIN_MIN
+        win = min(win, REGIME_WIN_MAX)
+        k = j
+    return a, w
+
+def regime_end(valid, k, m):
+    """
+    Find the end of a regime.
+    Args:
+        valid: (m-k,) bool array, if the regime holds at step k, k+1, ..., m-1.
+        k: first step of the window.
+        m: end of the window.
+    Returns:
+        the first step where the regime does not hold, m if it holds in the whole window. It is
+        at least k+1 to make sure the window moves forward.
+    """
+    idx = np.nonzero(np.logical_not(valid))[0]
+    if idx.shape[0] == 0:
+        return m
+    return k + max(idx[0], 1)
+
+def transition_powers(trans_powers, dt, num):
+    """
+    Powers of the state transition matrix of the linear PD controller. The state is
+    [att-att_com, att_dot]. The powers are generated by doubling and cached in trans_powers.
+    Args:
+        trans_powers: a list. If empty, the powers are calculated and appended to it.
+            Otherwise, trans_powers[0] contains the cached powers.
+        dt: simulation period, sec.
+        num: number of powers needed.
+    Returns:
+        numx2x2 array, powers of the transition matrix with exponents from 0 to num-1.
+    """
+    if len(trans_powers) > 0 and trans_powers[0].shape[0] >= num:
+        return trans_powers[0][0:num]
+    kp = pathgen.CTRL_KP
+    kd = pathgen.CTRL_KD
+    mat = np.array([[1.0 - kp*dt*dt, (1.0 - kd*dt)*dt],
+                    [-kp*dt, 1.0 - kd*dt]])
+    powers = np.zeros((num, 2, 2))
+    powers[0] = np.eye(2)
+    length = 1
+    while length < num:
+        cnt = min(length, num-length)
+        powers[length:length+cnt] = np.matmul(powers[0:cnt], mat)
+        mat = mat.dot(mat)
+        length += cnt
+    del trans_powers[:]
+    trans_powers.append(powers)
+    return powers
+
+def integrate_pos(pos_n, pos_delta_n, vel_n, dt, ref_frame):
+    """
+    Integrate velocity to get position change at each simulation step.
+    Args:
+        pos_n: 3x1 initial position. LLA if ref_frame is 0, xyz if ref_frame is 1.
+        pos_delta_n: 3x1 position change accumulated before the first step.
+        vel_n: nx3 velocity in the navigation frame at each simulation step, m/s.
+        dt: simulation period, sec.
+        ref_frame: See pathgen.path_gen.
+    Returns:
+        pos_delta: (n+1)x3 accumulated position change. pos_delta[k] is the one before the
+            velocity of the k-th step is integrated, and pos_delta[n] is the one after the
+            last step. Position of the k-th step is pos_n + pos_delta[k].
+    """
+    n = vel_n.shape[-2]
+    if ref_frame == 1:
+        return accumulate(pos_delta_n, vel_n*dt)
+    # Position change rate in the NED frame depends on the position itself through the local
+    # Earth radius, which changes very slowly. Solve it with fixed-point iterations, which
+    # converge within a few iterations.
+    pos_delta = accumulate(pos_delta_n, np.zeros(vel_n.shape))
+    for _ in range(POS_ITER_MAX):
+        pos_dot_n = pos_rate_ned(pos_n + pos_delta[..., 0:n, :], vel_n)
+        pos_delta_new = accumulate(pos_delta_n, pos_dot_n*dt)
+        err = np.abs(pos_delta_new - pos_delta)
+        pos_delta = pos_delta_new
+        if np.max(err[..., 0:2]) <= POS_ITER_TOL and np.max(err[..., 2]) <= POS_ITER_TOL*geoparams.Re:
+            break
+    return pos_delta
+
+def integrate_states(pos_n, pos_delta_n, att, vel_b, att_dot, vel_dot_b, dt, ref_frame, g,
+                     integration='euler'):
+    """
+    Integrate motion states of n simulation steps to get position, true sensor output and travel
+    distance. The Euler angle change rate and the velocity change rate are constant within each
+    simulation step.
+    Args:
+        pos_n: 3x1 initial position. LLA if ref_frame is 0, xyz if ref_frame is 1.
+        pos_delta_n: 3x1 position change accumulated before the first step.
+        att: nx3 Euler angles at the beginning of each step, rad.
+        vel_b: nx3 velocity in the body frame at the beginning of each step, m/s.
+        att_dot: nx3 Euler angle change rate of each step, rad/s.
+        vel_dot_b: nx3 velocity change rate in the body frame of each step, m/s/s.
+        dt: simulation period, sec.
+        ref_frame: See pathgen.path_gen.
+        g: Gravity, only used when ref_frame==1, m/s/s.
+        integration: See pathgen.path_gen.
+    Returns:
+        c_nb: nx3x3 transformation matrix from b to n at the beginning of each step.
+        vel_n: nx3 velocity in the navigation frame at the beginning of each step, m/s.
+        pos_delta: (n+1)x3 accumulated position change, see integrate_pos.
+        acc: nx3 true accelerometer output. 'euler': at the beginning of each step, 'rk4':
+            average over each step, m/s/s.
+        gyro: nx3 true gyro output, the same as acc, rad/s.
+        odo_delta: (n,) travel distance of each step, m.
+    """
+    c_nb = euler2dcm_zyx(att).swapaxes(-1, -2)   # b to n
+    vel_n = np.einsum('...ij,...j->...i', c_nb, vel_b)
+    if integration == 'euler':
+        pos_delta = integrate_pos(pos_n, pos_delta_n, vel_n, dt, ref_frame)
+        acc, gyro = calc_true_sensor_output_batch(pos_n + pos_delta[..., 0:vel_n.shape[-2], :],
+                                                  vel_b, att, c_nb, vel_dot_b, att_dot,
+                                                  ref_frame, g)[0:2]
+        odo_delta = np.sqrt(np.sum(vel_b*vel_b, -1))*dt
+        return c_nb, vel_n, pos_delta, acc, gyro, odo_delta
+    # states in the middle and at the end of each step
+    att_mid = att + 0.5*dt*att_dot
+    vel_b_mid = vel_b + 0.5*dt*vel_dot_b
+    c_nb_mid = euler2dcm_zyx(att_mid).swapaxes(-1, -2)
+    att_end = att + dt*att_dot
+    vel_b_end = vel_b + dt*vel_dot_b
+    c_nb_end = euler2dcm_zyx(att_end).swapaxes(-1, -2)
+    vel_n_mid = np.einsum('...ij,...j->...i', c_nb_mid, vel_b_mid)
+    vel_n_end = np.einsum('...ij,...j->...i', c_nb_end, vel_b_end)
+    pos_delta, pos_dot = integrate_pos_rk4(pos_n, pos_delta_n, vel_n, vel_n_mid, vel_n_end,
+                                           dt, ref_frame)
+    # sensor output at the RK4 stages, weighted by the RK4 weights
+    pos = pos_n + pos_delta[..., 0:vel_n.shape[-2], :]
+    r1 = calc_true_sensor_output_batch(pos, vel_b, att, c_nb, vel_dot_b, att_dot,
+                                       ref_frame, g)
+    r2 = calc_true_sensor_output_batch(pos + 0.5*dt*pos_dot[0], vel_b_mid, att_mid, c_nb_mid,
+                                       vel_dot_b, att_dot, ref_frame, g)
+    if ref_frame == 0:
+        r3 = calc_true_sensor_output_batch(pos + 0.5*dt*pos_dot[1], vel_b_mid, att_mid, c_nb_mid,
+                                           vel_dot_b, att_dot, ref_frame, g)
+    else:
+        r3 = r2     # sensor output does not depend on position
+    r4 = calc_true_sensor_output_batch(pos + dt*pos_dot[2], vel_b_end, att_end, c_nb_end,
+                                       vel_dot_b, att_dot, ref_frame, g)
+    acc = (r1[0] + 2.0*r2[0] + 2.0*r3[0] + r4[0]) / 6.0
+    gyro = (r1[1] + 2.0*r2[1] + 2.0*r3[1] + r4[1]) / 6.0
+    odo_delta = (np.sqrt(np.sum(vel_b*vel_b, -1)) + 4.0*np.sqrt(np.sum(vel_b_mid*vel_b_mid, -1)) +
+                 np.sqrt(np.sum(vel_b_end*vel_b_end, -1))) * (dt/6.0)
+    return c_nb, vel_n, pos_delta, acc, gyro, odo_delta
+
+def integrate_pos_rk4(pos_n, pos_delta_n, vel_n, vel_n_mid, vel_n_end, dt, ref_frame):
+    """
+    Integrate velocity to get position change at each simulation step with the classical
+    4th-order Runge-Kutta method.
+    Args:
+        pos_n: 3x1 initial position. LLA if ref_frame is 0, xyz if ref_frame is 1.
+        pos_delta_n: 3x1 position change accumulated before the first step.
+        vel_n, vel_n_mid, vel_n_end: nx3 velocity in the navigation frame at the beginning, in
+            the middle and at the end of each simulation step, m/s.
+        dt: simulation period, sec.
+        ref_frame: See pathgen.path_gen.
+    Returns:
+        pos_delta: (n+1)x3 accumulated position change, see integrate_pos.
+        pos_dot: list of the position change rates at the first three RK4 stages, each is nx3.
+            Position of the stages are pos + 0.5*dt*pos_dot[0], pos + 0.5*dt*pos_dot[1] and
+            pos + dt*pos_dot[2].
+    """
+    n = vel_n.shape[-2]
+    if ref_frame == 1:
+        pos_dot = [vel_n, vel_n_mid, vel_n_mid]
+        return accumulate(pos_delta_n, (vel_n + 4.0*vel_n_mid + vel_n_end)*(dt/6.0)), pos_dot
+    # Solve with fixed-point iterations, the same as integrate_pos.
+    pos_delta = accumulate(pos_delta_n, np.zeros(vel_n.shape))
+    for _ in range(POS_ITER_MAX):
+        pos = pos_n + pos_delta[..., 0:n, :]
+        k1 = pos_rate_ned(pos, vel_n)
+        k2 = pos_rate_ned(pos + 0.5*dt*k1, vel_n_mid)
+        k3 = pos_rate_ned(pos + 0.5*dt*k2, vel_n_mid)
+        k4 = pos_rate_ned(pos + dt*k3, vel_n_end)
+        pos_delta_new = accumulate(pos_delta_n, (k1 + 2.0*k2 + 2.0*k3 + k4)*(dt/6.0))
+        err = np.abs(pos_delta_new - pos_delta)
+        pos_delta = pos_delta_new
+        if np.max(err[..., 0:2]) <= POS_ITER_TOL and np.max(err[..., 2]) <= POS_ITER_TOL*geoparams.Re:
+            break
+    return pos_delta, [k1, k2, k3]
+
+def accumulate(x0, dx):
+    """
+    Cumulative sum of dx with the initial value x0.
+    Args:
+        x0: ...x3 initial value.
+        dx: ...xnx3 increments.
+    Returns:
+        ...x(n+1)x3 array. The first row is x0 and the k-th row is x0 + sum(dx[0:k]).
+    """
+    x0 = np.broadcast_to(np.expand_dims(x0, -2), dx.shape[0:-2] + (1, dx.shape[-1]))
+    return np.cumsum(np.concatenate((x0, dx), -2), -2)
+
+def pos_rate_ned(pos, vel_n):
+    """
+    LLA change rate from velocity in the NED frame.
+    Args:
+        pos: nx3 LLA position, [rad, rad, m].
+        vel_n: nx3 velocity in the NED frame, m/s.
+    Returns:
+        pos_dot_n: nx3 LLA change rate, [rad/s, rad/s, m/s].
+    """
+    rm, rn, _, _, cl = geoparams.geo_param_batch(pos)[0:5]
+    pos_dot_n = np.zeros(vel_n.shape)
+    pos_dot_n[..., 0] = vel_n[..., 0] / (rm + pos[..., 2])         # Lat
+    pos_dot_n[..., 1] = vel_n[..., 1] / (rn + pos[..., 2]) / cl    # Lon
+    pos_dot_n[..., 2] = -vel_n[..., 2]                          # Alt
+    return pos_dot_n
+
+def calc_true_sensor_output_batch(pos_n, vel_b, att, c_nb, vel_dot_b, att_dot, ref_frame, g):
+    """
+    Vectorized version of pathgen.calc_true_sensor_output.
+    Args:
+        pos_n: nx3 position. For NED, it is the absolute LLA position. Otherwise, it is
+            relative motion.
+        vel_b: nx3 velocity in the body frame, m/s.
+        att: nx3 Euler angles, [yaw pitch roll], rot seq is ZYX, rad.
+        c_nb: nx3x3 transformation matrix from b to n corresponding to att.
+        vel_dot_b: nx3 velocity change rate in the body frame, m/s/s
+        att_dot: nx3 Euler angle change rate, [yaw_d, pitch_d, roll_d], rad/s
+        ref_frame: See doc of function PathGen.
+        g: Gravity, only used when ref_frame==1, m/s/s.
+    Returns:
+        [0]: nx3 true accelerometer output in the body frame, m/s/s
+        [1]: nx3 true gyro output in the body frame, rad/s
+        [2]: nx3 velocity change rate in the navigation frame, m/s/s
+        [3]: nx3 position change rate in the navigation frame, m/s
+    """
+    # velocity in N
+    vel_n = np.einsum('...ij,...j->...i', c_nb, vel_b)
+    # Calculate rotation rate of n w.r.t e in n and e w.r.t i in n
+    w_en_n = np.zeros(vel_n.shape)
+    w_ie_n = np.zeros(vel_n.shape)
+    gravity = np.zeros(vel_n.shape)
+    if ref_frame == 0:
+        rm, rn, g, sl, cl, w_ie = geoparams.geo_param_batch(pos_n)
+        rm_effective = rm + pos_n[..., 2]
+        rn_effective = rn + pos_n[..., 2]
+        gravity[..., 2] = g
+        w_en_n[..., 0] = vel_n[..., 1] / rn_effective              # wN
+        w_en_n[..., 1] = -vel_n[..., 0] / rm_effective             # wE
+        w_en_n[..., 2] = -vel_n[..., 1] * sl /cl / rn_effective    # wD
+        w_ie_n[..., 0] = w_ie * cl
+        w_ie_n[..., 2] = -w_ie * sl
+    else:
+        gravity[..., 2] = g
+    # Calculate rotation rate from Euler angle derivative using ZYX rot seq.
+    sh = np.sin(att[..., 0])
+    ch = np.cos(att[..., 0])
+    w_nb_n = np.zeros(vel_n.shape)
+    w_nb_n[..., 0] = -sh*att_dot[..., 1] + c_nb[..., 0, 0]*att_dot[..., 2]
+    w_nb_n[..., 1] = ch*att_dot[..., 1] + c_nb[..., 1, 0]*att_dot[..., 2]
+    w_nb_n[..., 2] = att_dot[..., 0] + c_nb[..., 2, 0]*att_dot[..., 2]
+    # Velocity derivative
+    vel_dot_n = np.einsum('...ij,...j->...i', c_nb, vel_dot_b) + cross3_batch(w_nb_n, vel_n)
+    # Position derivative
+    if ref_frame == 0:
+        pos_dot_n = np.zeros(vel_n.shape)
+        pos_dot_n[..., 0] = vel_n[..., 0] / rm_effective        # Lat
+        pos_dot_n[..., 1] = vel_n[..., 1] / rn_effective / cl   # Lon
+        pos_dot_n[..., 2] = -vel_n[..., 2]                      # Alt
+    else:
+        pos_dot_n = vel_n.copy()
+    # Gyroscope output
+    gyro = np.einsum('...ji,...j->...i', c_nb, w_nb_n + w_en_n + w_ie_n)
+    # Acceleration output
+    w_ie_b = np.einsum('...ji,...j->...i', c_nb, w_ie_n)
+    acc = vel_dot_b + cross3_batch(w_ie_b+gyro, vel_b) - np.einsum('...ji,...j->...i', c_nb, gravity)
+    return acc, gyro, vel_dot_n, pos_dot_n
+
+def geo_mag_ned(pos_lla, ref_frame, gm=None):
+    """
+    Geomagnetic field in the navigation frame at the given positions.
+    Args:
+        pos_lla: 3x1 or nx3 [Lat, Lon, Alt], rad, m.
+        ref_frame: See pathgen.path_gen.
+        gm: a geomag.GeoMag object. None means WMM.COF.
+    Returns:
+        geo_mag_n: 3x1 or nx3 geomagnetic field in the navigation frame, uT.
+    """
+    if gm is None:
+        gm = geomag.GeoMag("WMM.COF")
+    pos_lla = np.asarray(pos_lla)
+    geo_mag = gm.GeoMagBatch(pos_lla[..., 0]/D2R, pos_lla[..., 1]/D2R, pos_lla[..., 2])
+    geo_mag_n = np.stack((geo_mag.bx, geo_mag.by, geo_mag.bz), -1)  # units in nT
+    geo_mag_n = geo_mag_n / 1000.0          # nT to uT
+    if ref_frame == 1:                      # remove inclination
+        geo_mag_n[..., 0] = np.sqrt(geo_mag_n[..., 0]**2 + geo_mag_n[..., 1]**2)
+        geo_mag_n[..., 1] = 0.0
+    return geo_mag_n
+
+def geo_mag_source(pos_lla, ref_frame, mag_cache=None):
+    """
+    Source of the geomagnetic field along a trajectory.
+    Args:
+        pos_lla: 3x1 or nx3 initial [Lat, Lon, Alt], rad, m.
+        ref_frame: See pathgen.path_gen.
+        mag_cache: See pathgen.path_gen.
+    Returns:
+        geo_mag_n: 3x1 or nx3 geomagnetic field at the initial position in the navigation
+            frame, uT. It is used for the whole trajectory if the returned mag_cache is None.
+        mag_cache: a geomag_cache.GeoMagTileCache to interpolate the field along the
+            trajectory, or None.
+    """
+    geo_mag_n = geo_mag_ned(pos_lla, ref_frame)
+    if ref_frame == 1 or mag_cache is False:
+        # the virtual inertial frame does not move with the vehicle, and the field in it is
+        # always that at the initial position
+        mag_cache = None
+    elif mag_cache is None:
+        mag_cache = geomag_cache.get_cache()
+    return geo_mag_n, mag_cache
+
+def geo_mag_body(c_nb, pos, geo_mag_n, mag_cache=None):
+    """
+    True geomagnetic field in the body frame.
+    Args:
+        c_nb: ...x3x3 coordinate transformation matrices from b to n.
+        pos: ...x3 positions, [Lat, Lon, Alt], rad, m. Only used when mag_cache is not None.
+        geo_mag_n: 3x1 geomagnetic field in the navigation frame, uT. Only used when mag_cache
+            is None.
+        mag_cache: a geomag_cache.GeoMagTileCache to interpolate the field at pos, or None.
+    Returns:
+        geo_mag_b: ...x3 geomagnetic field in the body frame, uT.
+    """
+    if mag_cache is not None:
+        geo_mag_n = mag_cache.field(pos) / 1000.0  # nT to uT
+    # geo_mag_b = c_nb.T.dot(geo_mag_n)
+    return np.einsum('...ji,...j->...i', c_nb, geo_mag_n)
+
+def window_sum(x, idx, x_sum0):
+    """
+    Sum of x over windows ending at idx. The first window contains x[0 : idx[0]+1] and the
+    i-th window contains x[idx[i-1]+1 : idx[i]+1].
+    Args:
+        x: nxm array.
+        idx: indices of the end of each window, increasing.
+        x_sum0: mx1 sum accumulated before x[0], added to the first window.
+    Returns:
+        x_sum: len(idx) x m array, sum of each window.
+        x_sum_rem: mx1 sum of the data after the last window, including x_sum0 if there is
+            no window.
+    """
+    if idx.shape[0] == 0:
+        return np.zeros(x.shape[0:-2] + (0, x.shape[-1])), x_sum0 + np.sum(x, -2)
+    starts = np.hstack((0, idx[0:-1]+1))
+    x_sum = np.add.reduceat(x[..., 0:idx[-1]+1, :], starts, -2)
+    x_sum[..., 0, :] = x_sum[..., 0, :] + x_sum0
+    x_sum_rem = np.sum(x[..., idx[-1]+1:, :], -2)
+    return x_sum, x_sum_rem
+
+def euler2dcm_zyx(angles):
+    """
+    Convert Euler angles (ZYX) to direction cosine matrices.
+    Args:
+        angles: nx3 Euler angles, rad.
+    Returns:
+        dcm: nx3x3 coordinate transformation matrices from n to b
+    """
+    dcm = np.zeros(angles.shape + (3,))
+    cangle = np.cos(angles)
+    sangle = np.sin(angles)
+    dcm[..., 0, 0] = cangle[..., 1]*cangle[..., 0]
+    dcm[..., 0, 1] = cangle[..., 1]*sangle[..., 0]
+    dcm[..., 0, 2] = -sangle[..., 1]
+    dcm[..., 1, 0] = sangle[..., 2]*sangle[..., 1]*cangle[..., 0] - cangle[..., 2]*sangle[..., 0]
+    dcm[..., 1, 1] = sangle[..., 2]*sangle[..., 1]*sangle[..., 0] + cangle[..., 2]*cangle[..., 0]
+    dcm[..., 1, 2] = cangle[..., 1]*sangle[..., 2]
+    dcm[..., 2, 0] = sangle[..., 1]*cangle[..., 2]*cangle[..., 0] + sangle[..., 0]*sangle[..., 2]
+    dcm[..., 2, 1] = sangle[..., 1]*cangle[..., 2]*sangle[..., 0] - cangle[..., 0]*sangle[..., 2]
+    dcm[..., 2, 2] = cangle[..., 1]*cangle[..., 2]
+    return dcm
+
+def euler_angle_range_three_axis(angles):
+    """
+    Vectorized version of attitude.euler_angle_range_three_axis.
+    Args:
+        angles: nx3 Euler angles, rad.
+    Returns:
+        nx3 Euler angles within [-pi, pi], [-pi/2, pi/2] and [-pi, pi].
+    """
+    a1 = angles[..., 0].copy()
+    a2 = angle_range_pi(angles[..., 1])
+    a3 = angles[..., 2].copy()
+    # the second angle is not within [-pi/2, pi/2]?
+    idx = a2 > HALF_PI
+    a2[idx] = math.pi - a2[idx]
+    idx2 = a2 < -HALF_PI
+    a2[idx2] = -math.pi - a2[idx2]
+    idx = np.logical_or(idx, idx2)
+    a1[idx] = a1[idx] + math.pi
+    a3[idx] = a3[idx] + math.pi
+    return np.stack((angle_range_pi(a1), a2, angle_range_pi(a3)), -1)
+
+def angle_range_pi(x):
+    """
+    Vectorized version of attitude.angle_range_pi.
+    """
+    x = np.mod(x, TWO_PI)
+    x[x > math.pi] -= TWO_PI
+    return x
+
+def cross3_batch(a, b):
+    """
+    cross product of arrays of size (n,3).
+    """
+    c = np.zeros(a.shape)
+    c[..., 0] = a[..., 1]*b[..., 2] - a[..., 2]*b[..., 1]
+    c[..., 1] = a[..., 2]*b[..., 0] - a[..., 0]*b[..., 2]
+    c[..., 2] = a[..., 0]*b[..., 1] - a[..., 1]*b[..., 0]
+    return c
@@ -12,54 +12,94 @@ import math
 import numpy as np
 
 # global
-VERSION = '1.0'
+VERSION = '1.1'
+# min and max length of the shaping filter
+MIN_FILTER_LEN = 64
+MAX_FILTER_LEN = 16384
+# max number of samples filtered at a time
+FILTER_BATCH_SIZE = 1 << 20
 
-def time_series_from_psd(sxx, freq, fs, n):
+def time_series_from_psd(sxx, freq, fs, n, rng=None):
     """
     Generate 1-D time series from a given 1-D single-sided power spectal density.
-    To save computational efforts, the max length of time series is 16384.
-    ****If desired length>16384, time series will be repeated. Notice repeat will
-    cause PSD of generated time series differs from the reference PSD.****
+    Normal white noise is filtered by a shaping filter designed from the PSD, see psd_filter
+    and filter_noise. The time series does not repeat, and its length is not limited.
     Args:
         sxx: 1D single-sided PSD.
         freq: frequency responding to sxx.
         fs: samplling frequency.
         n: samples of the time series.
+        rng: a numpy.random.Generator to generate random numbers. None means the global
+            numpy.random.
     Returns:
         status: true if sucess, false if error.
         x: time series
     """
-    x = np.zeros((n,))
     ### check input sampling frequency
     if fs < 2.0*freq[-1] or fs < 0.0:
-        return False, x
-    ### check if interpolation is needed
-    repeat_output = False
-    N = n
-    if n%2 != 0:                                # N should be even
-        N = n+1
-        repeat_output = True
-    if N > 16384:                               # max data length is 16384
-        N = 16384
-        repeat_output = True
-    ### convert psd to time series
-    L = freq.shape[0]                           # num of samples in psd
-    if L != N//2+1:                             # interp psd instead of output
-        L = N//2 + 1
-        freq_interp = np.linspace(0, fs/2.0, L)
-        sxx = np.interp(freq_interp, freq, sxx)
-    sxx[1:L-1] = 0.5 * sxx[1:L-1]               # single-sided psd amplitude to double-sided
-    ax = np.sqrt(sxx*N*fs)                      # double-sided frequency spectrum amplitude
-    phi = math.pi * np.random.randn(L)          # random phase
-    xk = ax * np.exp(1j*phi)                    # single-sided frequency spectrum
-    xk = np.hstack([xk, xk[-2:0:-1].conj()])    # double-sided frequency spectrum
-    xm = np.fft.ifft(xk)                        # inverse fft
-    x_tmp = xm.real                             # real part
-    ### repeat x to output time series of desired lenght n
-    if repeat_output is True:
-        repeat_num = n // N
-        repeat_remainder = n % N
-        x = np.hstack([np.tile(x_tmp, (repeat_num,)), x_tmp[0:repeat_remainder]])
-    else:
-        x = x_tmp
-    return True, x
+        return False, np.zeros((n,))
+    return True, filter_noise(psd_filter(sxx, freq, fs), n, rng)
+
+def psd_filter(sxx, freq, fs, filter_len=None):
+    """
+    Design a linear-phase FIR shaping filter. Normal white noise of unit variance filtered by
+    it has the given single-sided PSD. The filter only depends on the PSD, so it can be
+    designed once and reused by all time series of the same PSD.
+    Args:
+        sxx: 1D single-sided PSD.
+        freq: frequency responding to sxx, Hz.
+        fs: samplling frequency, Hz.
+        filter_len: length of the filter, a power of 2. None means it is chosen so that the
+            frequency resolution of the filter is at least twice of that of the PSD.
+    Returns:
+        hk: frequency response of the filter zero-padded to 2*filter_len, filter_len+1 complex
+            values. Use it with filter_noise.
+    """
+    sxx = np.asarray(sxx, dtype=float)
+    freq = np.asarray(freq, dtype=float)
+    if fs <= 0.0 or fs < 2.0*freq[-1]:
+        raise ValueError('fs should be positive and at least twice of the max PSD frequency.')
+    if filter_len is None:
+        df = np.diff(freq)
+        df = df[df > 0]
+        filter_len = MAX_FILTER_LEN if df.size == 0 else 2.0*fs/df.min()
+        filter_len = 1 << int(math.ceil(math.log2(max(filter_len, 1.0))))
+        filter_len = min(max(filter_len, MIN_FILTER_LEN), MAX_FILTER_LEN)
+    # white noise of unit variance has a single-sided PSD of 2/fs, so |H|^2 = sxx*fs/2
+    f = np.arange(filter_len//2 + 1) * fs / filter_len
+    amp = np.sqrt(np.maximum(np.interp(f, freq, sxx), 0.0) * fs / 2.0)
+    # zero-phase impulse response, delayed by half of the filter length and windowed
+    h = np.roll(np.fft.irfft(amp, filter_len), filter_len//2)
+    h *= np.hanning(filter_len + 1)[:filter_len]
+    return np.fft.rfft(h, 2*filter_len)
+
+def filter_noise(hk, n, rng=None):
+    """
+    Filter normal white noise of unit variance by a shaping filter with overlap-add. The noise
+    is generated and filtered in blocks, so memory use does not grow with n except the output.
+    Noise before the first output sample is also filtered, so there is no start-up transient.
+    Args:
+        hk: frequency response of the filter, output of psd_filter.
+        n: samples of the time series.
+        rng: a numpy.random.Generator to generate random numbers. None means the global
+            numpy.random.
+    Returns:
+        x: time series of n samples.
+    """
+    if rng is None:
+        rng = np.random
+    m = hk.shape[0] - 1                             # filter length, also the block length
+    nfft = 2 * m
+    batch = max(1, FILTER_BATCH_SIZE // m)          # blocks filtered at a time
+    total = n + m                                   # the first m samples are discarded
+    blocks = -(-total // m)
+    y = np.zeros((blocks*m + m,))
+    for start in range(0, blocks, batch):
+        k = min(batch, blocks - start)
+        w = rng.standard_normal((k, m))
+        yk = np.fft.irfft(np.fft.rfft(w, nfft, axis=1) * hk, nfft, axis=1)
+        # overlap-add: the second half of each block adds to the next block
+        i = start * m
+        y[i:i+k*m] += yk[:, :m].ravel()
+        y[i+m:i+(k+1)*m] += yk[:, m:].ravel()
+    return y[m:m+n]
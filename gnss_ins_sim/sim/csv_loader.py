@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Filename: csv_loader.py
+
+"""
+Load data files of Sim.
+A data file is a .csv file with units in the first row, for example
+'accel_x (m/s^2),accel_y (m/s^2),accel_z (m/s^2)'. The header and the data are read in one pass,
+and the data are parsed in chunks. Optionally, the data are saved in a .npy sidecar on first
+load, together with a .json file of the units and the size and modification time of the .csv
+file. Sidecars are saved in a cache directory instead of next to the .csv file, and are named
+by a hash of the absolute name of the .csv file. Later loads memory-map the sidecar if the .csv
+file is unchanged.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+import os
+import json
+import hashlib
+import itertools
+import numpy as np
+
+# sidecar format version, change it when the content of the sidecar files changes
+SIDECAR_VERSION = '1'
+# number of rows parsed at a time
+CHUNK_ROWS = 100000
+# default directory of sidecar files
+DEFAULT_SIDECAR_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gnss_ins_sim', 'csv')
+
+def parse_units(header):
+    '''
+    Get data units from the header of a data file.
+    Args:
+        header: first row of the file, column names with units in brackets.
+    Returns:
+        units: a list of units corresponding to each column in the file. If not untis
+            found, units is None.
+    '''
+    units = None
+    line = header.split(',')
+    tmp_units = []
+    for i in line:
+        left_bracket = i.find('(')
+        right_bracket = i.rfind(')')
+        if left_bracket != -1 and right_bracket != -1 and right_bracket > left_bracket:
+            tmp_units.append(i[left_bracket+1:right_bracket])
+    if len(tmp_units) == len(line):
+        units = tmp_units
+    return units
+
+def read_csv(file_name):
+    '''
+    Read a data file. The number of columns is known from the header, and the data are parsed
+    in chunks of CHUNK_ROWS rows. Files that cannot be parsed this way (for example, with
+    missing values) are read by numpy.genfromtxt.
+    Args:
+        file_name: full file name.
+    Returns:
+        data: numpy array of the data. It is 1D if the file has only one column.
+        units: see parse_units.
+    '''
+    with open(file_name) as fp:
+        header = fp.readline()
+        ncol = len(header.split(','))
+        chunks = []
+        try:
+            while True:
+                lines = list(itertools.islice(fp, CHUNK_ROWS))
+                if not lines:
+                    break
+                x = np.loadtxt(lines, delimiter=',', ndmin=2)
+                if x.shape[0] > 0 and x.shape[1] != ncol:
+                    raise ValueError('%s columns in data but %s in header.'% (x.shape[1], ncol))
+                chunks.append(x)
+        except ValueError:
+            chunks = None
+    if chunks is None:
+        data = np.genfromtxt(file_name, delimiter=',', skip_header=1)
+    else:
+        data = np.concatenate(chunks) if chunks else np.zeros((0, ncol))
+        if ncol == 1:
+            data = data[:, 0]
+    return data, parse_units(header)
+
+def sidecar_name(file_name, sidecar_dir):
+    '''
+    Name of the sidecar files of a data file, without extension.
+    Args:
+        file_name: full file name of the data file.
+        sidecar_dir: directory of sidecar files.
+    Returns:
+        the sidecar name in sidecar_dir. It is the base name of the data file followed by a
+        hash of its absolute name, so that files of the same name in different directories
+        have different sidecars.
+    '''
+    file_name = os.path.abspath(file_name)
+    h = hashlib.sha1(file_name.encode('utf-8')).hexdigest()
+    return os.path.join(sidecar_dir, '%s-%s' % (os.path.basename(file_name), h))
+
+def load_csv(file_name, sidecar_dir=None):
+    '''
+    Load a data file, from its sidecar if possible.
+    Args:
+        file_name: full file name.
+        sidecar_dir: directory of sidecar files, e.g. DEFAULT_SIDECAR_DIR. None means the
+            .csv file is always read and no sidecar is used.
+    Returns:
+        data: numpy array of the data. It is a read-only memory-mapped array if it is loaded
+            from the sidecar.
+        units: see parse_units.
+    '''
+    if sidecar_dir is None:
+        return read_csv(file_name)
+    name = sidecar_name(file_name, sidecar_dir)
+    npy_file = name + '.npy'
+    meta_file = name + '.json'
+    stat = os.stat(file_name)
+    meta = {'version': SIDECAR_VERSION, 'file': os.path.abspath(file_name),
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    try:
+        with open(meta_file) as fp:
+            saved_meta = json.load(fp)
+        if all([saved_meta.get(i) == meta[i] for i in meta]):
+            return np.load(npy_file, mmap_mode='r'), saved_meta['units']
+    except (OSError, ValueError, KeyError):
+        pass
+    data, units = read_csv(file_name)
+    meta['units'] = units
+    meta['shape'] = list(data.shape)
+    tmp_npy_file = npy_file + '.%s.tmp' % os.getpid()
+    tmp_meta_file = meta_file + '.%s.tmp' % os.getpid()
+    try:
+        # write to temporary files and then rename them, so that a partially written sidecar
+        # is never loaded. The .json file is written last.
+        os.makedirs(sidecar_dir, exist_ok=True)
+        with open(tmp_npy_file, 'wb') as fp:
+            np.save(fp, data)
+        os.replace(tmp_npy_file, npy_file)
+        with open(tmp_meta_file, 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(tmp_meta_file, meta_file)
+    except OSError:
+        print('Cannot save sidecar of %s in %s.'% (file_name, sidecar_dir))
+        for i in [tmp_npy_file, tmp_meta_file]:
+            if os.path.isfile(i):
+                os.remove(i)
+    return data, units
@@ -23,7 +23,7 @@ accel_low_accuracy = {'b': np.array([0.0e-3, 0.0e-3, 0.0e-3]),
                       'b_drift': np.array([2.0e-4, 2.0e-4, 2.0e-4]),
                       'b_corr': np.array([100.0, 100.0, 100.0]),
                       'vrw': np.array([0.05, 0.05, 0.05]) / 60.0}
-mag_low_accuracy = {'si': np.eye(3) + np.random.randn(3, 3)*0.0,
+mag_low_accuracy = {'si': np.eye(3),
                     'hi': np.array([10.0, 10.0, 10.0])*0.0,
                     'std': np.array([0.1, 0.1, 0.1])}
 # mid accuracy, partly from IMU381
@@ -35,7 +35,7 @@ accel_mid_accuracy = {'b': np.array([0.0e-3, 0.0e-3, 0.0e-3]),
                       'b_drift': np.array([5.0e-5, 5.0e-5, 5.0e-5]),
                       'b_corr': np.array([100.0, 100.0, 100.0]),
                       'vrw': np.array([0.03, 0.03, 0.03]) / 60}
-mag_mid_accuracy = {'si': np.eye(3) + np.random.randn(3, 3)*0.0,
+mag_mid_accuracy = {'si': np.eye(3),
                     'hi': np.array([10.0, 10.0, 10.0])*0.0,
                     'std': np.array([0.01, 0.01, 0.01])}
 # high accuracy, partly from HG9900, partly from
@@ -48,7 +48,7 @@ accel_high_accuracy = {'b': np.array([0.0e-3, 0.0e-3, 0.0e-3]),
                        'b_drift': np.array([3.6e-6, 3.6e-6, 3.6e-6]),
                        'b_corr': np.array([100.0, 100.0, 100.0]),
                        'vrw': np.array([2.5e-5, 2.5e-5, 2.5e-5]) / 60}
-mag_high_accuracy = {'si': np.eye(3) + np.random.randn(3, 3)*0.0,
+mag_high_accuracy = {'si': np.eye(3),
                      'hi': np.array([10.0, 10.0, 10.0])*0.0,
                      'std': np.array([0.001, 0.001, 0.001])}
 
@@ -8,6 +8,54 @@ Created on 2018-04-28
 """
 
 import copy
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import shared_data
+
+def run_algo_task(algo, set_of_input, run_index=0):
+    '''
+    Run an algorithm once. In a worker process, algo is a copy of the algorithm, so runs do not
+    share states.
+    Args:
+        algo: an algorithm.
+        set_of_input: input of the algorithm. shared_data.SharedArray handles in it are
+            attached.
+        run_index: number of runs of the algorithm before this one in the same run_algo call.
+            If the algorithm counts its runs in an attribute run_times, e.g., to choose a set of
+            initial states, run_times of the copy is advanced by run_index, so it is the same as
+            when the runs are done one after another.
+    Returns:
+        output of algo.get_results().
+    '''
+    set_of_input = [shared_data.resolve(x) for x in set_of_input]
+    if hasattr(algo, 'run_times'):
+        algo.run_times += run_index
+    algo.reset()
+    algo.run(algo_input(algo, set_of_input))
+    return algo.get_results()
+
+def algo_input(algo, set_of_input):
+    '''
+    Input passed to algo.run. Numpy arrays are passed as read-only views instead of copies, so
+    that data in the data manager cannot be changed by the algorithm. If the algorithm has an
+    attribute needs_writable_input set to True, a copy of the input is passed instead.
+    Args:
+        algo: an algorithm.
+        set_of_input: input of the algorithm.
+    Returns:
+        a list of the input data.
+    '''
+    if getattr(algo, 'needs_writable_input', False):
+        return copy.deepcopy(set_of_input)
+    algo_in = []
+    for x in set_of_input:
+        if isinstance(x, np.ndarray):
+            x = x.view()
+            x.flags.writeable = False
+        elif not np.isscalar(x):
+            x = copy.deepcopy(x)
+        algo_in.append(x)
+    return algo_in
 
 class InsAlgoMgr(object):
     '''
@@ -36,7 +84,7 @@ class InsAlgoMgr(object):
         if self.algo is not None:
             self.__check_algo()
 
-    def run_algo(self, input_data, keys=None):
+    def run_algo(self, input_data, keys=None, workers=None, shared_input=None):
         '''
         Run the algorithm with given input
         Args:
@@ -48,6 +96,16 @@ class InsAlgoMgr(object):
                 sets of gyro data: w={key0: set_of_data_#0, key1: set_of_data#1}.
                 w is a element of input. keys should be [key0, key1]. For each run of the algo,
                 gyro data is chosen accroding to the keys.
+            workers: number of worker processes. None or 1 means all algorithms are run in
+                this process one after another, and each algorithm is reset before each run.
+                Otherwise, each run of each algorithm is a task in a process pool, and is run by
+                a copy of the algorithm. The attribute run_times of the copy, if any, is set as
+                if the runs were done one after another, see run_algo_task. Algorithms with an
+                attribute parallel_safe set to False, e.g., those calling shared libraries, are
+                still run in this process.
+            shared_input: a dict of shared_data.SharedArray handles of input data, keys are
+                names of the input data. Tasks in the process pool get the handles and attach
+                the data instead of receiving copies of them.
         Returns:
             results: a list containing data defined in self.output.  Each output in results is
                 a dict with keys 'algorithm_name' + '_' + 'simulation run'. For example:
@@ -56,7 +114,6 @@ class InsAlgoMgr(object):
         if len(input_data) != self.nin:
             raise ValueError('Required %s input, but provide %s.'% (self.nin, len(input_data)))
         #### call the algorithm
-        set_of_input = []
         # run the algorithm once
         results = []
         for i in range(self.nout):
@@ -69,32 +126,60 @@ class InsAlgoMgr(object):
                 if isinstance(i, dict):
                     keys = list(i.keys())
                     break
-        # run each algorithm
+        # tasks of each algorithm and each simulation run
+        tasks = []
         for i in range(self.nalgo):
-            # algo name will be used as a key to index results of this algo
-            this_algo_name = self.get_algo_name(i)
-            # run the algorithm for each simulation
             for key in keys:
-                self.algo[i].reset()    # reset/initialize before each run
-                # prepare input
-                set_of_input = []
-                for j in self.input_alloc[i]:  # j is the index of input of this algo in self.input
-                    if isinstance(input_data[j], dict):
-                        if key in input_data[j]:
-                            set_of_input.append(input_data[j][key])
-                        else:
-                            raise ValueError("set_of_input has keys %s, but you are requiring %s"\
-                                            % (input_data[j].keys(), key))
-                    else:
-                        set_of_input.append(input_data[j])
-                self.algo[i].run(copy.deepcopy(set_of_input))   # deepcopy to avoid being changed
-                # get algorithm output of this run
-                this_results = self.algo[i].get_results()
+                tasks.append((i, key))
+        run_index = dict([(key, k) for k, key in enumerate(keys)])
+        # run tasks in a process pool
+        parallel = workers is not None and workers > 1
+        futures = {}
+        executor = None
+        if parallel:
+            parallel_tasks = [x for x in tasks if self.is_parallel_safe(x[0])]
+            if len(parallel_tasks) > 0:
+                executor = ProcessPoolExecutor(max_workers=min(workers, len(parallel_tasks)))
+                for i, key in parallel_tasks:
+                    futures[(i, key)] = executor.submit(run_algo_task, self.algo[i],\
+                                                        self.__get_input(input_data, i, key,
+                                                                         shared_input),
+                                                        run_index[key])
+        try:
+            for i, key in tasks:
+                # algo name will be used as a key to index results of this algo
+                this_algo_name = self.get_algo_name(i)
+                if (i, key) in futures:
+                    this_results = futures[(i, key)].result()
+                else:
+                    self.algo[i].reset()    # reset/initialize before each run
+                    # read-only views or a copy to avoid being changed
+                    self.algo[i].run(algo_input(self.algo[i],\
+                                                self.__get_input(input_data, i, key)))
+                    # get algorithm output of this run
+                    this_results = self.algo[i].get_results()
                 # add algorithm output of this run to results
                 for j in range(len(self.output_alloc[i])):
                     results[self.output_alloc[i][j]][this_algo_name+'_'+str(key)] = this_results[j]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        # the runs in the process pool are done by copies, count them in the algorithms
+        for i in set([x[0] for x in futures]):
+            if hasattr(self.algo[i], 'run_times'):
+                self.algo[i].run_times += len(keys)
         return results
 
+    def is_parallel_safe(self, i):
+        '''
+        Tell if the i-th algorithm can be run in a worker process.
+        Args:
+            i: index of the algorithm
+        Returns:
+            the attribute parallel_safe of the algorithm, True if it is not defined.
+        '''
+        return getattr(self.algo[i], 'parallel_safe', True)
+
     def get_algo_name(self, i):
         '''
         get the name of the i-th algo
@@ -113,6 +198,29 @@ class InsAlgoMgr(object):
             else:
                 return 'algo' + str(i)
 
+    def __get_input(self, input_data, i, key, shared_input=None):
+        '''
+        Input of one run of the i-th algorithm.
+        Args:
+            input_data, keys, shared_input: see run_algo.
+            i: index of the algorithm
+        Returns:
+            a list of the input data of this run.
+        '''
+        set_of_input = []
+        for j in self.input_alloc[i]:  # j is the index of input of this algo in self.input
+            if shared_input is not None and self.input[j] in shared_input:
+                set_of_input.append(shared_input[self.input[j]])
+            elif isinstance(input_data[j], dict):
+                if key in input_data[j]:
+                    set_of_input.append(input_data[j][key])
+                else:
+                    raise ValueError("set_of_input has keys %s, but you are requiring %s"\
+                                    % (input_data[j].keys(), key))
+            else:
+                set_of_input.append(input_data[j])
+        return set_of_input
+
     def __check_algo(self):
         '''
         Generate expressions to handle algorithm input and output.
@@ -7,14 +7,19 @@ Created on 2018-04-24
 @author: dongxiaoguang
 """
 
-import math
+import os
+import weakref
 import numpy as np
 from . import sim_data
 from .sim_data import Sim_data
+from .shared_data import SharedArrays
 from ..attitude import attitude
 from ..kml_gen import kml_gen
 from ..geoparams import geoparams
 
+# max number of elements of the stacked runs whose errors are calculated together
+ERR_BLOCK_SIZE = 1 << 22
+
 class InsDataMgr(object):
     '''
     A class that manage all data generated in an INS solution. For example, reference data,
@@ -299,6 +304,12 @@ class InsDataMgr(object):
                            self.att_quat.name: [self.att_euler, self.__quat2euler_zyx]}
         # error info, self.get_error_stat() and self.plot() will both update error info
         self.__err = {}
+        # calculated errors, {(data_name, err_opt, angle): [versions of data and ref, error]}
+        self.__err_cache = {}
+        # data published to shared memory for worker processes, removed when the manager is
+        # garbage collected or release_shared_data is called
+        self.__shared = SharedArrays()
+        weakref.finalize(self, self.__shared.close)
 
     def add_data(self, data_name, data, key=None, units=None):
         '''
@@ -328,6 +339,50 @@ class InsDataMgr(object):
         else:
             raise ValueError("Unsupported data: %s."%data_name)
 
+    def add_associated_data(self, data_name, src_name, func):
+        '''
+        Add data_name as associated data of src_name. data_name is added to available, but its
+        data are calculated from the data of src_name only when first accessed, and are
+        recalculated if the data of src_name change. Data explicitly added by add_data later
+        replace the associated data.
+        Args:
+            data_name: name of the associated data.
+            src_name: name of the source data.
+            func: a function to calculate data_name from a scalar or numpy array of src_name.
+        '''
+        if data_name not in self.__all:
+            raise ValueError("Unsupported data: %s."%data_name)
+        if src_name not in self.__all:
+            raise ValueError("Unsupported data: %s."%src_name)
+        self.__all[data_name].set_source(self.__all[src_name], func)
+        if data_name not in self.available:
+            self.available.append(data_name)
+
+    def share_data(self, data_names):
+        '''
+        Publish data to shared memory, so that worker processes can attach them without
+        copying. Data that are not numpy arrays are not published. Published data are reused
+        until they change.
+        Args:
+            data_names: a list of data names.
+        Returns:
+            a dict of shared_data.SharedArray handles, keys are data names.
+        '''
+        handles = {}
+        for i in data_names:
+            if i not in self.available:
+                continue
+            data = self.__all[i].data
+            if isinstance(data, np.ndarray):
+                handles[i] = self.__shared.publish(i, data, self.__all[i].version)
+        return handles
+
+    def release_shared_data(self):
+        '''
+        Remove all data published to shared memory.
+        '''
+        self.__shared.close()
+
     def set_algo_output(self, algo_output):
         '''
         Tell data manager what output an algorithm provide
@@ -424,10 +479,7 @@ class InsDataMgr(object):
             return None
         # calculate error
         err_data_name = 'err_' + data_name
-        if err_data_name not in self.__err:
-            data_err = self.calc_data_err(data_name, ref_data_name, angle, extra_opt)
-            if data_err is not None:
-                self.__err[data_err.name] = data_err
+        self.__get_data_err(data_name, ref_data_name, angle, extra_opt)
         if err_stats_start == -1:
             # end-point error
             err_stat = self.__end_point_error_stats(data_name)
@@ -488,6 +540,9 @@ class InsDataMgr(object):
                 err.legend = ['pos_x', 'pos_y', 'pos_z']
         if isinstance(self.__all[data_name].data, dict):
             ref_data = None
+            # runs of the same size share the same reference, and are stacked to calculate
+            # errors together.
+            group = []
             for i in self.__all[data_name].data:
                 # get raw reference data for first key in the dict, use reference from last
                 # step for other keys to avoid multiple interps.
@@ -499,13 +554,18 @@ class InsDataMgr(object):
                     # print("%s has different number of samples from its reference."% data_name)
                     # print('Interpolation needed.')
                     if self.algo_time.name in self.available and self.time.name in self.available:
+                        self.__group_error(err, data_name, group, ref_data, angle, lla)
+                        group = []
                         ref_data = self.__interp(self.algo_time.data[i],\
                                                  self.time.data, self.__all[ref_data_name].data)
                     else:
                         print("%s or %s is not available."% (self.algo_time.name, self.time.name))
                         return None
-                # error stat
-                err.data[i] = self.array_error(self.__all[data_name].data[i], ref_data, angle, lla)
+                group.append(i)
+                if len(group) * ref_data.size >= ERR_BLOCK_SIZE:
+                    self.__group_error(err, data_name, group, ref_data, angle, lla)
+                    group = []
+            self.__group_error(err, data_name, group, ref_data, angle, lla)
         elif isinstance(self.__all[data_name].data, np.ndarray):
             ref_data = self.__all[ref_data_name].data.copy()
             # Interpolation
@@ -525,10 +585,11 @@ class InsDataMgr(object):
         '''
         Calculate the error of an array w.r.t its reference.
         Args:
-            x: input data, numpy array.
-            r: reference data, same size as x.
+            x: input data, numpy array. Errors of multiple runs can be calculated together by
+                stacking them along a leading axis, e.g. (runs,n,3).
+            r: reference data, same size as x, or same size as each run in x.
             angle: True if x contains angles, False if not.
-            pos: 0 if x is not in LLA form;
+            lla: 0 if x is not in LLA form;
                  1 if x is in LLA form, and NED error is required;
                  >=2 if x is in LLA form, and ECEF error is required.
         Returns:
@@ -537,8 +598,7 @@ class InsDataMgr(object):
         if lla == 0:
             err = x - r
             if angle:
-                for j in range(len(err.flat)):
-                    err.flat[j] = attitude.angle_range_pi(err.flat[j])
+                err = attitude.angle_range_pi(err)
         else:
             # convert x and r to ECEF first
             x_ecef = geoparams.lla2ecef_batch(x)
@@ -546,10 +606,8 @@ class InsDataMgr(object):
             err = x_ecef - r_ecef
             # convert ecef err to NED err
             if lla == 1:
-                n = err.shape[0]
-                for i in range(0, n):
-                    c_ne = attitude.ecef_to_ned(r[i, 0], r[i, 1])
-                    err[i, :] = c_ne.dot(err[i, :])
+                c_ne = attitude.ecef_to_ned_batch(r[..., 0], r[..., 1])
+                err = np.matmul(c_ne, err[..., np.newaxis])[..., 0]
         return err
 
     def save_data(self, data_dir):
@@ -610,11 +668,8 @@ class InsDataMgr(object):
             # plot
             if ref_data_name is not None:
                 err_data_name = 'err_' + what_to_plot
-                # error data not generated yet, generate it
-                if err_data_name not in self.__err:
-                    data_err = self.calc_data_err(what_to_plot, ref_data_name, angle=angle)
-                    if data_err is not None:
-                        self.__err[data_err.name] = data_err
+                # error data not generated yet or out of date, generate it
+                self.__get_data_err(what_to_plot, ref_data_name, angle=angle)
                 # error data generated, plot it
                 if err_data_name in self.__err:
                     self.__err[err_data_name].plot(x_axis, key=keys,\
@@ -636,62 +691,44 @@ class InsDataMgr(object):
         '''
         sim_data.show_plot()
 
-    def save_kml_files(self, data_dir):
+    def save_kml_files(self, data_dir, tol=kml_gen.DEFAULT_TOL):
         '''
-        generate kml files from reference position and simulation position.
+        generate a .kmz file from reference position, GPS position and simulation position.
+        Each run is a track in the file. Tracks are simplified within tol.
         Args:
-            data_dir: kml files are saved in data_dir
+            data_dir: the .kmz file is saved in data_dir
+            tol: max deviation of the simplified tracks from the original tracks, m.
         '''
         convert_xyz_to_lla = False
         if self.ref_frame.data == 1:
             convert_xyz_to_lla = True
-        # ref position
-        if 'ref_pos' in self.available:
-            if 'ref_att_euler' in self.available:
-                heading = self.__all['ref_att_euler'].data[:, 0] * attitude.R2D
-            else:
-                heading = None
-            max_points = self.__all['ref_pos'].data.shape[0] / self.__all['fs'].data
-            kml_gen.kml_gen(data_dir,\
-                            self.__all['ref_pos'].data,\
-                            heading=heading,\
-                            name='ref_pos',\
-                            convert_to_lla=convert_xyz_to_lla,\
-                            color='ff0000ff',\
-                            max_points=max_points)
-        # gps position
-        if 'gps' in self.available:
-            for i in self.__all['gps'].data.keys():
-                pos_name = 'gps_' + str(i)
-                heading = np.zeros((self.__all['gps'].data[i].shape[0],))
-                for j in range(self.__all['gps'].data[i].shape[0]):
-                    heading[j] = math.atan2(self.__all['gps'].data[i][j,4],
-                                            self.__all['gps'].data[i][j,3]) * attitude.R2D
-                    self.__all['gps'].data[i][j, 0:3] *= self.__all['gps_visibility'].data[j]
-                max_points = self.__all['gps'].data[i].shape[0] / self.__all['fs_gps'].data
-                kml_gen.kml_gen(data_dir,\
-                                self.__all['gps'].data[i][:, 0:3],\
-                                heading=heading,\
-                                convert_to_lla=convert_xyz_to_lla,\
-                                name=pos_name,\
-                                color='ff00ff00',\
-                                max_points=max_points)
-        # simulation position
-        if 'pos' in self.available:
-            for i in self.__all['pos'].data.keys():
-                pos_name = 'pos_' + str(i)
-                if 'att_euler' in self.available:
-                    heading = self.__all['att_euler'].data[i][:, 0] * attitude.R2D
-                else:
-                    heading = None
-                max_points = self.__all['pos'].data[i].shape[0] / self.__all['fs'].data
-                kml_gen.kml_gen(data_dir,\
-                                self.__all['pos'].data[i],\
-                                heading=heading,\
-                                convert_to_lla=convert_xyz_to_lla,\
-                                name=pos_name,\
-                                color='ffff0000',\
-                                max_points=max_points)
+        # [name, color, data name, GPS visibility]
+        tracks = [['ref_pos', 'ff0000ff', self.ref_pos.name, False],\
+                  ['gps', 'ff00ff00', self.gps.name, True],\
+                  ['pos', 'ffff0000', self.pos.name, False]]
+        kmz_file = os.path.join(data_dir, 'trajectories.kmz')
+        with kml_gen.KmzWriter(kmz_file, tol=tol) as kmz:
+            for name, color, data_name, gps in tracks:
+                if data_name not in self.available:
+                    continue
+                data = self.__all[data_name].data
+                if not isinstance(data, dict):
+                    data = {None: data}
+                valid = None
+                if gps and self.gps_visibility.name in self.available:
+                    valid = self.gps_visibility.data
+                kmz.begin_folder(name)
+                for i in data:
+                    track_name = name if i is None else name + '_' + str(i)
+                    lla = kml_gen.pos_to_lla(data[i][:, 0:3], convert_xyz_to_lla)
+                    if convert_xyz_to_lla:
+                        # save lla to .csv file. ** This is needed by the web version.
+                        lla_deg = lla.copy()
+                        lla_deg[:, 0:2] = lla_deg[:, 0:2] * attitude.R2D
+                        np.savetxt(os.path.join(data_dir, track_name + '_LLA.csv'), lla_deg,\
+                                   header='Latitude (deg), Longitude (deg), Altitude (m)',\
+                                   delimiter=',', comments='')
+                    kmz.add_track(track_name, lla, color, valid)
 
     def is_supported(self, data_name):
         '''
@@ -714,6 +751,30 @@ class InsDataMgr(object):
                 rtn = False
         return rtn
 
+    def __get_data_err(self, data_name, ref_data_name, angle=False, err_opt=''):
+        '''
+        Get error of one set of data, and make it the current error of data_name used by error
+        stats and plot. Calculated errors are cached, and recalculated if data_name or
+        ref_data_name has changed.
+        Args:
+            data_name, ref_data_name, angle, err_opt: see calc_data_err.
+        Returns:
+            an Sim_data object corresponds to data_name, or None if it cannot be calculated.
+        '''
+        # associated data change their versions when first calculated, so get data first
+        self.get_data([data_name, ref_data_name])
+        versions = (self.__all[data_name].version, self.__all[ref_data_name].version)
+        key = (data_name, err_opt, angle)
+        if key in self.__err_cache and self.__err_cache[key][0] == versions:
+            data_err = self.__err_cache[key][1]
+        else:
+            data_err = self.calc_data_err(data_name, ref_data_name, angle, err_opt)
+            if data_err is not None:
+                self.__err_cache[key] = [versions, data_err]
+        if data_err is not None:
+            self.__err[data_err.name] = data_err
+        return data_err
+
     def __end_point_error_stats(self, data_name, group=True):
         '''
         end-point error statistics
@@ -831,6 +892,27 @@ class InsDataMgr(object):
             groups = None
         return groups
 
+    def __group_error(self, err, data_name, keys, ref_data, angle, lla):
+        '''
+        Calculate errors of a group of runs of the same size, and add them to err.
+        Args:
+            err: Sim_data of the error.
+            data_name: name of the input data.
+            keys: keys of the runs in the data.
+            ref_data: reference data of the runs.
+            angle, lla: see array_error.
+        '''
+        if len(keys) == 0:
+            return
+        data = self.__all[data_name].data
+        if len(keys) == 1:
+            err.data[keys[0]] = self.array_error(data[keys[0]], ref_data, angle, lla)
+            return
+        x = np.stack([data[i] for i in keys])
+        group_err = self.array_error(x, ref_data, angle, lla)
+        for i in range(len(keys)):
+            err.data[keys[i]] = group_err[i]
+
     def __interp(self, x, xp, fp):
         '''
         data interpolation
@@ -852,17 +934,10 @@ class InsDataMgr(object):
         quaternion to Euler angles (zyx)
         '''
         if isinstance(src.data, np.ndarray):
-            n = src.data.shape[0]
-            dst.data = np.zeros((n, 3))
-            for j in range(n):
-                dst.data[j, :] = attitude.quat2euler(src.data[j, :])
+            dst.data = attitude.quat2euler_batch(src.data)
         elif isinstance(src.data, dict):
             for i in src.data:
-                n = src.data[i].shape[0]
-                euler = np.zeros((n, 3))
-                for j in range(n):
-                    euler[j, :] = attitude.quat2euler(src.data[i][j, :])
-                dst.data[i] = euler
+                dst.data[i] = attitude.quat2euler_batch(src.data[i])
         else:
             raise ValueError('%s is not a dict or numpy array.'% src.name)
 
@@ -872,17 +947,10 @@ class InsDataMgr(object):
         '''
         # array
         if isinstance(src.data, np.ndarray):
-            n = src.data.shape[0]
-            dst.data = np.zeros((n, 4))
-            for j in range(n):
-                dst.data[j, :] = attitude.euler2quat(src.data[j, :])
+            dst.data = attitude.euler2quat_batch(src.data)
         # dict
         elif isinstance(src.data, dict):
             for i in src.data:
-                n = src.data[i].shape[0]
-                quat = np.zeros((n, 4))
-                for j in range(n):
-                    quat[j, :] = attitude.euler2quat(src.data[i][j, :])
-                dst.data[i] = quat
+                dst.data[i] = attitude.euler2quat_batch(src.data[i])
         else:
             raise ValueError('%s is not a dict or numpy array.'% src.name)
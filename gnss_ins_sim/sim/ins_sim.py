@@ -10,12 +10,19 @@ Created on 2018-04-24
 import os
 import time
 import math
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from .ins_data_manager import InsDataMgr
 from .ins_algo_manager import InsAlgoMgr
+from .traj_cache import TrajCache
+from .sim_rng import SimRng
+from . import csv_loader
+from . import shared_data
 from ..pathgen import pathgen
+from ..pathgen import pathgen_vec
 from ..attitude import attitude
 from ..geoparams import geoparams
+from ..geoparams import geomag_cache
 
 # version info
 NAME = 'gnss-ins-sim'
@@ -24,12 +31,89 @@ VERSION = '3.0.0_alpha'
 # built-in mobility
 high_mobility = np.array([1.0, 0.5, 2.0])   # m/s/s, rad/s/s, rad/s
 
+# reference data and error models shared by the runs generated in a worker process
+_sensor_ctx = None
+
+def sensor_noise_count(ctx):
+    '''
+    Number of normal random numbers used by gen_sensor_data.
+    Args:
+        ctx: see gen_sensor_data.
+    Returns:
+        number of random numbers.
+    '''
+    imu = ctx['imu']
+    n = ctx['ref_accel'].shape[0]
+    # bias drift and white noise of accel and gyro
+    count = 12 * n
+    vib_def = ctx['vib_def']
+    if vib_def is not None and vib_def['type'] == 'random':
+        count += 3 * n
+    elif vib_def is not None and vib_def['type'] == 'psd':
+        for axis in ['x', 'y', 'z']:
+            m = vib_def['filter'][axis].shape[0] - 1
+            count += -(-(n + m) // m) * m
+    if imu.gps:
+        count += 6 * ctx['ref_gps'].shape[0]
+    if imu.magnetometer:
+        count += 3 * ctx['ref_mag'].shape[0]
+    if imu.odo:
+        count += ctx['ref_odo'].shape[0]
+    return count
+
+def gen_sensor_data(ctx, rng):
+    '''
+    Generate sensor data of one simulation run.
+    Args:
+        ctx: a dict of reference data and error models.
+            'fs': IMU sample rate, Hz.
+            'ref_frame': reference frame.
+            'imu': the IMU model.
+            'vib_def': vibration model, see pathgen.acc_gen.
+            'ref_accel', 'ref_gyro', 'ref_gps', 'ref_mag', 'ref_odo': reference data. Data of
+                sensors not in the IMU model are not used.
+        rng: a sim_rng.RunRng of this run.
+    Returns:
+        a dict of sensor data, keys are data names.
+    '''
+    # random numbers of all sensors are drawn in one block
+    rng.reserve(sensor_noise_count(ctx))
+    imu = ctx['imu']
+    data = {}
+    data['accel'] = pathgen.acc_gen(ctx['fs'], ctx['ref_accel'], imu.accel_err,
+                                    ctx['vib_def'], rng)
+    data['gyro'] = pathgen.gyro_gen(ctx['fs'], ctx['ref_gyro'], imu.gyro_err, rng)
+    if imu.gps:
+        data['gps'] = pathgen.gps_gen(ctx['ref_gps'], imu.gps_err, ctx['ref_frame'], rng)
+    if imu.magnetometer:
+        data['mag'] = pathgen.mag_gen(ctx['ref_mag'], imu.mag_err, rng)
+    if imu.odo:
+        data['odo'] = pathgen.odo_gen(ctx['ref_odo'], imu.odo_err, rng)
+    return data
+
+def _init_sensor_worker(ctx):
+    '''
+    Keep the reference data and error models in a worker process. Reference data in shared
+    memory are attached without copying.
+    '''
+    global _sensor_ctx
+    _sensor_ctx = {}
+    for i in ctx:
+        _sensor_ctx[i] = shared_data.resolve(ctx[i])
+
+def _gen_sensor_data_worker(rng):
+    '''
+    Generate sensor data of one simulation run in a worker process.
+    '''
+    return gen_sensor_data(_sensor_ctx, rng)
+
 class Sim(object):
     '''
     INS simulation engine.
     '''
     def __init__(self, fs, motion_def, ref_frame=0, imu=None,\
-                 mode=None, env=None, algorithm=None):
+                 mode=None, env=None, algorithm=None, backend='loop', traj_cache=False,\
+                 integration='euler', seed=None, rng=None, csv_sidecar=False):
         '''
         Args:
             fs: [fs_imu, fs_gps, fs_mag], Hz.
@@ -114,6 +198,52 @@ class Sim(object):
 
             algorithm: a user defined algorithm or list of algorithms. If there are multiple
                 algorithms, all algorithms should have the same input and output.
+
+            backend: trajectory generation engine used when sensor data are generated from a
+                motion definition file.
+                'loop': pathgen.path_gen, the reference step-by-step engine (default).
+                'vectorized': pathgen_vec.path_gen_vec, which processes each motion segment
+                    in bulk and calculates true sensor output in batch. It is tens of times
+                    faster and its output agrees with 'loop' to floating-point rounding (see
+                    pathgen_vec.path_gen_vec for the tolerance).
+
+            traj_cache: on-disk cache of the reference trajectory generated from a motion
+                definition file. The reference trajectory is deterministic, and is loaded from
+                the cache if it has been generated with the same initial states, motion
+                definition, sample rates, mode, reference frame, magnetometer flag, backend,
+                integration scheme and library version.
+                False or None: do not use the cache (default).
+                True: use the default cache, which writes up to 1 GB of files in
+                    ~/.cache/gnss_ins_sim/traj. See traj_cache.TrajCache.
+                a TrajCache object: use the specified cache.
+
+            integration: numerical integration scheme of the reference trajectory generated
+                from a motion definition file. The simulation runs at the IMU sample rate.
+                'euler': forward Euler (default).
+                'rk4': 4th-order Runge-Kutta. The position error of the reference trajectory is
+                    several orders of magnitude smaller, and the reference IMU output is the
+                    average over each sample period. See pathgen.path_gen for details.
+
+            seed: seed of the sensor errors, an int or anything accepted by
+                numpy.random.SeedSequence. Each simulation run generates its sensor errors by its
+                own random number generator spawned from the seed, so that results of a run only
+                depend on the seed and the run index, no matter how many workers are used.
+                None means the seed is drawn from the global numpy.random, so numpy.random.seed
+                can still be used to reproduce results.
+
+            rng: a sim_rng.SimRng object to generate the sensor errors. seed is ignored if rng
+                is not None. A SimRng can draw float32 random numbers, use another bit generator,
+                or be shared by several Sim objects to compare configurations with common
+                random numbers. None means SimRng(seed).
+
+            csv_sidecar: when data are loaded from .csv files, save the data of each file in a
+                .npy sidecar on first load, and memory-map the sidecar on later loads if the
+                .csv file is unchanged. Sidecars are never written next to the .csv files. See
+                csv_loader.load_csv.
+                False or None: always read the .csv files (default).
+                True: save sidecars in ~/.cache/gnss_ins_sim/csv. They take about as much
+                    space as the data.
+                a directory name: save sidecars in the specified directory.
         '''
         # version info of gnss-ins-sim
         self.name = NAME
@@ -123,12 +253,47 @@ class Sim(object):
         self.imu = imu
         self.mode = mode
         self.env = env
+        if backend == 'loop':
+            self.path_gen = pathgen.path_gen
+        elif backend == 'vectorized':
+            self.path_gen = pathgen_vec.path_gen_vec
+        else:
+            raise ValueError("backend should be 'loop' or 'vectorized', but got %s." % backend)
+        self.backend = backend
+        if integration not in pathgen.INTEGRATION_SCHEMES:
+            raise ValueError("integration should be one of %s, but got %s."\
+                             % (pathgen.INTEGRATION_SCHEMES, integration))
+        self.integration = integration
+        self.seed = seed
+        if rng is None:
+            self.rng = SimRng(seed)
+        elif isinstance(rng, SimRng):
+            self.rng = rng
+        else:
+            raise TypeError('rng should be None or a SimRng object.')
+        if traj_cache is True:
+            self.traj_cache = TrajCache()
+        elif traj_cache is False or traj_cache is None:
+            self.traj_cache = None
+        elif isinstance(traj_cache, TrajCache):
+            self.traj_cache = traj_cache
+        else:
+            raise TypeError('traj_cache should be True, False, None or a TrajCache object.')
+        if csv_sidecar is True:
+            self.csv_sidecar = csv_loader.DEFAULT_SIDECAR_DIR
+        elif csv_sidecar is False or csv_sidecar is None:
+            self.csv_sidecar = None
+        elif isinstance(csv_sidecar, str):
+            self.csv_sidecar = csv_sidecar
+        else:
+            raise TypeError('csv_sidecar should be True, False, None or a directory name.')
         if ref_frame == 0 or ref_frame == 1:
             self.ref_frame = ref_frame
         else:
             self.ref_frame = 0      # default frame is NED
         # simulation status
         self.sim_count = 1          # simulation count
+        self.workers = 1            # number of worker processes to generate sensor data
         self.sim_complete = False   # simulation complete successfully
         self.sim_results = False    # simulation results is generated
         # simulation data manager
@@ -154,15 +319,24 @@ class Sim(object):
         # summary
         self.sum = ''
 
-    def run(self, num_times=1):
+    def run(self, num_times=1, workers=None):
         '''
         run simulation.
         Args:
             num_times: run the simulation for num_times times with given IMU error model.
+            workers: number of worker processes to generate sensor data of the runs and to run
+                the algorithms. None or 1 means everything is done in this process. Results
+                are the same for any number of workers. See InsAlgoMgr.run_algo.
         '''
         self.sim_count = int(num_times)
         if self.sim_count < 1:
             self.sim_count = 1
+        if workers is None:
+            workers = 1
+        workers = int(workers)
+        if workers < 1:
+            raise ValueError('workers should be a positive integer, but got %s.'% workers)
+        self.workers = workers
 
         #### generate sensor data from file or pathgen
         self.__gen_data()
@@ -173,8 +347,13 @@ class Sim(object):
             self.dmgr.set_algo_output(self.amgr.output)
             # get algo input data
             algo_input = self.dmgr.get_data(self.amgr.input)
+            # input data shared by all runs are attached by worker processes
+            shared_input = None
+            if self.workers > 1:
+                shared_input = self.dmgr.share_data(self.amgr.input)
             # run the algo and get algo output
-            algo_output = self.amgr.run_algo(algo_input, range(self.sim_count))
+            algo_output = self.amgr.run_algo(algo_input, range(self.sim_count), self.workers,
+                                             shared_input)
             # add algo output to ins_data_manager
             for i in range(len(self.amgr.output)):
                 self.dmgr.add_data(self.amgr.output[i], algo_output[i])
@@ -208,8 +387,8 @@ class Sim(object):
                 is -1, end-point error statistics will be calculated. Any other negative value
                 will be the same as 0. If err_stats_start exceeds the max number of data points,
                 it will be converted to 0.
-            gen_kml: True to generate two .kml files containing the reference position and the
-                    simulation position (output by algorithms), respectively.
+            gen_kml: True to generate a .kmz file containing the reference position, the GPS
+                    position and the simulation position (output by algorithms) of all runs.
             extra_opt: Extra options to generate the results. It can be a string option to
                 calculate errors. The following options are supported:
                     'ned': NED position error.
@@ -223,7 +402,7 @@ class Sim(object):
                 # save data files
                 data_saved = self.dmgr.save_data(data_dir)
 
-            #### generate .kml files
+            #### generate .kmz file
             if gen_kml is True:       # want to gen kml without specifying the data_dir
                 if data_dir is None:
                     data_dir = ''
@@ -423,11 +602,9 @@ class Sim(object):
         for i in os.listdir(self.data_src):
             data_name, data_key = self.__get_data_name_and_key(i)
             if self.dmgr.is_supported(data_name):
-                full_file_name = self.data_src + '//' + i
-                # read data in file
-                data = np.genfromtxt(full_file_name, delimiter=',', skip_header=1)
-                # get data units in file
-                units = self.__get_data_units(full_file_name)
+                full_file_name = os.path.join(self.data_src, i)
+                # read data and units in file
+                data, units = csv_loader.load_csv(full_file_name, self.csv_sidecar)
                 # see if position info mathes reference frame
                 if data_name == self.dmgr.ref_pos.name or data_name == self.dmgr.pos.name:
                     data, units = self.__convert_pos(data, units, self.dmgr.ref_frame.data)
@@ -454,43 +631,81 @@ class Sim(object):
         # sim mode-->vehicle maneuver capability
         mobility = self.__parse_mode(self.mode)
 
-        # generate reference data and add data to ins_data_manager
-        rtn = pathgen.path_gen(ini_pva, motion_def, output_def, mobility,
-                               self.ref_frame, self.imu.magnetometer)
-        self.dmgr.add_data(self.dmgr.time.name, rtn['nav'][:, 0] / self.fs[0])
-        self.dmgr.add_data(self.dmgr.ref_pos.name, rtn['nav'][:, 1:4])
-        self.dmgr.add_data(self.dmgr.ref_vel.name, rtn['nav'][:, 4:7])
-        self.dmgr.add_data(self.dmgr.ref_att_euler.name, rtn['nav'][:, 7:10])
-        self.dmgr.add_data(self.dmgr.ref_accel.name, rtn['imu'][:, 1:4])
-        self.dmgr.add_data(self.dmgr.ref_gyro.name, rtn['imu'][:, 4:7])
+        # generate reference data or load it from cache, and add data to ins_data_manager
+        rtn = None
+        # the geomagnetic field depends on the epoch (today) and the tolerance of the cache
+        mag_cache = geomag_cache.get_cache() if self.imu.magnetometer else None
+        if self.traj_cache is not None:
+            # make the key before path_gen, which modifies motion_def and output_def
+            cache_key = self.traj_cache.make_key(ini_pva, motion_def, output_def, mobility,
+                                                 self.ref_frame, self.imu.magnetometer,
+                                                 self.backend, self.integration,
+                                                 self.version, mag_cache)
+            rtn = self.traj_cache.load(cache_key)
+        if rtn is None:
+            rtn = self.path_gen(ini_pva, motion_def, output_def, mobility,
+                                self.ref_frame, self.imu.magnetometer, implicit_index=True,
+                                integration=self.integration, mag_cache=mag_cache)
+            if self.traj_cache is not None:
+                self.traj_cache.save(cache_key, rtn)
+        # sample index of the k-th row is start + k*step
+        index = rtn['index']['imu']
+        n = rtn['nav'].shape[0]
+        self.dmgr.add_data(self.dmgr.time.name,
+                           (index[0] + index[1]*np.arange(n)) / self.fs[0])
+        self.dmgr.add_data(self.dmgr.ref_pos.name, rtn['nav'][:, 0:3])
+        self.dmgr.add_data(self.dmgr.ref_vel.name, rtn['nav'][:, 3:6])
+        self.dmgr.add_data(self.dmgr.ref_att_euler.name, rtn['nav'][:, 6:9])
+        self.dmgr.add_data(self.dmgr.ref_accel.name, rtn['imu'][:, 0:3])
+        self.dmgr.add_data(self.dmgr.ref_gyro.name, rtn['imu'][:, 3:6])
         if self.imu.gps:
-            self.dmgr.add_data(self.dmgr.gps_time.name, rtn['gps'][:, 0] / self.fs[0])
-            self.dmgr.add_data(self.dmgr.ref_gps.name, rtn['gps'][:, 1:7])
-            self.dmgr.add_data(self.dmgr.gps_visibility.name, rtn['gps'][:, 7])
+            index = rtn['index']['gps']
+            n = rtn['gps'].shape[0]
+            self.dmgr.add_data(self.dmgr.gps_time.name,
+                               (index[0] + index[1]*np.arange(n)) / self.fs[0])
+            self.dmgr.add_data(self.dmgr.ref_gps.name, rtn['gps'][:, 0:6])
+            self.dmgr.add_data(self.dmgr.gps_visibility.name, rtn['gps'][:, 6])
         if self.imu.magnetometer:
-            self.dmgr.add_data(self.dmgr.ref_mag.name, rtn['mag'][:, 1:4])
+            self.dmgr.add_data(self.dmgr.ref_mag.name, rtn['mag'][:, 0:3])
         if self.imu.odo:
-            self.dmgr.add_data(self.dmgr.ref_odo.name, rtn['odo'][:, 2])
+            self.dmgr.add_data(self.dmgr.ref_odo.name, rtn['odo'][:, 1])
         # generate sensor data
         # environment-->vibraition params
         vib_def = self.__parse_env(self.env)
-        for i in range(self.sim_count):
-            accel = pathgen.acc_gen(self.fs[0], self.dmgr.ref_accel.data,
-                                    self.imu.accel_err, vib_def)
-            self.dmgr.add_data(self.dmgr.accel.name, accel, key=i)
-            gyro = pathgen.gyro_gen(self.fs[0], self.dmgr.ref_gyro.data,\
-                                    self.imu.gyro_err)
-            self.dmgr.add_data(self.dmgr.gyro.name, gyro, key=i)
-            if self.imu.gps:
-                gps = pathgen.gps_gen(self.dmgr.ref_gps.data, self.imu.gps_err,\
-                                                   self.ref_frame)
-                self.dmgr.add_data(self.dmgr.gps.name, gps, key=i)
-            if self.imu.magnetometer:
-                mag = pathgen.mag_gen(self.dmgr.ref_mag.data, self.imu.mag_err)
-                self.dmgr.add_data(self.dmgr.mag.name, mag, key=i)
-            if self.imu.odo:
-                odo = pathgen.odo_gen(self.dmgr.ref_odo.data, self.imu.odo_err)
-                self.dmgr.add_data(self.dmgr.odo.name, odo, key=i)
+        ctx = {'fs': self.fs[0], 'ref_frame': self.ref_frame, 'imu': self.imu,
+               'vib_def': vib_def,
+               'ref_accel': self.dmgr.ref_accel.data, 'ref_gyro': self.dmgr.ref_gyro.data}
+        if self.imu.gps:
+            ctx['ref_gps'] = self.dmgr.ref_gps.data
+        if self.imu.magnetometer:
+            ctx['ref_mag'] = self.dmgr.ref_mag.data
+        if self.imu.odo:
+            ctx['ref_odo'] = self.dmgr.ref_odo.data
+        # each run has its own random number generator
+        rngs = self.rng.spawn(self.sim_count)
+        if self.workers == 1 or self.sim_count == 1:
+            results = (gen_sensor_data(ctx, i) for i in rngs)
+            self.__add_sensor_data(results)
+        else:
+            # workers attach reference data in shared memory instead of receiving copies
+            ctx.update(self.dmgr.share_data([i for i in ctx if i.startswith('ref_')]))
+            workers = min(self.workers, self.sim_count)
+            chunksize = max(1, self.sim_count // (4*workers))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_sensor_worker,
+                                     initargs=(ctx,)) as executor:
+                results = executor.map(_gen_sensor_data_worker, rngs, chunksize=chunksize)
+                self.__add_sensor_data(results)
+
+    def __add_sensor_data(self, results):
+        '''
+        Add sensor data of each run to ins_data_manager.
+        Args:
+            results: an iterable of the output of gen_sensor_data of each run, in run order.
+        '''
+        for i, data in enumerate(results):
+            for name in ['accel', 'gyro', 'gps', 'mag', 'odo']:
+                if name in data:
+                    self.dmgr.add_data(name, data[name], key=i)
 
     def __get_data_name_and_key(self, file_name):
         '''
@@ -520,30 +735,6 @@ class Sim(object):
                     data_key = int(data_key)
         return data_name, data_key
 
-    def __get_data_units(self, file_name):
-        '''
-        Get data units in file. Units information should be provided in the first row.
-        Args:
-            file_name: full file name
-        Returns:
-            units: a list of units corresponding to each column in the file. If not untis
-                found, units is None.
-        '''
-        units = None
-        fp = open(file_name)
-        line = fp.readline()
-        fp.close()
-        line = line.split(',')
-        tmp_units = []
-        for i in line:
-            left_bracket = i.find('(')
-            right_bracket = i.rfind(')')
-            if left_bracket != -1 and right_bracket != -1 and right_bracket > left_bracket:
-                tmp_units.append(i[left_bracket+1:right_bracket])
-        if len(tmp_units) == len(line):
-            units = tmp_units
-        return units
-
     def __data_from_algo_output(self, data_name):
         '''
         Check if data corresponding to data_name are from algo output or associated
@@ -671,13 +862,15 @@ class Sim(object):
             if env.ndim == 2 and env.shape[1] == 4: # env is a np.array of size (n,4)
                 vib_def['type'] = 'psd'
                 n = env.shape[0]
-                half_fs = 0.5*self.fs.data
+                half_fs = 0.5*self.fs[0]
                 if env[-1, 0] > half_fs:
                     n = np.where(env[:, 0] > half_fs)[0][0]
                 vib_def['freq'] = env[:n, 0]
                 vib_def['x'] = env[:n, 1]
                 vib_def['y'] = env[:n, 2]
                 vib_def['z'] = env[:n, 3]
+                # shaping filters are designed once for all runs
+                vib_def = pathgen.psd_vib_filter(vib_def, self.fs[0])
             else:
                 raise TypeError('env should be of size (n,2)')
         else:
@@ -712,43 +905,28 @@ class Sim(object):
 
     def __add_associated_data_to_results(self):
         '''
-        Check if some data in self.res have associated data. If so, calculate the associated data
-        and add the data in self.res.
-        For example, pathgen generates Euler angles, this procedure will calculate the
-        coresponding quaternions and add those in self.res.
+        Check if some data in self.res have associated data. If so, add the associated data
+        in self.res. The associated data are calculated only when they are first accessed.
+        For example, pathgen generates Euler angles, and the coresponding quaternions will be
+        calculated when they are requested, plotted or saved.
         '''
         for i in self.data_map:
             # data available and its associated data are supported
             src_name = self.data_map[i][0]
-            if src_name in self.dmgr.available and self.dmgr.is_supported(i):
-                src_data = self.dmgr.get_data([src_name])[0]
-                # src_data is a dict, add associated data of all keys
-                if isinstance(src_data, dict):
-                    for key in src_data:
-                        if not self.dmgr.is_available(i, key):
-                            self.dmgr.add_data(i, self.data_map[i][1](src_data[key]), key)
-                else:
-                    if not self.dmgr.is_available(i):
-                        self.dmgr.add_data(i, self.data_map[i][1](src_data))
+            if src_name in self.dmgr.available and self.dmgr.is_supported(i) and\
+               not self.dmgr.is_available(i):
+                self.dmgr.add_associated_data(i, src_name, self.data_map[i][1])
 
     def __quat2euler_zyx(self, src):
         '''
         quaternion to Euler angles (zyx)
         '''
         if isinstance(src, np.ndarray):
-            n = src.shape[0]
-            dst = np.zeros((n, 3))
-            for j in range(n):
-                dst[j, :] = attitude.quat2euler(src[j, :])
-            return dst
+            return attitude.quat2euler_batch(src)
         elif isinstance(src, dict):
             dst = {}
             for i in src:
-                n = src[i].shape[0]
-                euler = np.zeros((n, 3))
-                for j in range(n):
-                    euler[j, :] = attitude.quat2euler(src[i][j, :])
-                dst[i] = euler
+                dst[i] = attitude.quat2euler_batch(src[i])
             return dst
         else:
             raise ValueError('%s is not a dict or numpy array.'% src.name)
@@ -759,20 +937,12 @@ class Sim(object):
         '''
         # array
         if isinstance(src, np.ndarray):
-            n = src.shape[0]
-            dst = np.zeros((n, 4))
-            for j in range(n):
-                dst[j, :] = attitude.euler2quat(src[j, :])
-            return dst
-        # dict557
+            return attitude.euler2quat_batch(src)
+        # dict
         elif isinstance(src, dict):
             dst = {}
             for i in src:
-                n = src[i].shape[0]
-                quat = np.zeros((n, 4))
-                for j in range(n):
-                    quat[j, :] = attitude.euler2quat(src[i][j, :])
-                dst[i] = quat
+                dst[i] = attitude.euler2quat_batch(src[i])
             return dst
         else:
             raise ValueError('%s is not a dict or numpy array.'% src.name)
@@ -794,18 +964,16 @@ class Sim(object):
             # deg to rad
             if units == ['deg', 'deg', 'm']:
                 units = ['rad', 'rad', 'm']
+                # data loaded from a sidecar are read-only
+                data = np.array(data)
                 data[:, 0] = data[:, 0] * attitude.D2R
                 data[:, 1] = data[:, 1] * attitude.D2R
             # lla2ned
             if units == ['rad', 'rad', 'm']:
                 units = ['m', 'm', 'm']
-                # relative motion in ECEF
-                data = geoparams.lla2ecef_batch(data)
-                ini_pos_ecef = data[0, :]   # initial ECEF position
-                data = data - ini_pos_ecef
-                # relative motion in ECEF to NED, NED defined by first LLA
-                c_ne = attitude.ecef_to_ned(data[0, 0], data[0, 1])
-                data = data.dot(c_ne.T)
+                # relative motion in NED, NED defined by first LLA
+                ini_pos_ecef = geoparams.lla2ecef(data[0, :])   # initial ECEF position
+                data = geoparams.lla2ned_batch(data, data[0, :])
                 data = data + ini_pos_ecef
         elif ref_frame == 0:
             # ned2lla or ecef2lla
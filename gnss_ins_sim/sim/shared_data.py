@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Filename: shared_data.py
+
+"""
+Numpy arrays in shared memory for worker processes.
+The owner process publishes an array to a block of shared memory and gets a handle. The handle
+is small and can be sent to worker processes, where it is attached as a read-only view of the
+shared memory without copying the data.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+from multiprocessing import shared_memory
+import numpy as np
+
+# shared memory blocks attached in this process, kept open while the views are used
+_attached = {}
+
+class SharedArray(object):
+    '''
+    Handle of a numpy array in shared memory.
+    '''
+    def __init__(self, shm_name, shape, dtype):
+        '''
+        Args:
+            shm_name: name of the shared memory block.
+            shape: shape of the array.
+            dtype: data type of the array.
+        '''
+        self.shm_name = shm_name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+
+    def attach(self):
+        '''
+        Attach the array in this process.
+        Returns:
+            a read-only numpy array backed by the shared memory.
+        '''
+        if self.shm_name not in _attached:
+            _attached[self.shm_name] = shared_memory.SharedMemory(name=self.shm_name)
+        x = np.ndarray(self.shape, dtype=self.dtype, buffer=_attached[self.shm_name].buf)
+        x.flags.writeable = False
+        return x
+
+def resolve(x):
+    '''
+    Attach x if it is a SharedArray.
+    Args:
+        x: a SharedArray or any other object.
+    Returns:
+        the attached array if x is a SharedArray, otherwise x.
+    '''
+    if isinstance(x, SharedArray):
+        return x.attach()
+    return x
+
+class SharedArrays(object):
+    '''
+    Arrays published to shared memory by the owner process. Shared memory blocks are removed
+    when close is called.
+    '''
+    def __init__(self):
+        self.blocks = {}    # name: [shared memory block, handle, version of the data]
+
+    def publish(self, name, x, version=None):
+        '''
+        Copy an array to shared memory. If an array of the same name and version has been
+        published, it is reused. Otherwise, the old block of the name is removed.
+        Args:
+            name: name of the array.
+            x: a numpy array.
+            version: version of the array, see sim_data.Sim_data.
+        Returns:
+            a SharedArray handle.
+        '''
+        if name in self.blocks:
+            if version is not None and self.blocks[name][2] == version:
+                return self.blocks[name][1]
+            self.remove(name)
+        x = np.asarray(x)
+        # a shared memory block cannot be empty
+        shm = shared_memory.SharedMemory(create=True, size=max(x.nbytes, 1))
+        y = np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf)
+        y[...] = x
+        handle = SharedArray(shm.name, x.shape, x.dtype)
+        self.blocks[name] = [shm, handle, version]
+        return handle
+
+    def remove(self, name):
+        '''
+        Remove the shared memory block of an array.
+        Args:
+            name: name of the array.
+        '''
+        shm = self.blocks.pop(name)[0]
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        '''
+        Remove all shared memory blocks.
+        '''
+        for name in list(self.blocks.keys()):
+            self.remove(name)
@@ -73,8 +73,53 @@ class Sim_data(object):
         n is the sample number, dim is a set of data at time tn. For example, accel is nx3,
         att_quat is nx4, allan_t is (n,)
         '''
+        # version of self.data, increased each time self.data is changed
+        self.version = 0
+        # associated data are calculated from a source Sim_data on first access, see set_source
+        self.source = None
+        self.func = None
+        self.source_version = None
         self.data = {}
 
+    @property
+    def data(self):
+        '''
+        Data of this Sim_data. If this is associated data of a source Sim_data, it is calculated
+        from the source data when first accessed or when the source data have changed.
+        '''
+        if self.source is not None and self.source_version != self.source.version:
+            src_data = self.source.data
+            if isinstance(src_data, dict):
+                self.__data = {}
+                for i in src_data:
+                    self.__data[i] = self.func(src_data[i])
+            else:
+                self.__data = self.func(src_data)
+            self.source_version = self.source.version
+            self.version += 1
+        return self.__data
+
+    @data.setter
+    def data(self, data):
+        self.__data = data
+        self.version += 1
+        # explicitly set data are no longer associated data
+        self.source = None
+
+    def set_source(self, source, func):
+        '''
+        Make this Sim_data associated data of another Sim_data. Data are not calculated here,
+        but on first access of self.data, and are recalculated if the source data change.
+        Args:
+            source: source Sim_data.
+            func: a function to calculate this data from the source data. If the source data
+                are a dict, func is applied to each value in the dict.
+        '''
+        self.__data = {}
+        self.source = source
+        self.func = func
+        self.source_version = None
+
     def add_data(self, data, key=None, units=None):
         '''
         Add data to Sim_data.
@@ -113,6 +158,8 @@ class Sim_data(object):
             if not isinstance(self.data, dict):
                 self.data = {}
             self.data[key] = data
+            self.version += 1
+            self.source = None
 
     def save_to_file(self, data_dir):
         '''
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Filename: sim_rng.py
+
+"""
+Random number generation of sensor errors.
+A SimRng is owned by a Sim object and spawns one RunRng for each simulation run. A RunRng draws
+the normal random numbers of all sensors of a run in one block and hands out consecutive pieces
+of the block, which gives the same numbers as drawing them one by one from the generator.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+import numpy as np
+
+# supported data types of random numbers
+RNG_DTYPES = ['float64', 'float32']
+
+class RunRng(object):
+    '''
+    Random number generator of one simulation run. It provides standard_normal like
+    numpy.random.Generator and can be passed to the rng argument of pathgen functions.
+    '''
+    def __init__(self, seed_seq, dtype='float64', bit_generator=None):
+        '''
+        Args:
+            seed_seq: a numpy.random.SeedSequence of this run.
+            dtype: data type of the random numbers, 'float64' or 'float32'.
+            bit_generator: a numpy.random.BitGenerator class. None means numpy.random.PCG64.
+        '''
+        self.seed_seq = seed_seq
+        self.dtype = dtype
+        self.bit_generator = bit_generator
+        # the generator is created when first used, so that a RunRng sent to a worker process
+        # only carries its seed
+        self.generator = None
+        self.block = None
+        self.pos = 0
+
+    def get_generator(self):
+        '''
+        Returns:
+            the numpy.random.Generator of this run.
+        '''
+        if self.generator is None:
+            bit_generator = np.random.PCG64 if self.bit_generator is None else self.bit_generator
+            self.generator = np.random.Generator(bit_generator(self.seed_seq))
+        return self.generator
+
+    def reserve(self, count):
+        '''
+        Draw count standard normal random numbers in one block. They are used by subsequent
+        calls of standard_normal. Random numbers left in the previous block are discarded.
+        Args:
+            count: number of random numbers.
+        '''
+        self.block = self.get_generator().standard_normal(count, dtype=self.dtype)
+        self.pos = 0
+
+    def standard_normal(self, size=None):
+        '''
+        Standard normal random numbers, taken from the reserved block first and then from the
+        generator.
+        Args:
+            size: an int or a tuple of ints, shape of the output. None means a single value.
+        Returns:
+            an array of the given size, or a float if size is None.
+        '''
+        if size is None:
+            return self.standard_normal(1)[0]
+        shape = (size,) if np.isscalar(size) else tuple(size)
+        n = int(np.prod(shape))
+        left = 0 if self.block is None else self.block.shape[0] - self.pos
+        if left >= n:
+            x = self.block[self.pos:self.pos+n]
+            self.pos += n
+        else:
+            x = self.get_generator().standard_normal(n-left, dtype=self.dtype)
+            if left > 0:
+                x = np.concatenate([self.block[self.pos:], x])
+            self.block = None
+            self.pos = 0
+        return x.reshape(shape)
+
+class SimRng(object):
+    '''
+    Random number generation of the simulation. Runs spawned from the same seed get the same
+    random numbers, so a SimRng with a fixed seed can be shared by several Sim objects to
+    compare configurations with common random numbers.
+    '''
+    def __init__(self, seed=None, dtype='float64', bit_generator=None):
+        '''
+        Args:
+            seed: an int or anything accepted by numpy.random.SeedSequence. None means the seed
+                is drawn from the global numpy.random each time runs are spawned, so
+                numpy.random.seed can be used to reproduce results.
+            dtype: data type of the random numbers, 'float64' or 'float32'. float32 is faster
+                to generate, and its precision is enough for sensor noise.
+            bit_generator: a numpy.random.BitGenerator class, for example numpy.random.Philox.
+                None means numpy.random.PCG64.
+        '''
+        if dtype not in RNG_DTYPES:
+            raise ValueError('dtype should be one of %s, but got %s.'% (RNG_DTYPES, dtype))
+        self.seed = seed
+        self.dtype = dtype
+        self.bit_generator = bit_generator
+
+    def spawn(self, count):
+        '''
+        Spawn random number generators of simulation runs. The generator of the i-th run only
+        depends on the seed and i.
+        Args:
+            count: number of runs.
+        Returns:
+            a list of RunRng objects.
+        '''
+        seed = self.seed
+        if seed is None:
+            seed = np.random.randint(0, 2**31, size=4)
+        return [RunRng(i, self.dtype, self.bit_generator)\
+                for i in np.random.SeedSequence(seed).spawn(count)]
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Filename: traj_cache.py
+
+"""
+On-disk cache of reference trajectories generated by path_gen.
+The reference trajectory is determined by the initial states, the motion definition, the output
+definition, the vehicle mobility, the reference frame, the magnetometer flag, the trajectory
+generation engine, the integration scheme and the library version. With the magnetometer, it
+also depends on the epoch and the tolerance of the geomagnetic field. A hash of them is used as
+the key, and the path_gen results are saved as a compressed .npz file named by the key.
+Created on 2026-10-18
+@author: dongxiaoguang
+"""
+
+import os
+import hashlib
+import zipfile
+import numpy as np
+
+# cache format version, change it when the content of the cache files changes
+CACHE_VERSION = '2'
+# default cache directory and max total size of cache files
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gnss_ins_sim', 'traj')
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024       # bytes
+# outputs of path_gen
+TRAJ_DATA = ['imu', 'nav', 'mag', 'gps', 'odo']
+
+class TrajCache(object):
+    '''
+    A size bounded on-disk cache of reference trajectories. When the total size of cache files
+    exceeds max_size, least recently used files are removed.
+    '''
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        '''
+        Args:
+            cache_dir: directory to store cache files. None means DEFAULT_CACHE_DIR.
+            max_size: max total size of cache files, bytes.
+        '''
+        if cache_dir is None:
+            cache_dir = DEFAULT_CACHE_DIR
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def make_key(self, ini_pos_vel_att, motion_def, output_def, mobility, ref_frame, magnet,
+                 backend, integration, version, mag_cache=None):
+        '''
+        Generate the key of a reference trajectory. This should be called before path_gen,
+        which modifies motion_def and output_def.
+        Args:
+            ini_pos_vel_att, motion_def, output_def, mobility, ref_frame, magnet: input of
+                path_gen. See pathgen.path_gen.
+            backend: name of the trajectory generation engine.
+            integration: integration scheme of path_gen.
+            version: library version.
+            mag_cache: the geomag_cache.GeoMagTileCache passed to path_gen when magnet is True.
+                Its epoch and tolerance are part of the key.
+        Returns:
+            key: a hex string.
+        '''
+        h = hashlib.sha1()
+        h.update(('%s|%s|%s|%s|%s|%s|' % (CACHE_VERSION, version, backend, integration,
+                                          int(ref_frame), bool(magnet))).encode('utf-8'))
+        for i in [ini_pos_vel_att, motion_def, output_def, mobility]:
+            x = np.ascontiguousarray(i, dtype=np.float64)
+            h.update(str(x.shape).encode('utf-8'))
+            h.update(x.tobytes())
+        if magnet and mag_cache is not None:
+            h.update(('%r|%r|' % (float(mag_cache.time), float(mag_cache.tol))).encode('utf-8'))
+        return h.hexdigest()
+
+    def load(self, key):
+        '''
+        Load a reference trajectory from the cache.
+        Args:
+            key: key of the trajectory, see make_key.
+        Returns:
+            path_results in the same form as the output of path_gen with implicit_index=True,
+            or None if the trajectory is not in the cache.
+        '''
+        file_name = self.__file_name(key)
+        if not os.path.isfile(file_name):
+            return None
+        try:
+            with np.load(file_name) as data:
+                rtn = {'status': True, 'index': {}}
+                for i in TRAJ_DATA:
+                    rtn[i] = data[i] if i in data.files else []
+                for i in ['imu', 'gps']:
+                    if 'index_' + i in data.files:
+                        rtn['index'][i] = data['index_' + i].tolist()
+            # mark as recently used
+            os.utime(file_name, None)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            print('Cannot load cached trajectory %s, it will be regenerated.'% file_name)
+            return None
+        return rtn
+
+    def save(self, key, path_results):
+        '''
+        Save a reference trajectory to the cache, and remove least recently used files if the
+        total size of cache files exceeds max_size.
+        Args:
+            key: key of the trajectory, see make_key.
+            path_results: output of path_gen with implicit_index=True.
+        '''
+        data = {}
+        for i in TRAJ_DATA:
+            if len(path_results[i]) > 0:
+                data[i] = path_results[i]
+        for i in path_results['index']:
+            data['index_' + i] = np.array(path_results['index'][i])
+        file_name = self.__file_name(key)
+        tmp_file_name = file_name + '.%s.tmp' % os.getpid()
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # write to a temporary file and then rename it, so that a partially written
+            # file is never loaded
+            with open(tmp_file_name, 'wb') as f:
+                np.savez_compressed(f, **data)
+            os.replace(tmp_file_name, file_name)
+        except OSError:
+            print('Cannot save trajectory to cache directory %s.'% self.cache_dir)
+            if os.path.isfile(tmp_file_name):
+                os.remove(tmp_file_name)
+            return
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove least recently used files until the total size of cache files does not exceed
+        max_size.
+        '''
+        files = []
+        for i in os.listdir(self.cache_dir):
+            if i.endswith('.npz'):
+                file_name = os.path.join(self.cache_dir, i)
+                stat = os.stat(file_name)
+                files.append((stat.st_mtime, stat.st_size, file_name))
+        total_size = sum([i[1] for i in files])
+        for i in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(i[2])
+            except OSError:
+                continue
+            total_size -= i[1]
+
+    def clear(self):
+        '''
+        Remove all cache files.
+        '''
+        if not os.path.isdir(self.cache_dir):
+            return
+        for i in os.listdir(self.cache_dir):
+            if i.endswith('.npz'):
+                os.remove(os.path.join(self.cache_dir, i))
+
+    def __file_name(self, key):
+        '''
+        Cache file name of a key.
+        '''
+        return os.path.join(self.cache_dir, key + '.npz')